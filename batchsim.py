@@ -0,0 +1,325 @@
+# Headless engine stepping many independent matches at once - for bots training and powerups balancing.
+# It does not need pygame. Run as: python batchsim.py [matches] [players] to see its throughput.
+
+import sys
+import time
+import numpy as np
+import constants
+import torus
+
+POWERUPS = list(constants.Powerup) # powerups are stored as indexes of this list
+NONE = POWERUPS.index(constants.Powerup.NONE)
+WEIRD_WALKING = POWERUPS.index(constants.Powerup.WEIRD_WALKING)
+WALL_WALKING = POWERUPS.index(constants.Powerup.WALL_WALKING)
+CRUSHING = POWERUPS.index(constants.Powerup.CRUSHING)
+GHOSTING = POWERUPS.index(constants.Powerup.GHOSTING)
+
+# decisions are the same as decisionfunctions.Direction
+FORWARD, LEFT, RIGHT = 0, 1, 2
+
+class BatchEngine:
+    """
+    N matches kept in stacked arrays (first axis is the match, second one is the snake).
+    Rules follow simulation.game_loop with two simplifications which make it possible to step
+    everything at once: inside a tick all snakes move before any collision is resolved,
+    and tails follow heads the way gameobjects.TailArray does. Results are statistically
+    the same as in the game, but not identical.
+
+    Observation of every snake (see OBSERVATION_FIELDS) is a row of floats.
+    Reward is +1 for every eaten fruit and -death_penalty on the tick snake died.
+    """
+
+    OBSERVATION_FIELDS = (
+        "x", "y", # position relative to the board size
+        "direction_x", "direction_y",
+        "alive",
+        "length", # tail length relative to max_tail
+        "weird_walking", "crushing", "ghosting", # seconds left
+        "wall_walking", # seconds left, common for whole match
+        "fruit_dx", "fruit_dy", # nearest fruit (through the board edges too) relative to the board size
+    )
+    INITIAL_FRUITS = 6
+    FRUIT_EVENT_TIME = 5
+
+    def __init__(self, matches, players=4, width=1280, height=720, max_tail=128, max_fruits=32, max_walls=64,
+                 max_ticks=0, seed=None, auto_reset=True, death_penalty=1.0,
+                 powerup_probabilities=constants.POWERUP_PROBABILITIES, powerup_times=constants.POWERUP_TIMES):
+        """
+        :param max_ticks: matches are cut after that many ticks (0 - only when all snakes die)
+        :param auto_reset: finished matches start again at the end of step
+        :param powerup_probabilities: like constants.POWERUP_PROBABILITIES
+        :param powerup_times: like constants.POWERUP_TIMES
+        """
+        game = constants.Game()
+        self.matches = matches
+        self.players = players
+        self.max_tail = max_tail
+        self.max_ticks = max_ticks
+        self.auto_reset = auto_reset
+        self.death_penalty = death_penalty
+        self.diameter = game.diameter
+        self.r = game.diameter / 2
+        self.wall_r = game.diameter
+        self.base_speed = game.speed
+        self.base_rotation = game.rotation_power
+        self.time_limit = game.time_limit
+        self.dt = constants.TICK_SEC
+        self.board = torus.of_size(width, height)
+        self.size = self.board.size
+        self.rng = np.random.default_rng(seed)
+
+        self.powerup_codes = np.array([POWERUPS.index(p) for p in powerup_probabilities], dtype=int)
+        self.powerup_thresholds = np.cumsum(list(powerup_probabilities.values()))
+        self.powerup_times = np.zeros(len(POWERUPS))
+        for powerup, seconds in powerup_times.items():
+            self.powerup_times[POWERUPS.index(powerup)] = seconds
+
+        M, P = matches, players
+        self.heads = np.zeros((M, P, 2))
+        self.directions = np.zeros((M, P, 2))
+        self.alive = np.zeros((M, P), dtype=bool)
+        self.tails = np.zeros((M, P, max_tail, 2))
+        self.tail_lengths = np.zeros((M, P), dtype=int)
+        self.powerups = np.zeros((M, P, len(POWERUPS))) # seconds left
+        self.scores = np.zeros((M, P), dtype=int)
+        self.fruits = np.zeros((M, max_fruits, 2))
+        self.fruit_powerups = np.zeros((M, max_fruits), dtype=int)
+        self.fruit_active = np.zeros((M, max_fruits), dtype=bool)
+        self.walls = np.zeros((M, max_walls, 2))
+        self.wall_active = np.zeros((M, max_walls), dtype=bool)
+        self.time_passed = np.zeros(M)
+        self.fruit_event_timer = np.zeros(M)
+        self.wall_event_timer = np.zeros(M)
+        self.wall_walking_event_timer = np.zeros(M)
+        self.speed = np.zeros(M)
+        self.rotation_power = np.zeros(M)
+        self.ticks = np.zeros(M, dtype=int)
+
+        # statistics for balancing
+        self.eaten = np.zeros(len(POWERUPS), dtype=int) # fruits eaten so far by powerup
+        self.finished_scores = np.zeros((M, P), dtype=int) # scores of the last finished match
+        self.finished_ticks = np.zeros(M, dtype=int) # length of the last finished match
+
+        self.reset()
+
+    def reset(self, matches=None) -> np.ndarray:
+        """
+        Starts new matches.
+        :param matches: boolean mask of matches to reset (all if not given)
+        :return: observations
+        """
+        m = np.ones(self.matches, dtype=bool) if matches is None else np.asarray(matches, dtype=bool)
+        k = int(m.sum())
+        if k:
+            P = self.players
+            self.heads[m] = self.rng.random((k, P, 2)) * self.size * 0.6 + self.size * 0.2
+            directions = self.rng.random((k, P, 2)) + 1e-9
+            self.directions[m] = directions / np.linalg.norm(directions, axis=2, keepdims=True)
+            self.alive[m] = True
+            self.tail_lengths[m] = 0
+            self.powerups[m] = 0
+            self.scores[m] = 0
+            self.fruit_active[m] = False
+            self.fruit_active[np.ix_(m, np.arange(self.INITIAL_FRUITS))] = True
+            self.fruits[m] = self.rng.random((k, self.fruits.shape[1], 2)) * self.size
+            self.fruit_powerups[m] = NONE
+            self.wall_active[m] = False
+            self.time_passed[m] = 0
+            self.fruit_event_timer[m] = 0
+            self.wall_event_timer[m] = 0
+            self.wall_walking_event_timer[m] = 0
+            self.speed[m] = self.base_speed
+            self.rotation_power[m] = self.base_rotation
+            self.ticks[m] = 0
+        return self.observations()
+
+    def step(self, decisions) -> tuple[np.ndarray, np.ndarray, np.ndarray]:
+        """
+        Advances all matches by one tick (constants.TICK_SEC).
+        :param decisions: array (matches, players) of FORWARD/LEFT/RIGHT
+        :return: observations (matches, players, len(OBSERVATION_FIELDS)), rewards (matches, players)
+            and dones (matches, players) - True for dead snakes and for all snakes of finished matches
+        """
+        decisions = np.asarray(decisions)
+        alive = self.alive
+        r = self.r
+        size = self.size
+        rewards = np.zeros(alive.shape)
+        distance = self.diameter * self.speed * self.dt # (M,)
+
+        # turn and move heads
+        turn = (decisions == RIGHT).astype(float) - (decisions == LEFT)
+        angle = np.radians(turn * (distance[:, None] * 180) / (self.rotation_power[:, None] * r * 3.14))
+        cos, sin = np.cos(angle), np.sin(angle)
+        dx, dy = self.directions[..., 0].copy(), self.directions[..., 1].copy()
+        self.directions[..., 0] = np.where(alive, dx * cos - dy * sin, dx)
+        self.directions[..., 1] = np.where(alive, dx * sin + dy * cos, dy)
+        self.heads += self.directions * (distance[:, None] * alive)[..., None]
+
+        self._follow(distance)
+
+        # fruits - every fruit goes to the first snake touching it
+        touching = self._touching(self.heads, self.fruits, 2 * r) & alive[..., None] & self.fruit_active[:, None]
+        eats = touching & (np.cumsum(touching, axis=1) == 1)
+        eaten = eats.sum(axis=2)
+        fruit_codes = np.broadcast_to(self.fruit_powerups[:, None], eats.shape)
+        for code in (WEIRD_WALKING, CRUSHING, GHOSTING):
+            self.powerups[..., code] += self.powerup_times[code] * (eats & (fruit_codes == code)).sum(axis=2)
+        self.wall_walking_event_timer += (self.powerup_times[WALL_WALKING] * (eats & (fruit_codes == WALL_WALKING)).sum(axis=(1, 2))
+                                          + self.powerup_times[CRUSHING] * (eats & (fruit_codes == CRUSHING)).sum(axis=(1, 2)))
+        self.eaten += np.bincount(self.fruit_powerups[eats.any(axis=1)], minlength=len(POWERUPS))
+        self._grow(eaten)
+        self.scores += eaten
+        rewards += eaten
+        fruits_to_add = eats.any(axis=1).sum(axis=1)
+        self.fruit_active &= ~eats.any(axis=1)
+
+        crushing = self.powerups[..., CRUSHING] > 0
+        ghosting = self.powerups[..., GHOSTING] > 0
+        died = np.zeros(alive.shape, dtype=bool)
+
+        # walls
+        hits = self._touching(self.heads, self.walls, r + self.wall_r) & alive[..., None] & self.wall_active[:, None]
+        self.wall_active &= ~(hits & crushing[..., None]).any(axis=1)
+        died |= hits.any(axis=2) & ~crushing & ~ghosting
+
+        # borders
+        outside = ((self.heads - r < 0) | (self.heads + r > size)).any(axis=2) & alive
+        passing = (self.wall_walking_event_timer[:, None] > 0) | ghosting
+        died |= outside & ~passing
+        self.heads = np.where((outside & passing)[..., None], self.heads % size, self.heads)
+
+        # tails and heads of others
+        others_alive = alive & ~died
+        reach = (2 * r) ** 2
+        players = np.arange(self.players)
+        used = self.tail_lengths.max(initial=0) # segments behind that are not used by any snake
+        segments = np.arange(used)
+        tail_valid = (segments < self.tail_lengths[..., None]) & others_alive[..., None] # (M, P, T)
+        not_neck = ~((players[:, None, None] == players[None, :, None]) & (segments < 3)) # (P, P, T)
+        d2 = ((self.heads[:, :, None, None] - self.tails[:, None, :, :used]) ** 2).sum(axis=-1) # (M, P, P, T)
+        hit_tails = ((d2 < reach) & tail_valid[:, None] & not_neck).any(axis=3)
+        d2 = ((self.heads[:, :, None] - self.heads[:, None]) ** 2).sum(axis=-1) # (M, P, P)
+        hit_heads = (d2 < reach) & others_alive[:, None] & (players[:, None] != players)
+        ghosts = ghosting[:, :, None] | ghosting[:, None]
+        died |= ((hit_tails | hit_heads) & ~ghosts).any(axis=2) & alive
+
+        died &= alive
+        self.alive &= ~died
+        rewards -= self.death_penalty * died
+
+        # timers
+        self.powerups = np.where(self.alive[..., None], np.maximum(0, self.powerups - self.dt), self.powerups)
+        self.time_passed += self.dt
+        self.fruit_event_timer += self.dt
+        self.wall_walking_event_timer = np.maximum(0, self.wall_walking_event_timer - self.dt)
+        fruit_event = self.fruit_event_timer > self.FRUIT_EVENT_TIME
+        fruits_to_add += fruit_event
+        self.fruit_event_timer[fruit_event] = 0
+        walls_to_add = np.zeros(self.matches, dtype=int)
+        if self.time_limit:
+            late = self.time_passed > self.time_limit
+            self.wall_event_timer[late] += self.dt
+            wall_event = late & (self.wall_event_timer > self.time_limit ** 2 / self.time_passed ** 2)
+            walls_to_add += wall_event
+            self.wall_event_timer[wall_event] = 0
+        self.speed = self.base_speed + 2 * np.floor(1 + self.time_passed / 10)
+        self.rotation_power = self.base_rotation + np.floor(self.time_passed / 10)
+
+        self._spawn(self.fruits, self.fruit_active, fruits_to_add, self.fruit_powerups)
+        self._spawn(self.walls, self.wall_active, walls_to_add)
+
+        self.ticks += 1
+        truncated = (self.ticks >= self.max_ticks) if self.max_ticks else np.zeros(self.matches, dtype=bool)
+        dones = ~self.alive | truncated[:, None]
+        finished = dones.all(axis=1)
+        if finished.any():
+            self.finished_scores[finished] = self.scores[finished]
+            self.finished_ticks[finished] = self.ticks[finished]
+            if self.auto_reset:
+                self.reset(finished)
+        return self.observations(), rewards, dones
+
+    def observations(self) -> np.ndarray:
+        offsets = self.board.displacements(self.heads[:, :, None], self.fruits[:, None]) # (M, P, F, 2)
+        d2 = np.where(self.fruit_active[:, None], (offsets ** 2).sum(axis=-1), np.inf)
+        nearest = np.take_along_axis(offsets, d2.argmin(axis=2)[..., None, None], axis=2)[:, :, 0]
+        nearest[np.isinf(d2.min(axis=2))] = 0
+        return np.concatenate((
+            self.heads / self.size,
+            self.directions,
+            self.alive[..., None],
+            self.tail_lengths[..., None] / self.max_tail,
+            self.powerups[..., [WEIRD_WALKING, CRUSHING, GHOSTING]],
+            np.broadcast_to(self.wall_walking_event_timer[:, None, None], self.alive.shape + (1,)),
+            nearest / self.size,
+        ), axis=2)
+
+    def _touching(self, heads, circles, reach) -> np.ndarray:
+        """ (M, P, N) mask of heads closer than reach to circles """
+        return ((heads[:, :, None] - circles[:, None]) ** 2).sum(axis=-1) < reach ** 2
+
+    def _follow(self, distance):
+        """ Batched version of gameobjects.TailArray.follow for all tails of all matches """
+        used = self.tail_lengths.max(initial=0)
+        if not used:
+            return
+        pos = self.tails[:, :, :used]
+        prev = np.concatenate((self.heads[:, :, None], pos[:, :, :-1]), axis=2)
+        valid = (np.arange(used) < self.tail_lengths[..., None]) & self.alive[..., None]
+        reach = 2 * self.r
+        offset = prev - pos
+        active = valid & (np.hypot(offset[..., 0], offset[..., 1]) >= reach)
+        offset = self.board.displacements(pos, prev)
+        length = np.hypot(offset[..., 0], offset[..., 1])
+        distance = distance[:, None, None]
+        ratio = np.where(length > distance, distance / np.maximum(length, 1e-12), 1)
+        moved = pos + offset * ratio[..., None]
+        straight = (self.powerups[..., WEIRD_WALKING] > 0) | (self.powerups[..., CRUSHING] > 0)
+        moved = np.where(straight[..., None, None], pos + self.directions[:, :, None] * distance[..., None], moved)
+        moved %= self.size
+        moved_offset = prev - moved
+        active &= np.hypot(moved_offset[..., 0], moved_offset[..., 1]) >= reach
+        self.tails[:, :, :used] = np.where(active[..., None], moved, pos)
+
+    def _grow(self, eaten):
+        """ New segments appear where the last one is (or on the head) """
+        lengths = self.tail_lengths
+        last = np.take_along_axis(self.tails, np.maximum(lengths - 1, 0)[..., None, None], axis=2)[:, :, 0]
+        last = np.where((lengths > 0)[..., None], last, self.heads)
+        new_lengths = np.minimum(lengths + eaten, self.max_tail)
+        used = new_lengths.max(initial=0)
+        segments = np.arange(used)
+        new = (segments >= lengths[..., None]) & (segments < new_lengths[..., None])
+        self.tails[:, :, :used] = np.where(new[..., None], last[:, :, None], self.tails[:, :, :used])
+        self.tail_lengths = new_lengths
+
+    def _spawn(self, positions, active, counts, powerups=None):
+        """ Places counts[m] new objects at random in free slots of every match m """
+        for i in range(int(counts.max(initial=0))):
+            needed = (counts > i) & ~active.all(axis=1)
+            if not needed.any():
+                return
+            matches = np.nonzero(needed)[0]
+            slots = active[matches].argmin(axis=1)
+            positions[matches, slots] = self.rng.random((len(matches), 2)) * self.size
+            active[matches, slots] = True
+            if powerups is not None:
+                draws = self.rng.random(len(matches))
+                chosen = np.searchsorted(self.powerup_thresholds, draws, side="right")
+                codes = np.append(self.powerup_codes, NONE)
+                powerups[matches, slots] = codes[chosen]
+
+
+if __name__ == "__main__":
+    matches = int(sys.argv[1]) if len(sys.argv) > 1 else 512
+    players = int(sys.argv[2]) if len(sys.argv) > 2 else 4
+    engine = BatchEngine(matches, players, seed=0)
+    rng = np.random.default_rng(1)
+    TICKS = 300
+    start = time.perf_counter()
+    for _ in range(TICKS):
+        engine.step(rng.integers(0, 3, (matches, players)))
+    took = time.perf_counter() - start
+    print(f"{matches} matches x {players} snakes: {matches * players * TICKS / took:,.0f} snake-ticks/s")
+    print("Eaten fruits by powerup:", {p.name: int(n) for p, n in zip(POWERUPS, engine.eaten)})
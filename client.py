@@ -1,10 +1,13 @@
 import gamenetwork as net
+import gameobjects
 import views
 from utils import *
 from views import *
 import pygameview
 from dataclasses import dataclass, field
-from dto import Config, GameState, GameInputs
+import dto
+from dto import GameState, GameInputs, SnapshotBaselines
+from config import Config
 import constants
 import pygameutils
 import playfab
@@ -15,6 +18,7 @@ import gamenetwork.client_tester as client_tester
 import json
 import os
 import math
+import numpy as np
 
 
 # find free data filename
@@ -38,28 +42,129 @@ def DEBUG_WRITE2FILE(some_json):
     with open(DEBUG_FILENAME, "a") as file:
         file.write(json.dumps(some_json) + "\n")
 
+class PredictionHistory:
+    """
+    Ring buffer of the last ticks predicted by the client: own inputs and a summary of the predicted state.
+    Entries are overwritten after `size` ticks.
+    """
+    TOLERANCE = 1.0 # states sent by host have quantized positions (see dto.quantize_position), so the same state can differ that much
+    ANGLE_TOLERANCE = 1 # in quantization steps of directions (see dto.quantize_angle)
+    TAIL_TOLERANCE = 0.5 # of the radius of segments
+
+    def __init__(self, size=constants.TICKS_PER_SECOND * 2):
+        self.size = size
+        self._ticks = [-1] * size
+        self._summaries = [None] * size
+        self._inputs = [[] for _ in range(size)]
+
+    def _slot(self, tick) -> int:
+        slot = tick % self.size
+        if self._ticks[slot] != tick:
+            self._ticks[slot] = tick
+            self._summaries[slot] = None
+            self._inputs[slot] = []
+        return slot
+
+    @staticmethod
+    def summary(game_state: GameState) -> tuple:
+        discrete = (
+            tuple(snake.alive for snake in game_state.players),
+            tuple(snake.decision for snake in game_state.players),
+            tuple(len(snake.tail) for snake in game_state.players),
+            len(game_state.fruits),
+            len(game_state.walls),
+            tuple(game_state.scores)
+        )
+        angles = [dto.quantize_angle(snake.direction) for snake in game_state.players]
+        positions = [(circle.x, circle.y) for circle in (*game_state.players, *game_state.fruits)]
+        tails = [dto.tail_rows(snake.tail)[:, :2] for snake in game_state.players]
+        return discrete, angles, positions, tails
+
+    def record_input(self, tick: int, color, decision: int):
+        self._inputs[self._slot(tick)].append((color, decision))
+
+    def record_state(self, game_state: GameState):
+        self._summaries[self._slot(game_state.tick)] = self.summary(game_state)
+
+    def inputs(self, tick: int) -> list:
+        slot = tick % self.size
+        return self._inputs[slot] if self._ticks[slot] == tick else []
+
+    def matches(self, game_state: GameState) -> bool:
+        """ Whether the prediction for game_state's tick is the same as game_state """
+        slot = game_state.tick % self.size
+        if self._ticks[slot] != game_state.tick or self._summaries[slot] is None:
+            return False
+        discrete, angles, positions, tails = self._summaries[slot]
+        other_discrete, other_angles, other_positions, other_tails = self.summary(game_state)
+        if discrete != other_discrete:
+            return False
+        # directions are rotated from quantized ones as well
+        steps = dto.QUANTIZATION_STEPS
+        if any(min((a - b) % steps, (b - a) % steps) > self.ANGLE_TOLERANCE for a, b in zip(angles, other_angles)):
+            return False
+        # host sends images of positions on the board, a snake which has just crossed its edge may be off it
+        geometry = gameobjects.board()
+        if not all(abs(d) < self.TOLERANCE for (x, y), (other_x, other_y) in zip(positions, other_positions)
+                   for d in geometry.displacement(x, y, other_x, other_y)):
+            return False
+        # segments move by whole steps once they stop touching the previous one, so quantization alone can put them a few
+        # steps away - only more than that changes which collisions happen
+        return all(np.all(np.abs(geometry.displacements(tail, other_tail)) < self.TAIL_TOLERANCE * snake.r)
+                   for tail, other_tail, snake in zip(tails, other_tails, game_state.players))
+
+def lead_ticks() -> int:
+    """
+    :return: how many ticks the prediction is ahead of the host - the round trip of own inputs
+        and the wait for the next snapshot, measured when possible
+    """
+    link = net.link_quality()
+    lead = link.rtt + 2*link.jitter + constants.NETWORK_GAME_LATENCY_SEC if link and link.rtt is not None else 2*constants.NETWORK_GAME_LATENCY_SEC
+    return math.ceil(lead / constants.TICK_SEC)
+
+def rebase(gs: GameState, history: PredictionHistory, current_tick: int, lead: int) -> GameState:
+    """
+    Rewinds the prediction to host's state and replays own inputs which host had not known yet, tick by tick.
+    :param gs: host's state, becomes the new prediction
+    :param current_tick: of the prediction so far
+    :param lead: ticks to play ahead of gs if it is ahead of the prediction (see lead_ticks)
+    :return: gs
+    """
+    if gs.time_passed < 1.0:
+        gs.time_passed = 1.0
+    target = current_tick if gs.tick <= current_tick else gs.tick + lead
+    history.record_state(gs)
+    while gs.tick < target:
+        for color, decision in history.inputs(gs.tick):
+            snake = find(gs.players, lambda s: s.color == color)
+            snake.decision = decision
+        simulate_tick(gs)
+        history.record_state(gs)
+    return gs
+
 @singleton
 @dataclass
 class ClientNetworkData:
     players: list = field(default_factory=list)
     predicted: GameState = None
     my_colors: dict = field(default_factory=dict)
-    inputs: list = field(default_factory=list)
-    inputs_sended_idx: int = 0
+    inputs: list = field(default_factory=list) # not sent yet
+    history: PredictionHistory = field(default_factory=PredictionHistory)
+    snapshots: SnapshotBaselines = field(default_factory=SnapshotBaselines)
 
 should_relaunch = True
 
 async def send_controls():
     while True:
-        if ClientNetworkData().inputs_sended_idx < 0:
+        if ClientNetworkData().inputs:
             ctrls = GameInputs()
-            for game_input in ClientNetworkData().inputs[ClientNetworkData().inputs_sended_idx:]:
-                color, decision, time_passed = game_input
+            for game_input in ClientNetworkData().inputs:
+                color, decision, tick = game_input
                 name = find(ClientNetworkData().my_colors.keys(), lambda n: ClientNetworkData().my_colors[n] == color)
 
-                ctrls.append(name, decision, time_passed)
+                ctrls.append(name, decision, tick=tick)
             net.send_udp("control", ctrls.serialize())
-            ClientNetworkData().inputs_sended_idx = 0
+            ClientNetworkData().inputs = []
         await asyncio.sleep(constants.NETWORK_GAME_LATENCY_SEC)
 
 
@@ -93,6 +198,9 @@ class ClientLobbyView(pygameview.PyGameView):
 
 class ClientGameView(pygameview.PyGameView):
 
+    def __init__(self):
+        self.timestep = FixedTimestep()
+
     def update(self, delta):
         if ClientNetworkData().predicted is None:
             return
@@ -103,12 +211,14 @@ class ClientGameView(pygameview.PyGameView):
                 decision = function()
                 snake = find(ClientNetworkData().predicted.players, lambda s: s.color == color)
                 snake.decision = decision
-                loop_delta_fragment = 0.0001
-                ClientNetworkData().inputs.append((color, decision, ClientNetworkData().predicted.time_passed - loop_delta_fragment))
-                ClientNetworkData().inputs_sended_idx -= 1
-                DEBUG_WRITE2FILE({"color": color, "decision": decision, "time_passed": ClientNetworkData().predicted.time_passed})
-
-        sounds = game_loop(ClientNetworkData().predicted, delta, add_new_entities=False)
+                ClientNetworkData().inputs.append((color, decision, ClientNetworkData().predicted.tick))
+                ClientNetworkData().history.record_input(ClientNetworkData().predicted.tick, color, decision)
+                DEBUG_WRITE2FILE({"color": color, "decision": decision, "tick": ClientNetworkData().predicted.tick})
+
+        sounds = []
+        for _ in range(self.timestep.advance(delta)):
+            sounds += simulate_tick(ClientNetworkData().predicted)
+            ClientNetworkData().history.record_state(ClientNetworkData().predicted)
         draw_board(ClientNetworkData().predicted)
         for sound in sounds:
             pygame.mixer.Sound(f"sound/{sound}.mp3").play(maxtime=constants.SOUND_MAXTIME[sound])
@@ -136,7 +246,11 @@ class ClientNetworkListener(client_tester.ClientTester):
         ClientNetworkData().players = players
 
     def action_game(self, game_state):
-        gs = GameState.deserialize(game_state)
+        gs = ClientNetworkData().snapshots.decode(game_state)
+        if gs is None:
+            net.send_udp("keyframe")
+            return
+        net.send_udp("ack", gs.numbering)
         if ClientNetworkData().predicted is not None and ClientNetworkData().predicted.timestamp > gs.timestamp:
             return
         
@@ -149,38 +263,15 @@ class ClientNetworkListener(client_tester.ClientTester):
         # DEBUG_WRITE2FILE(debug2file_json)
 
         if ClientNetworkData().predicted is not None and ClientNetworkData().predicted.time_passed > 1:
-            current_time = ClientNetworkData().predicted.time_passed - 0.0001
-            # now = pygame.time.get_ticks()
-            # from_last_msg = (now - self.test) / 1000.0
-            # self.test = now
-            # if current_time - gs.time_passed > 2 * constants.NETWORK_GAME_LATENCY / 1000:
-            #     time_diff = current_time - gs.time_passed
-            #     constants.LOG.debug(f"3. {time_diff=:.4f}\t{from_last_msg=:.4f}")
-            ClientNetworkData().predicted = gs
-            ClientNetworkData().predicted.time_passed = current_time
-            delta_time = 1.0 / pygameview.DEFAULT_FPS
-            if gs.time_passed < 1.0:
-                ClientNetworkData().predicted.time_passed = 1.0
-                ClientNetworkData().inputs = [inp for inp in ClientNetworkData().inputs if inp[2] >= 1.0]
-            else:
-                ClientNetworkData().inputs = [inp for inp in ClientNetworkData().inputs if inp[2] > gs.time_passed - delta_time]
-            for color, decision, tp in ClientNetworkData().inputs:
-                # If all inputs are processed up to current state, fast-forward in units of delta_time
-                if tp > ClientNetworkData().predicted.time_passed:
-                    loop_delta = math.ceil((tp - ClientNetworkData().predicted.time_passed)/delta_time)*delta_time
-                    game_loop(ClientNetworkData().predicted, loop_delta, False)
-                # Else just apply the input
-                snake = find(gs.players, lambda s: s.color == color)
-                snake.decision = decision
-            if current_time > ClientNetworkData().predicted.time_passed:
-                loop_delta = math.ceil((current_time - ClientNetworkData().predicted.time_passed)/delta_time)*delta_time
-                game_loop(ClientNetworkData().predicted, loop_delta, False)
+            current_tick = ClientNetworkData().predicted.tick
+            history = ClientNetworkData().history
+            if gs.tick <= current_tick and history.matches(gs):
+                return # prediction was right
+            ClientNetworkData().predicted = rebase(gs, history, current_tick, lead_ticks())
         else:
             ClientNetworkData().predicted = gs
-            delta_time = 1.0 / pygameview.DEFAULT_FPS
-            loop_delta = math.ceil((2*constants.NETWORK_GAME_LATENCY_SEC)/delta_time)*delta_time
-            ClientNetworkData().predicted.time_passed += loop_delta
-            # self.test = pygame.time.get_ticks()
+            # ready go ends that much earlier than on the host
+            ClientNetworkData().predicted.time_passed += lead_ticks() * constants.TICK_SEC
 
 
     def action_your_color(self, data):
@@ -192,7 +283,9 @@ class ClientNetworkListener(client_tester.ClientTester):
         constants.LOG.info("Game is starting")
         self.controls_task = asyncio.create_task(send_controls())
         ClientNetworkData().predicted = None
-        pygame.display.set_mode(resolution, pygame.FULLSCREEN if resolution == pygameutils.get_screen_size() else 0)
+        ClientNetworkData().history = PredictionHistory()
+        ClientNetworkData().snapshots = SnapshotBaselines()
+        pygameutils.set_resolution(resolution)
         pygameview.set_view(ClientReadyGoView(ClientGameView()))
 
     def action_score(self, game_state):
@@ -208,11 +301,14 @@ class ClientNetworkListener(client_tester.ClientTester):
         pygameview.close_view()
 
 
-async def run_client(ip:str, tcp_port: int, udp_port: int):
+async def run_client(ip:str, tcp_port: int, udp_port: int, room: str = None):
+    """
+    :param room: room on the host to join (host's default one if not given)
+    """
     with net.ContextManager():
         try:
             await first_completed(
-                net.connect_to_server(ip, tcp_port, udp_port, ClientNetworkListener()),
+                net.connect_to_server(ip, tcp_port, udp_port, ClientNetworkListener(), hello=room),
                 pygameview.run_async(pygameview.common.WaitingView("Connecting to server"))
                 )
         except OSError as e:
@@ -226,14 +322,17 @@ async def run_client(ip:str, tcp_port: int, udp_port: int):
             constants.LOG.info("Connection aborted")
             return
         
-        Config().last_connected_ip = f"{ip}:{tcp_port}" 
+        Config().last_connected_ip = f"{ip}:{tcp_port}/{room}" if room else f"{ip}:{tcp_port}"
         Config().save_to_file()
 
         global should_relaunch
         should_relaunch = True
         while should_relaunch:
             should_relaunch = False
-            net.send("join", Config().active_players_names)
+            if room:
+                net.send("join", {"room": room, "names": Config().active_players_names})
+            else:
+                net.send("join", Config().active_players_names)
             await ClientLobbyView(f"{ip}:{tcp_port}:{udp_port}")
     
 
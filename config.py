@@ -0,0 +1,65 @@
+# Local configuration of the player, kept in Config.FILE_NAME
+
+from dataclasses import dataclass
+import pygame
+import utils
+import pygameutils
+import constants
+from decisionfunctions import based_on_keys
+
+@dataclass
+class Control:
+    left: int
+    right: int 
+
+@utils.singleton
+class Config:
+    names = ["snake", "snake2", "snake3"]
+    number_of_players = 1
+    controls = [Control(pygame.K_LEFT, pygame.K_RIGHT), Control(pygame.K_a, pygame.K_d), Control(pygame.K_j, pygame.K_l)]
+    last_connected_ip = "localhost"
+    FILE_NAME = "config.data"
+
+    @property
+    def active_players_names(self):
+        return self.names[:self.number_of_players]
+
+    @property
+    def control_functions(self):
+        return [based_on_keys(control.left, control.right) for control in self.controls]
+
+    def save_to_file(self):
+        with open(self.FILE_NAME, "w") as file:
+            for idx, name in enumerate(self.names):
+                file.write(f"player {idx+1} name: {name}\n")
+            for control in self.controls:
+                file.write(f"player {self.controls.index(control)+1} controls: {pygame.key.name(control.left)} {pygame.key.name(control.right)}\n")
+            file.write(f"resolution: {pygame.display.get_window_size()[0]} {pygame.display.get_window_size()[1]}\n")
+            file.write(f"last_connected_ip: {self.last_connected_ip}\n")
+
+    def load_from_file(self):
+        try:
+            with open(self.FILE_NAME, "r") as file:
+                for line in file:
+                    if line.startswith("player"):
+                        pygame.init()
+                        parts = line.split()
+                        player = int(parts[1]) - 1
+                        if (parts[2] == "name:"):
+                            self.names[player] = " ".join(parts[3:])
+                        if (parts[2] == "controls:"):
+                            self.controls[player].left = pygame.key.key_code(parts[3])
+                            self.controls[player].right = pygame.key.key_code(parts[4])
+                    if line.startswith("resolution"):
+                        key, w, h = line.split()
+                        w = int(w)
+                        h = int(h)
+                        full_screen = pygameutils.get_screen_size()
+                        if full_screen[0] < w or full_screen[1] < h:
+                            w, h = full_screen
+                        pygameutils.create_window(constants.WINDOW_TITLE, w, h)
+                    if line.startswith("last_connected_ip"):
+                        parts = line.split()
+                        self.last_connected_ip = parts[1]
+        except FileNotFoundError:
+            ...
@@ -1,6 +1,8 @@
 import logging
 import utils
 import enum
+import itertools
+import colorsys
 
 class Color:
     black = (0, 0, 0)
@@ -34,7 +36,17 @@ class Color:
     
     @staticmethod
     def players_colors():
-        return (c for c in Color.values() if not c in (Color.black, Color.green, Color.cyan, Color.gold, Color.magenta))
+        """ Endless stream of distinct colors (they identify snakes) - the named ones first, then generated ones """
+        used = {Color.black, Color.green, Color.cyan, Color.gold, Color.magenta}
+        for color in Color.values():
+            if color not in used:
+                used.add(color)
+                yield color
+        for k in itertools.count():
+            color = tuple(int(255 * c) for c in colorsys.hsv_to_rgb(k * 0.618034 % 1, 0.7, 0.9))
+            if color not in used:
+                used.add(color)
+                yield color
     
 @utils.singleton
 class Game:
@@ -42,12 +54,16 @@ class Game:
     :param diameter: size of things in pixels
     :param speed: diameters per second
     :param time_limit: seconds
+    :param board_size: (width, height) of the board in pixels - the window's size, unless the host set it (see pygameutils.set_resolution)
+    :param array_tails: keep snakes' tails in numpy arrays (gameobjects.TailArray) instead of lists of Tail objects -
+                        faster with long tails, but they follow heads a bit differently (see TailArray.follow)
     """
     diameter  = 30
     speed  = 4
     time_limit = 60
     rotation_power = 4
-    screen_rect = None
+    board_size: tuple[int, int] = None
+    array_tails = False
 
 LOG = logging.getLogger("snake")
 
@@ -64,6 +80,14 @@ class Powerup(enum.Enum):
     CRUSHING = Color.gold
     GHOSTING = Color.gray
 
+# chances that a new fruit carries a powerup (the rest are plain fruits)
+POWERUP_PROBABILITIES = {
+    Powerup.WALL_WALKING: 0.1,
+    Powerup.WEIRD_WALKING: 0.1,
+    Powerup.GHOSTING: 0.05,
+    Powerup.CRUSHING: 0.02
+}
+
 POWERUP_TIMES = {
     Powerup.WALL_WALKING: 5.0,
     Powerup.WEIRD_WALKING: 10.0,
@@ -77,4 +101,7 @@ SOUND_MAXTIME = {
 }
 
 NETWORK_GAME_LATENCY = 60  # milliseconds
-NETWORK_GAME_LATENCY_SEC = NETWORK_GAME_LATENCY / 1000.0
\ No newline at end of file
+NETWORK_GAME_LATENCY_SEC = NETWORK_GAME_LATENCY / 1000.0
+SNAPSHOT_BUDGET = 64 * 1024  # bytes per second of snapshots to one client, see simulation.SnapshotRate
+TICKS_PER_SECOND = 60  # fixed simulation rate, see simulation.simulate_tick
+TICK_SEC = 1.0 / TICKS_PER_SECOND
@@ -0,0 +1,174 @@
+# run as module, use: python -m debugtools.benchmark --help
+# Headless benchmark of simulation.game_loop - ticks per second, time spent in every phase of a tick
+# and memory allocations, for boards built with given numbers of players, tail segments, fruits and walls.
+
+import argparse
+import gc
+import itertools
+import json
+import math
+import random
+import sys
+import time
+import tracemalloc
+from collections import defaultdict
+
+import constants
+import dto
+import gameobjects
+import simulation
+from decisionfunctions import Direction
+from vector import Vector2
+
+PHASES = ["move", "fruits", "walls", "borders", "tails", "timers", "spawns"]
+
+class PhaseTimer:
+    """ Sums up time between consecutive laps under names of the phases which just ended """
+
+    def __init__(self):
+        self.totals = defaultdict(float)
+        self._last = time.perf_counter()
+
+    def start(self):
+        self._last = time.perf_counter()
+
+    def lap(self, phase):
+        now = time.perf_counter()
+        self.totals[phase] += now - self._last
+        self._last = now
+
+def build_state(players, tail, fruits, walls, powerups=(), seed=0) -> dto.GameState:
+    """
+    Game state with snakes spread evenly over the board, each with a straight tail of given length
+    (wrapping around the board if it does not fit).
+    :param powerups: constants.Powerup given to every snake for the whole benchmark
+    """
+    rng = random.Random(seed)
+    board = gameobjects.board()
+    radius = constants.Game().diameter / 2
+    st = dto.GameState()
+    st.init(players, seed)
+    st.fruits = [gameobjects.Fruit.at_random_position(radius, rng=rng) for _ in range(fruits)]
+    st.walls = [gameobjects.Wall.at_random_position(constants.Game().diameter, rng=rng) for _ in range(walls)]
+    columns = math.ceil(math.sqrt(players))
+    for k, player in enumerate(st.players):
+        player.x = board.width * (k % columns + 0.5) / columns
+        player.y = board.height * (k // columns + 0.5) / columns
+        player.direction = Vector2(0, -1)
+        for i in range(1, tail + 1):
+            x, y = board.wrap(player.x, player.y + i * player.r)
+            player.tail.append(gameobjects.Tail(x, y, player.r, Vector2(player.direction), player.color, int(player.r / 2)))
+        for powerup in powerups:
+            player.powerups[powerup] = math.inf
+    # fruits and walls are not eaten nor added over time, unless snakes run into them
+    st.fruit_event_timer = -math.inf
+    st.invalidate_index()
+    return st
+
+def decide(st: dto.GameState, rng: random.Random):
+    """ Snakes keep turning one way for a while, so they wander around instead of circling """
+    for player in st.alive_players():
+        if st.tick % constants.TICKS_PER_SECOND == 0:
+            player.decision = rng.choice([Direction.LEFT, Direction.RIGHT, Direction.FORWARD])
+
+def run(st: dto.GameState, ticks, timer=None, seed=0):
+    rng = random.Random(seed)
+    for _ in range(ticks):
+        decide(st, rng)
+        if timer:
+            timer.start()
+        simulation.game_loop(st, constants.TICK_SEC, add_new_entities=True, rng=rng, timer=timer)
+        st.tick += 1
+
+def benchmark(players, tail, fruits, walls, powerups=(), ticks=300, seed=0, trace=False) -> dict:
+    """
+    Runs the same game three times - plainly for the speed, with phase timer and with allocation tracking
+    (only if trace is set, as tracemalloc slows everything down a lot).
+    """
+    result = {
+        "players": players, "tail": tail, "fruits": fruits, "walls": walls,
+        "powerups": [powerup.name for powerup in powerups], "ticks": ticks,
+        "array_tails": constants.Game().array_tails,
+    }
+
+    st = build_state(players, tail, fruits, walls, powerups, seed)
+    gc.collect()
+    blocks = sys.getallocatedblocks()
+    collections = [generation["collections"] for generation in gc.get_stats()]
+    start = time.perf_counter()
+    run(st, ticks, seed=seed)
+    took = time.perf_counter() - start
+    result["ticks_per_second"] = ticks / took
+    result["ms_per_tick"] = took / ticks * 1000
+    result["alive"] = sum(player.alive for player in st.players)
+    result["blocks_retained"] = sys.getallocatedblocks() - blocks
+    result["gc_collections"] = [generation["collections"] - before for generation, before in zip(gc.get_stats(), collections)]
+
+    timer = PhaseTimer()
+    run(build_state(players, tail, fruits, walls, powerups, seed), ticks, timer, seed)
+    result["phases_ms_per_tick"] = {phase: timer.totals[phase] / ticks * 1000 for phase in PHASES}
+
+    if trace:
+        st = build_state(players, tail, fruits, walls, powerups, seed)
+        tracemalloc.start()
+        before = tracemalloc.take_snapshot()
+        run(st, ticks, seed=seed)
+        after = tracemalloc.take_snapshot()
+        _, peak = tracemalloc.get_traced_memory()
+        tracemalloc.stop()
+        stats = after.compare_to(before, "filename")
+        result["traced_peak_bytes"] = peak
+        result["traced_blocks_retained"] = sum(stat.count_diff for stat in stats)
+        result["traced_top"] = [f"{stat.traceback[0].filename}: {stat.size_diff:+} B in {stat.count_diff:+} blocks" for stat in stats[:5]]
+    return result
+
+def show(result):
+    print(f"players={result['players']} tail={result['tail']} fruits={result['fruits']} walls={result['walls']} "
+          f"powerups={','.join(result['powerups']) or '-'} array_tails={result['array_tails']}")
+    print(f"  {result['ticks_per_second']:.1f} ticks/s ({result['ms_per_tick']:.3f} ms/tick), "
+          f"{result['alive']}/{result['players']} alive after {result['ticks']} ticks")
+    print("  " + " ".join(f"{phase}={ms:.3f}" for phase, ms in result["phases_ms_per_tick"].items()) + " (ms/tick)")
+    print(f"  retained blocks: {result['blocks_retained']}, gc collections: {result['gc_collections']}")
+    if "traced_peak_bytes" in result:
+        print(f"  traced peak: {result['traced_peak_bytes']} B, traced retained blocks: {result['traced_blocks_retained']}")
+        for line in result["traced_top"]:
+            print(f"    {line}")
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(prog="python -m debugtools.benchmark", description="Headless benchmark of simulation.game_loop")
+    parser.add_argument("--players", type=int, nargs="+", default=[4], help="one or more numbers of snakes")
+    parser.add_argument("--tail", type=int, nargs="+", default=[0, 50, 100, 200, 400], help="one or more tail lengths")
+    parser.add_argument("--fruits", type=int, nargs="+", default=[6])
+    parser.add_argument("--walls", type=int, nargs="+", default=[0])
+    parser.add_argument("--powerups", nargs="*", default=["GHOSTING"], choices=[powerup.name for powerup in constants.Powerup],
+                        help="given to every snake for the whole run (GHOSTING keeps them alive)")
+    parser.add_argument("--ticks", type=int, default=300)
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--size", type=int, nargs=2, default=[1920, 1080], metavar=("WIDTH", "HEIGHT"))
+    parser.add_argument("--array-tails", action="store_true", help="keep tails in numpy arrays (constants.Game.array_tails)")
+    parser.add_argument("--trace", action="store_true", help="track allocations with tracemalloc (slow)")
+    parser.add_argument("--json", help="file to write results to, - for standard output")
+    args = parser.parse_args(argv)
+
+    constants.Game().board_size = tuple(args.size)
+    constants.Game().array_tails = args.array_tails
+    constants.Game().time_limit = 0
+    constants.LOG.disabled = True
+    powerups = [constants.Powerup[name] for name in args.powerups]
+
+    results = []
+    # every combination of given values, so passing many values of one parameter gives its scaling curve
+    for players, tail, fruits, walls in itertools.product(args.players, args.tail, args.fruits, args.walls):
+        result = benchmark(players, tail, fruits, walls, powerups, args.ticks, args.seed, args.trace)
+        results.append(result)
+        if args.json != "-":
+            show(result)
+
+    if args.json == "-":
+        json.dump(results, sys.stdout, indent=2)
+    elif args.json:
+        with open(args.json, "w") as file:
+            json.dump(results, file, indent=2)
+
+if __name__ == "__main__":
+    main()
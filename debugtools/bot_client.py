@@ -0,0 +1,122 @@
+# run as module, use: python -m debugtools.bot_client <ip>[:<port>][/<room>] [--help for options]
+# Headless client whose players are bots (see decisionfunctions.BOTS) - runs many games in a row without a window,
+# so a few of them put a host under realistic load. One process runs many of them, each with its own net.NetworkEndpoint.
+
+import argparse
+import asyncio
+import logging
+import math
+import typing
+import constants
+import decisionfunctions
+import gamenetwork as net
+from dto import GameState, GameInputs, SnapshotBaselines
+
+class BotClient(net.NetworkListener):
+
+    def __init__(self, names: list[str], kind: str, room: str = None, host_bots: int = 0, start_with: int = 0, resolution=(1280, 720), games: int = 0):
+        """
+        :param host_bots: number of bots to add on the host side before every game
+        :param start_with: starts the game as soon as the room has that many players (0 - never, somebody else does it)
+        :param games: number of games to play before leaving (0 - play forever)
+        """
+        self.names = names
+        self.kind = kind
+        self.room = room
+        self.host_bots = host_bots
+        self.start_with = start_with
+        self.resolution = resolution
+        self.games = games
+        self.played = 0
+        self.state: GameState = None
+        self.snapshots = SnapshotBaselines()
+        self.bots: dict[str, typing.Callable[[], int]] = {} # name -> decision function
+        self.done = asyncio.get_running_loop().create_future()
+
+    def join(self):
+        self.endpoint.send("join", {"room": self.room, "names": self.names} if self.room else self.names)
+        if self.host_bots:
+            self.endpoint.send("add_bots", {"count": self.host_bots, "kind": self.kind})
+
+    def action_lobby(self, players):
+        if self.start_with and self.state is None and len(players) >= self.start_with:
+            self.endpoint.send("start", self.resolution)
+
+    def action_your_color(self, data):
+        self.bots[data["name"]] = decisionfunctions.BOTS[self.kind](lambda: self.state, data["color"])
+
+    def action_start(self, resolution):
+        constants.Game().board_size = tuple(resolution)
+        self.state = None
+        self.snapshots = SnapshotBaselines()
+
+    def action_game(self, data):
+        gs = self.snapshots.decode(data)
+        if gs is None:
+            self.endpoint.send_udp("keyframe")
+            return
+        self.endpoint.send_udp("ack", gs.numbering)
+        if self.state is not None and self.state.tick > gs.tick:
+            return
+        self.state = gs
+
+        # like a player's client, decisions are sent all the time - lost datagrams do not matter then
+        # the host drops controls for ticks it has passed, so they are meant for when they arrive there (see client.py)
+        link = self.endpoint.link_quality()
+        lead = link.rtt + 2*link.jitter if link and link.rtt is not None else 2*constants.NETWORK_GAME_LATENCY_SEC
+        tick = gs.tick + math.ceil(lead / constants.TICK_SEC) + 1
+        controls = GameInputs()
+        for name, function in self.bots.items():
+            controls.append(name, function(), tick=tick)
+        self.endpoint.send_udp("control", controls.serialize())
+
+    def action_score(self, data):
+        scores = GameState.deserialize(data).scores
+        self.played += 1
+        constants.LOG.info(f"Game {self.played} over, scores: {scores}")
+        self.bots.clear()
+        self.state = None
+        if self.games and self.played >= self.games:
+            self.done.set_result(True)
+        else:
+            self.join()
+
+    def disconnected(self):
+        if not self.done.done():
+            self.done.set_result(False)
+
+async def main():
+    parser = argparse.ArgumentParser(prog="python -m debugtools.bot_client", description="Headless client played by bots")
+    parser.add_argument("address", help="ip[:port][/room]")
+    parser.add_argument("--udp", type=int, help="host's UDP port, the same as TCP one if not given")
+    parser.add_argument("--players", type=int, default=1, help="number of bots in this client")
+    parser.add_argument("--clients", type=int, default=1, help="number of clients in this process, each with its own connection")
+    parser.add_argument("--kind", default="seeking_fruits", choices=list(decisionfunctions.BOTS))
+    parser.add_argument("--start-with", type=int, default=0, help="start the game when the room has that many players")
+    parser.add_argument("--host-bots", type=int, default=0, help="number of bots to add on the host side, in the same room")
+    parser.add_argument("--games", type=int, default=0, help="number of games to play, 0 for no limit")
+    parser.add_argument("--size", type=int, nargs=2, default=[1280, 720], metavar=("WIDTH", "HEIGHT"))
+    parser.add_argument("--udp-only", action="store_true", help="connect without TCP (solo host only, a router hands over TCP connections)")
+    args = parser.parse_args()
+
+    address, _, room = args.address.partition("/")
+    ip, _, port = address.partition(":")
+    tcp_port = int(port) if port else constants.DEFAULT_PORT
+    udp_port = args.udp or tcp_port
+
+    clients = [BotClient([f"{args.kind} {n * args.players + k + 1}" for k in range(args.players)], args.kind, room or None,
+                         args.host_bots if n == 0 else 0, args.start_with, tuple(args.size), args.games)
+               for n in range(args.clients)]
+    endpoints = [net.NetworkEndpoint() for _ in clients]
+    try:
+        for endpoint, client in zip(endpoints, clients):
+            await endpoint.connect_to_server(ip, tcp_port, udp_port, client, hello=room or None, tcp=not args.udp_only)
+            client.join()
+        await asyncio.gather(*(client.done for client in clients))
+    finally:
+        for endpoint in endpoints:
+            endpoint.close()
+
+if __name__ == "__main__":
+    logging.basicConfig(level=logging.INFO)
+    asyncio.run(main())
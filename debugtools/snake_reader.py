@@ -22,11 +22,11 @@ def create_x_surface(size, color=(255, 0, 0), thickness=5):
 
 def draw_debug(game_state: dto.GameState):
     for player in game_state.alive_players():
-        player.draw_direction()
+        views.draw_direction(player)
     for player in game_state.players:
         if player.alive is False:
-            player.draw()
-            player.draw_direction()
+            views.draw_snake(player)
+            views.draw_direction(player)
             surface = create_x_surface(player.r*3, CRIMSON_RED, int(player.r))
             pygame.display.get_surface().blit(surface, (player.x - player.r*1.5, player.y - player.r*1.5 ))
     title(
@@ -0,0 +1,129 @@
+# run as module, use: python -m debugtools.snapshot_benchmark --help
+# Headless benchmark of game state snapshots - their size, time of encoding and decoding and bandwidth they take
+# at the host's sending rate, for boards with given numbers of players and tail segments.
+
+import argparse
+import itertools
+import json
+import sys
+import time
+
+import constants
+import dto
+from debugtools.benchmark import build_state, run
+
+class Codec:
+    """
+    Encodes snapshots of one game for one receiver. Before every measured snapshot it is shown
+    the state the receiver got last (see baseline), as the host knows it from acknowledgements.
+    """
+
+    def baseline(self, st: dto.GameState): ...
+
+    def encode(self, st: dto.GameState) -> bytes: ...
+
+    def decode(self, data: bytes) -> dto.GameState: ...
+
+class FullCodec(Codec):
+
+    def encode(self, st):
+        return st.serialize()
+
+    def decode(self, data):
+        return dto.GameState.deserialize(data)
+
+class DeltaCodec(Codec):
+    """ Delta against the baseline, the host takes a dto.Snapshot of every state it sends """
+
+    def baseline(self, st):
+        self.snapshot = dto.Snapshot(st)
+        self.receiver = dto.SnapshotBaselines()
+        self.receiver.decode(st.serialize())
+
+    def encode(self, st):
+        return st.serialize_delta(dto.Snapshot(st), self.snapshot)
+
+    def decode(self, data):
+        return self.receiver.decode(data)
+
+CODECS: dict[str, type[Codec]] = {
+    "full": FullCodec,
+    "delta": DeltaCodec,
+}
+
+def measure(function, argument, repeat) -> float:
+    """ :return: microseconds per call """
+    start = time.perf_counter()
+    for _ in range(repeat):
+        function(argument)
+    return (time.perf_counter() - start) / repeat * 1e6
+
+def benchmark(players, tail, codecs=CODECS, warmup=0, repeat=100, seed=0) -> list[dict]:
+    """
+    :param warmup: ticks played before the measured snapshot - straight tails of a new board hardly move
+    """
+    st = build_state(players, tail, fruits=6, walls=10, powerups=[constants.Powerup.GHOSTING], seed=seed)
+    st.fruit_event_timer = 0 # fruits and walls keep spawning, like in a real game
+    run(st, warmup, seed=seed)
+    interval = round(constants.NETWORK_GAME_LATENCY_SEC / constants.TICK_SEC) # ticks between snapshots
+    codecs = {name: codec() for name, codec in codecs.items()}
+    st.numbering += 1
+    for codec in codecs.values():
+        codec.baseline(st)
+    run(st, interval, seed=seed + 1)
+    st.numbering += 1
+
+    sent_per_second = 1000 / constants.NETWORK_GAME_LATENCY
+    expected = dto.GameState.deserialize(st.serialize()).to_json()
+    results = []
+    for name, codec in codecs.items():
+        data = codec.encode(st)
+        assert codec.decode(data).to_json() == expected, f"{name} does not decode what it encoded"
+        results.append({
+            "codec": name, "players": players, "tail": tail, "warmup": warmup, "array_tails": constants.Game().array_tails,
+            "bytes": len(data),
+            "bytes_per_second": len(data) * sent_per_second, # to every client
+            "encode_us": measure(codec.encode, st, repeat),
+            "decode_us": measure(codec.decode, data, repeat),
+        })
+    return results
+
+def show(result):
+    print(f"{result['codec']:>12} players={result['players']} tail={result['tail']} warmup={result['warmup']}: {result['bytes']} B "
+          f"({result['bytes_per_second'] / 1000:.1f} kB/s per client), "
+          f"encode {result['encode_us']:.1f} us, decode {result['decode_us']:.1f} us")
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(prog="python -m debugtools.snapshot_benchmark", description="Benchmark of game state snapshots")
+    parser.add_argument("--players", type=int, nargs="+", default=[4], help="one or more numbers of snakes")
+    parser.add_argument("--tail", type=int, nargs="+", default=[0, 50, 100, 200, 400], help="one or more tail lengths")
+    parser.add_argument("--warmup", type=int, nargs="+", default=[600], help="one or more numbers of ticks played before the snapshot")
+    parser.add_argument("--codecs", nargs="+", default=list(CODECS), choices=list(CODECS))
+    parser.add_argument("--repeat", type=int, default=100, help="encodings and decodings of every snapshot")
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--size", type=int, nargs=2, default=[1920, 1080], metavar=("WIDTH", "HEIGHT"))
+    parser.add_argument("--array-tails", action="store_true", help="keep tails in numpy arrays (constants.Game.array_tails)")
+    parser.add_argument("--json", help="file to write results to, - for standard output")
+    args = parser.parse_args(argv)
+
+    constants.Game().board_size = tuple(args.size)
+    constants.Game().array_tails = args.array_tails
+    constants.Game().time_limit = 0
+    constants.LOG.disabled = True
+    codecs = {name: CODECS[name] for name in args.codecs}
+
+    results = []
+    for players, tail, warmup in itertools.product(args.players, args.tail, args.warmup):
+        for result in benchmark(players, tail, codecs, warmup, args.repeat, args.seed):
+            results.append(result)
+            if args.json != "-":
+                show(result)
+
+    if args.json == "-":
+        json.dump(results, sys.stdout, indent=2)
+    elif args.json:
+        with open(args.json, "w") as file:
+            json.dump(results, file, indent=2)
+
+if __name__ == "__main__":
+    main()
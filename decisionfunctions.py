@@ -1,5 +1,8 @@
-import pygame
 import typing
+import math
+import random
+import numpy as np
+import constants
 
 class Direction:
     FORWARD = 0
@@ -7,9 +10,152 @@ class Direction:
     RIGHT = 2
 
 def based_on_keys(left, right) -> typing.Callable[[], Direction]:
+    import pygame # only here, the host does not have it (see host.py)
+
     def function():
         keys = pygame.key.get_pressed()
         if keys[left]: return Direction.LEFT
         if keys[right]: return Direction.RIGHT
         return Direction.FORWARD
-    return function
\ No newline at end of file
+    return function
+
+# region BOTS
+# Bots need nothing but the current game state, so they can take player slots on the host
+# as well as play in headless clients (see debugtools.bot_client).
+
+RAY_ANGLES = np.radians([-90, -60, -35, -15, 0, 15, 35, 60, 90]) # relative to the heading, LEFT turns towards negative ones
+REACH = 6 # how far bots look ahead, in snake's diameters
+
+class Sensors:
+    """
+    Everything a snake can crash into during one tick - heads, tail segments and walls - gathered into numpy arrays,
+    so every bot casts all its rays at once and bots looking at the same tick share the gathering (see of).
+    """
+
+    def __init__(self, state):
+        from gameobjects import board, TailArray # gameobjects imports this module
+        self.state = state
+        self.tick = state.tick
+        self.board = board()
+        positions, radii, owners, indexes = [np.empty((0, 2))], [np.empty(0)], [np.empty(0, int)], [np.empty(0, int)]
+        for k, snake in enumerate(state.players):
+            if not snake.alive:
+                continue
+            tail = snake.tail
+            if isinstance(tail, TailArray):
+                points, sizes = tail.positions[:len(tail)], tail.radii[:len(tail)]
+            else:
+                points, sizes = np.array([(t.x, t.y) for t in tail]).reshape(-1, 2), np.array([t.r for t in tail])
+            positions += [np.array([(snake.x, snake.y)]), points]
+            radii += [np.array([snake.r]), sizes]
+            owners.append(np.full(len(tail) + 1, k))
+            indexes.append(np.arange(len(tail) + 1)) # 0 is the head
+        positions.append(np.array([(wall.x, wall.y) for wall in state.walls]).reshape(-1, 2))
+        radii.append(np.array([wall.r for wall in state.walls]))
+        owners.append(np.full(len(state.walls), -1))
+        indexes.append(np.zeros(len(state.walls), int))
+        self.positions = np.concatenate(positions)
+        self.radii = np.concatenate(radii)
+        self.owners = np.concatenate(owners)
+        self.indexes = np.concatenate(indexes)
+
+    @classmethod
+    def of(cls, state) -> "Sensors":
+        global _sensors
+        if _sensors is None or _sensors.state is not state or _sensors.tick != state.tick:
+            _sensors = cls(state)
+        return _sensors
+
+    def cast(self, snake, angles=RAY_ANGLES, reach=None) -> np.ndarray:
+        """
+        :param angles: directions of rays, relative to snake's heading
+        :param reach: length of rays, REACH diameters of the snake if not given
+        :return: distance which the snake can go along every ray before it crashes (reach if nothing is in the way)
+        """
+        reach = reach or REACH * 2 * snake.r
+        heading = math.atan2(snake.direction.y, snake.direction.x)
+        rays = np.stack((np.cos(heading + angles), np.sin(heading + angles)), axis=1)
+        distances = np.full(len(angles), float(reach))
+
+        if constants.Powerup.GHOSTING not in snake.powerups:
+            k = next(k for k, other in enumerate(self.state.players) if other is snake)
+            offsets = self.board.displacements(np.array((snake.x, snake.y)), self.positions)
+            clearance = self.radii + snake.r
+            obstacles = (self.owners != k) | (self.indexes > snake.NECK)
+            if constants.Powerup.CRUSHING in snake.powerups:
+                obstacles &= self.owners != -1
+            obstacles &= np.einsum("ij,ij->i", offsets, offsets) < (reach + clearance) ** 2
+            offsets, clearance = offsets[obstacles], clearance[obstacles, np.newaxis]
+            along = offsets @ rays.T
+            across = np.einsum("ij,ij->i", offsets, offsets)[:, np.newaxis] - along ** 2
+            hit = (along > 0) & (across < clearance ** 2)
+            hits = np.where(hit, along - np.sqrt(np.maximum(clearance ** 2 - across, 0)), reach)
+            distances = np.minimum(distances, hits.min(axis=0, initial=reach))
+
+            if self.state.wall_walking_event_timer == 0:
+                with np.errstate(divide="ignore"):
+                    to_x = np.where(rays[:, 0] > 0, self.board.width - snake.r - snake.x, snake.x - snake.r) / np.abs(rays[:, 0])
+                    to_y = np.where(rays[:, 1] > 0, self.board.height - snake.r - snake.y, snake.y - snake.r) / np.abs(rays[:, 1])
+                distances = np.minimum(distances, np.minimum(to_x, to_y))
+
+        return np.maximum(distances, 0)
+
+_sensors: Sensors = None
+
+def based_on_sensors(get_state, color, seek_fruits=True, rng=random) -> typing.Callable[[], Direction]:
+    """
+    Bot avoiding walls, tails and (deadly) borders, which may also go for the nearest fruit.
+    :param get_state: returns the game state to decide on - it may be a different object every time
+    :param color: color of the snake driven by the bot
+    :param seek_fruits: turn towards fruits when the way is clear, wander around otherwise
+    """
+    wander = [Direction.FORWARD, 0] # decision, ticks left
+    escape = [None] # side to which the bot is turning away from an obstacle, kept until the way is clear
+
+    def function():
+        state = get_state()
+        snake = state and next((s for s in state.players if s.color == color and s.alive), None)
+        if snake is None:
+            return Direction.FORWARD
+        sensors = Sensors.of(state)
+        reach = REACH * 2 * snake.r
+        distances = sensors.cast(snake, RAY_ANGLES, reach)
+        left, ahead, right = distances[RAY_ANGLES < 0], distances[np.abs(RAY_ANGLES) < 0.3], distances[RAY_ANGLES > 0]
+
+        if ahead.min() < reach:
+            if escape[0] is None:
+                escape[0] = Direction.LEFT if left[1:].min() > right[:-1].min() else Direction.RIGHT
+            return escape[0]
+        escape[0] = None
+
+        if seek_fruits and state.fruits:
+            fruit = min(state.fruits, key=lambda f: sensors.board.distance(snake.x, snake.y, f.x, f.y))
+            dx, dy = sensors.board.displacement(snake.x, snake.y, fruit.x, fruit.y)
+            angle = (math.atan2(dy, dx) - math.atan2(snake.direction.y, snake.direction.x) + math.pi) % (2 * math.pi) - math.pi
+            decision = Direction.FORWARD if abs(angle) < 0.1 else Direction.LEFT if angle < 0 else Direction.RIGHT
+        else:
+            if wander[1] <= 0:
+                wander[:] = rng.choice([Direction.FORWARD, Direction.LEFT, Direction.RIGHT]), rng.randint(10, 60)
+            wander[1] -= 1
+            decision = wander[0]
+
+        # do not turn into something close on the side
+        if decision == Direction.LEFT and left[-2:].min() < reach / 2 or decision == Direction.RIGHT and right[:2].min() < reach / 2:
+            return Direction.FORWARD
+        return decision
+
+    return function
+
+def wandering(get_state, color, rng=random) -> typing.Callable[[], Direction]:
+    return based_on_sensors(get_state, color, False, rng)
+
+def seeking_fruits(get_state, color, rng=random) -> typing.Callable[[], Direction]:
+    return based_on_sensors(get_state, color, True, rng)
+
+# factories of bots by name, all take (get_state, color)
+BOTS: dict[str, typing.Callable[..., typing.Callable[[], Direction]]] = {
+    "wandering": wandering,
+    "seeking_fruits": seeking_fruits,
+}
+
+# endregion
@@ -1,71 +1,16 @@
 from dataclasses import dataclass, field, asdict
 from constants import *
-from decisionfunctions import based_on_keys, Direction
+from decisionfunctions import Direction
 from gameobjects import *
-import utils
-import pygameutils
 import toolz
 import constants
 import time
+import random
+import math
+import numpy as np
 import dto_pb2
-from google.protobuf import json_format
-
-@dataclass
-class Control:
-    left: int
-    right: int 
-
-@utils.singleton
-class Config:
-    names = ["snake", "snake2", "snake3"]
-    number_of_players = 1
-    controls = [Control(pygame.K_LEFT, pygame.K_RIGHT), Control(pygame.K_a, pygame.K_d), Control(pygame.K_j, pygame.K_l)]
-    last_connected_ip = "localhost"
-    FILE_NAME = "config.data"
-
-    @property
-    def active_players_names(self):
-        return self.names[:self.number_of_players]
-
-    @property
-    def control_functions(self):
-        return [based_on_keys(control.left, control.right) for control in self.controls]
-
-    def save_to_file(self):
-        with open(self.FILE_NAME, "w") as file:
-            for idx, name in enumerate(self.names):
-                file.write(f"player {idx+1} name: {name}\n")
-            for control in self.controls:
-                file.write(f"player {self.controls.index(control)+1} controls: {pygame.key.name(control.left)} {pygame.key.name(control.right)}\n")
-            file.write(f"resolution: {pygame.display.get_window_size()[0]} {pygame.display.get_window_size()[1]}\n")
-            file.write(f"last_connected_ip: {self.last_connected_ip}\n")
-
-    def load_from_file(self):
-        try:
-            with open(self.FILE_NAME, "r") as file:
-                for line in file:
-                    if line.startswith("player"):
-                        pygame.init()
-                        parts = line.split()
-                        player = int(parts[1]) - 1
-                        if (parts[2] == "name:"):
-                            self.names[player] = " ".join(parts[3:])
-                        if (parts[2] == "controls:"):
-                            self.controls[player].left = pygame.key.key_code(parts[3])
-                            self.controls[player].right = pygame.key.key_code(parts[4])
-                    if line.startswith("resolution"):
-                        key, w, h = line.split()
-                        w = int(w)
-                        h = int(h)
-                        full_screen = pygameutils.get_screen_size()
-                        if full_screen[0] < w or full_screen[1] < h:
-                            w, h = full_screen
-                        pygameutils.create_window(constants.WINDOW_TITLE, w, h)
-                    if line.startswith("last_connected_ip"):
-                        parts = line.split()
-                        self.last_connected_ip = parts[1]
-        except FileNotFoundError:
-            ...
+import spatialhash
+import torus
 
 def default_name_key(line):
     return line.split(" ")[0] + " ".join(line.split(" ")[2:])
@@ -103,16 +48,46 @@ class GameState:
     timestamp: float = time.time()
     last_delta: float = 0.0
     numbering: int = 0
+    tick: int = 0
+    seed: int = 0
+    entities_version: int = 0 # changes whenever fruits or walls change
+    _index = None # not a field - it is neither copied nor serialized
 
-    def init(self, number_of_players):
+    def init(self, number_of_players, seed=None):
+        """
+        :param seed: makes the whole game reproducible (see simulation.simulate_tick), random if not given
+        """
+        self.seed = seed if seed is not None else random.getrandbits(32)
+        rng = random.Random(self.seed)
         radius = Game().diameter / 2
         color = Color.players_colors()
         for _ in range(number_of_players):
-            player = Snake.at_random_position(radius, next(color))
+            player = Snake.at_random_position(radius, next(color), rng)
             self.players.append(player)
-        self.fruits=[Fruit.at_random_position(radius) for _ in range(6)]
+        self.fruits=[Fruit.at_random_position(radius, rng=rng) for _ in range(6)]
         self.current_speed= Game().speed
         self.scores=[0] * number_of_players
+        self._index = None
+
+    def rng(self) -> random.Random:
+        """
+        Randomness of the current tick - depends only on the seed and the tick number,
+        so everyone simulating the same game spawns the same fruits and walls.
+        """
+        return random.Random(self.seed << 32 | self.tick)
+
+    def spatial_index(self) -> spatialhash.BoardIndex:
+        """
+        Lazily built index of all objects on the board. It is kept up to date by game_loop,
+        so anything else changing players, fruits or walls should call invalidate_index().
+        """
+        if self._index is None:
+            geometry = board()
+            self._index = spatialhash.BoardIndex.of(self, geometry.width, geometry.height, Game().diameter)
+        return self._index
+
+    def invalidate_index(self):
+        self._index = None
 
     def get_init(self):
         return len(self.players) > 0
@@ -133,6 +108,7 @@ class GameState:
             other = asdict(other)
         for k, v in other.items():
             setattr(self, k, v)
+        self._index = None
 
     def reset(self):
         self.copy_values(GameState())
@@ -144,9 +120,50 @@ class GameState:
                 res[k] = [item.to_json() for item in v]
         return res
     
-    def serialize(self):
+    def serialize(self, board_size=None):
+        """ :param board_size: of the board snakes are on, constants.Game().board_size if not given """
+        board_size = board_size or Game().board_size
         packed = dto_pb2.GameState()
-        json_format.ParseDict(self.to_json(), packed)
+        pack_scalars(self, packed, board_size)
+        for player in self.players:
+            pack_snake(player, packed.players.add(), board_size)
+        for fruit in self.fruits:
+            pack_fruit(fruit, packed.fruits.add())
+        for wall in self.walls:
+            pack_circle(wall, packed.walls.add())
+        return packed.SerializeToString()
+
+    def serialize_delta(self, snapshot: "Snapshot", baseline: "Snapshot") -> bytes:
+        """
+        Only what changed since baseline - for receivers which know it (see SnapshotBaselines).
+        :param snapshot: Snapshot of this state, taken after its last change
+        """
+        packed = dto_pb2.GameState(baseline=baseline.numbering)
+        pack_scalars(self, packed, snapshot.board_size)
+        for k, (snake, head, points) in enumerate(zip(self.players, snapshot.heads, snapshot.tails)):
+            old_points = baseline.tails[k]
+            common = min(len(points), len(old_points))
+            changed = np.flatnonzero((points[:common] != old_points[:common]).any(axis=1))
+            if len(points) > common:
+                changed = np.concatenate((changed, np.arange(common, len(points))))
+            if head == baseline.heads[k] and len(changed) == 0 and len(points) == len(old_points):
+                continue
+            delta = packed.changed_players.add(index=k, tail_length=len(points))
+            if head != baseline.heads[k]:
+                pack_snake(snake, delta.head, snapshot.board_size, tail=False)
+            if len(changed) > TRAIL_SHARE * len(points):
+                delta.trail.extend(trail_of(points))
+            else:
+                delta.changed.extend(changed.tolist())
+                delta.tail = points[changed].tobytes()
+        removed, appended = list_delta(baseline.fruits, snapshot.fruits)
+        packed.removed_fruits.extend(removed)
+        for fruit in self.fruits[appended:]:
+            pack_fruit(fruit, packed.fruits.add())
+        removed, appended = list_delta(baseline.walls, snapshot.walls)
+        packed.removed_walls.extend(removed)
+        for wall in self.walls[appended:]:
+            pack_circle(wall, packed.walls.add())
         return packed.SerializeToString()
 
     @classmethod
@@ -160,26 +177,307 @@ class GameState:
     
     @classmethod
     def deserialize(cls, data):
+        """ Only full states - deltas need their baselines (see SnapshotBaselines) """
         packed = dto_pb2.GameState()
         packed.ParseFromString(data)
-        return cls.from_json(json_format.MessageToDict(packed, preserving_proto_field_name=True))
-    
+        return unpack_state(packed)
+
+
+# region QUANTIZATION
+# Snakes go on the wire quantized to 16 bits: coordinates to 1/65536 of the board's width or height (0.03 px on a
+# full HD board) and directions of heads to angles in 1/65536 of the full turn, while radii are sent once per state -
+# all snakes have the same one. Coordinates are read back as the middle of their step, so they are off by half a step
+# at most and always on the board, which client.PredictionHistory tolerates.
+
+QUANTIZATION_STEPS = 1 << 16
+QUANTIZED = np.dtype("<u2") # of quantized tails on the wire
+
+def quantize_position(x, y, board_size) -> tuple[int, int]:
+    """ :return: quantized position of the point's image on the board """
+    width, height = board_size
+    qx = math.floor(x / width * QUANTIZATION_STEPS) % QUANTIZATION_STEPS
+    qy = math.floor(y / height * QUANTIZATION_STEPS) % QUANTIZATION_STEPS
+    return qx, qy
+
+def dequantize_position(qx, qy, board_size) -> tuple[float, float]:
+    width, height = board_size
+    return (qx + 0.5) * width / QUANTIZATION_STEPS, (qy + 0.5) * height / QUANTIZATION_STEPS
+
+def quantize_angle(direction: Vector2) -> int:
+    return round(math.atan2(direction.y, direction.x) / math.tau * QUANTIZATION_STEPS) % QUANTIZATION_STEPS
+
+def dequantize_angle(angle) -> Vector2:
+    angle = angle * math.tau / QUANTIZATION_STEPS
+    return Vector2(math.cos(angle), math.sin(angle))
+
+def quantize_tail(rows: np.ndarray, board_size) -> np.ndarray:
+    """
+    Vectorized quantize_position.
+    :param rows: see tail_rows
+    :return: quantized x and y of every segment
+    """
+    points = np.empty((len(rows), 2), QUANTIZED)
+    points[:] = np.floor(rows[:, :2] / board_size * QUANTIZATION_STEPS) % QUANTIZATION_STEPS
+    return points
+
+def dequantize_tail(points: np.ndarray, board_size) -> np.ndarray:
+    """ :return: positions of segments """
+    return (points + 0.5) * board_size / QUANTIZATION_STEPS
+
+def tail_directions(head: Snake, positions: np.ndarray, board_size) -> np.ndarray:
+    """
+    Directions of segments at given positions, as Snake.move leaves them - each one points at the previous segment,
+    or has its direction if they are at the same place.
+    """
+    previous = np.concatenate(([(head.x, head.y)], positions[:-1]))
+    offsets = torus.of_size(*board_size).displacements(positions, previous)
+    lengths = np.hypot(*offsets.T)
+    directions = np.concatenate(([(head.direction.x, head.direction.y)], offsets))
+    nonzero = lengths > 0
+    directions[1:][nonzero] /= lengths[nonzero, None]
+    # segments at the place of the previous one take its direction, which may come from the one before it
+    source = np.maximum.accumulate(np.where(np.concatenate(([True], nonzero)), np.arange(len(directions)), 0))
+    return directions[source][1:]
+
+# endregion
+
+# region TRAILS
+# Tail segments follow the head's path, so steps between them are short and change little from one to the next.
+# Trails are the first segment's position, the first step and differences between following steps, all in
+# quantized coordinates (see quantize_tail). Sent as zigzag varints (sint32), they take about 2 bytes per segment
+# instead of 4 of the absolute coordinates, and give back exactly the same ones.
+
+def trail_of(points: np.ndarray) -> list[int]:
+    """
+    :param points: quantized tail (see quantize_tail)
+    :return: its trail, x and y of every element one after another
+    """
+    steps = np.diff(points.astype(np.int64), axis=0, prepend=np.zeros((1, 2), np.int64))
+    steps = (steps + QUANTIZATION_STEPS // 2) % QUANTIZATION_STEPS - QUANTIZATION_STEPS // 2 # shortest way around the board
+    trail = steps.copy()
+    trail[2:] -= steps[1:-1]
+    return trail.ravel().tolist()
+
+def trail_points(trail) -> np.ndarray:
+    """ :return: quantized tail of the trail (see trail_of) """
+    steps = np.array(trail, np.int64).reshape(-1, 2)
+    steps[1:] = np.cumsum(steps[1:], axis=0)
+    return (np.cumsum(steps, axis=0) % QUANTIZATION_STEPS).astype(QUANTIZED)
+
+# endregion
+
+# region PROTOBUF
+# Game objects are written straight into dto_pb2 messages and read straight from them - going through to_json and
+# json_format costs several times more. Messages are not reused, as cleared ones keep the memory of their old content.
+
+STATE_SCALARS = ["time_passed", "fruit_event_timer", "wall_event_timer", "wall_walking_event_timer", "current_speed",
+                 "timestamp", "last_delta", "numbering", "tick", "seed", "entities_version"]
+BOARD_SCALARS = ["width", "height", "radius"]
+SNAKE_HEAD_SCALARS = ["x", "y", "direction", "decision", "rotation_power", "alive"]
+POWERUP_TO_PB = {powerup: dto_pb2.Powerup.Value(powerup.name) for powerup in Powerup}
+POWERUP_FROM_PB = {value: powerup for powerup, value in POWERUP_TO_PB.items()}
+
+def pack_scalars(game_state: GameState, packed: dto_pb2.GameState, board_size):
+    for name in STATE_SCALARS:
+        setattr(packed, name, getattr(game_state, name))
+    packed.scores.extend(game_state.scores)
+    packed.width, packed.height = board_size
+    if game_state.players:
+        packed.radius = game_state.players[0].r
+
+def unpack_state(packed: dto_pb2.GameState) -> GameState:
+    res = GameState()
+    for name in STATE_SCALARS:
+        setattr(res, name, getattr(packed, name))
+    res.scores = list(packed.scores)
+    board_size = (packed.width, packed.height)
+    res.players = [unpack_snake(player, board_size, packed.radius) for player in packed.players]
+    res.fruits = [unpack_fruit(fruit) for fruit in packed.fruits]
+    res.walls = [Wall(wall.x, wall.y, wall.r) for wall in packed.walls]
+    return res
+
+def pack_circle(circle: Circle, packed):
+    packed.x = circle.x
+    packed.y = circle.y
+    packed.r = circle.r
+
+def pack_fruit(fruit: Fruit, packed: dto_pb2.Fruit):
+    pack_circle(fruit, packed)
+    packed.powerup = POWERUP_TO_PB[fruit.powerup]
+
+def unpack_fruit(packed: dto_pb2.Fruit) -> Fruit:
+    return Fruit(packed.x, packed.y, packed.r, POWERUP_FROM_PB[packed.powerup])
+
+def pack_snake(snake: Snake, packed: dto_pb2.Snake, board_size, tail=True):
+    """ :param tail: False leaves the tail out """
+    packed.x, packed.y = quantize_position(snake.x, snake.y, board_size)
+    packed.direction = quantize_angle(snake.direction)
+    packed.decision = snake.decision
+    packed.rotation_power = snake.rotation_power
+    packed.alive = snake.alive
+    packed.color.extend(snake.color)
+    for powerup, time_left in snake.powerups.items():
+        packed.powerups[powerup.name] = time_left
+    if tail:
+        packed.trail.extend(trail_of(quantize_tail(tail_rows(snake.tail), board_size)))
+
+def unpack_snake(packed: dto_pb2.Snake, board_size, radius) -> Snake:
+    color = list(packed.color)
+    x, y = dequantize_position(packed.x, packed.y, board_size)
+    snake = Snake(x, y, radius, color, direction=dequantize_angle(packed.direction))
+    snake.decision = packed.decision
+    snake.rotation_power = packed.rotation_power
+    snake.alive = packed.alive
+    for name, time_left in packed.powerups.items():
+        snake.powerups[Powerup[name]] = time_left
+    positions = dequantize_tail(trail_points(packed.trail), board_size)
+    directions = tail_directions(snake, positions, board_size)
+    if isinstance(snake.tail, TailArray):
+        snake.tail.extend(positions, directions, np.full(len(positions), radius))
+    else:
+        outline_width = int(radius / 2)
+        snake.tail = [Tail(x, y, radius, Vector2(dx, dy), color, outline_width)
+                      for (x, y), (dx, dy) in zip(positions.tolist(), directions.tolist())]
+    return snake
+
+def tail_points(data: bytes) -> np.ndarray:
+    """ :return: quantized segments sent as data (see quantize_tail) """
+    return np.frombuffer(data, QUANTIZED).reshape(-1, 2)
+
+# endregion
+
+# region SNAPSHOTS
+# Host sends every client only what changed since the last snapshot the client acknowledged (see simulation.send_game_state).
+# Most tail segments stay in place between snapshots, so deltas are several times smaller than full states.
+
+SNAPSHOT_HISTORY = 32 # snapshots kept as baselines on both sides, about 2 s of them
+TRAIL_SHARE = 0.4 # changed tail segments take about 6 bytes, whole trail about 2 per segment
+
+class Snapshot:
+    """
+    Quantized values of a game state at the time it was sent, kept by the host as a baseline of later deltas.
+    """
+
+    def __init__(self, game_state: GameState, board_size=None):
+        """ :param board_size: see GameState.serialize """
+        self.numbering = game_state.numbering
+        self.board_size = board_size or Game().board_size
+        self.heads = [head_values(snake, self.board_size) for snake in game_state.players]
+        self.tails = [quantize_tail(tail_rows(snake.tail), self.board_size) for snake in game_state.players]
+        self.fruits = [(fruit.x, fruit.y, fruit.r, fruit.powerup) for fruit in game_state.fruits]
+        self.walls = [(wall.x, wall.y, wall.r) for wall in game_state.walls]
+
+    def can_be_baseline_of(self, other: "Snapshot") -> bool:
+        # 0 marks full states
+        return self.numbering > 0 and len(self.heads) == len(other.heads) and self.board_size == other.board_size
+
+class SnapshotBaselines:
+    """
+    Snapshots received by a client lately, kept as baselines of the deltas which follow them.
+    """
+
+    def __init__(self, size=SNAPSHOT_HISTORY):
+        self.size = size
+        self._packed: dict[int, dto_pb2.GameState] = {}
+
+    def decode(self, data: bytes) -> GameState | None:
+        """ :return: None if data is a delta against an unknown snapshot - a full one has to be requested """
+        packed = dto_pb2.GameState()
+        packed.ParseFromString(data)
+        if packed.baseline:
+            baseline = self._packed.get(packed.baseline)
+            if baseline is None:
+                return None
+            packed = apply_delta(baseline, packed)
+        self._packed[packed.numbering] = packed
+        # numberings received are sparse (lost ones, skipped by SnapshotRate), so every older one has to go
+        for numbering in [numbering for numbering in self._packed if numbering <= packed.numbering - self.size]:
+            del self._packed[numbering]
+        return unpack_state(packed)
+
+def head_values(snake: Snake, board_size) -> tuple:
+    """ Everything sent about the snake but its tail """
+    return (*quantize_position(snake.x, snake.y, board_size), quantize_angle(snake.direction), snake.decision,
+            snake.rotation_power, snake.alive, tuple(snake.color), tuple(snake.powerups.items()))
+
+def tail_rows(tail: list[Tail] | TailArray) -> np.ndarray:
+    """ :return: x, y, r, direction's x and y of every segment """
+    if isinstance(tail, TailArray):
+        n = len(tail)
+        return np.column_stack((tail.positions[:n], tail.radii[:n], tail.directions[:n]))
+    return np.array([(t.x, t.y, t.r, t.direction.x, t.direction.y) for t in tail]).reshape(-1, 5)
+
+def list_delta(old: list, new: list) -> tuple[list[int], int]:
+    """
+    :return: indexes of items to remove from old and index of the first item of new to append to it, so it becomes new
+    """
+    removed = []
+    kept = 0
+    for i, item in enumerate(old):
+        if kept < len(new) and new[kept] == item:
+            kept += 1
+        else:
+            removed.append(i)
+    return removed, kept
+
+def apply_delta(baseline: dto_pb2.GameState, delta: dto_pb2.GameState) -> dto_pb2.GameState:
+    packed = dto_pb2.GameState()
+    packed.CopyFrom(baseline)
+    for name in STATE_SCALARS + BOARD_SCALARS:
+        setattr(packed, name, getattr(delta, name))
+    packed.ClearField("scores")
+    packed.scores.extend(delta.scores)
+    for change in delta.changed_players:
+        player = packed.players[change.index]
+        if change.HasField("head"):
+            head = change.head
+            for name in SNAKE_HEAD_SCALARS:
+                setattr(player, name, getattr(head, name))
+            player.ClearField("color")
+            player.color.extend(head.color)
+            player.powerups.clear()
+            player.powerups.update(head.powerups)
+        if change.trail or change.tail_length == 0:
+            player.ClearField("trail")
+            player.trail.extend(change.trail)
+            continue
+        old_points = trail_points(player.trail)[:change.tail_length]
+        points = np.zeros((change.tail_length, 2), QUANTIZED)
+        points[:len(old_points)] = old_points
+        points[list(change.changed)] = tail_points(change.tail)
+        player.ClearField("trail")
+        player.trail.extend(trail_of(points))
+    for i in reversed(delta.removed_fruits):
+        del packed.fruits[i]
+    packed.fruits.extend(delta.fruits)
+    for i in reversed(delta.removed_walls):
+        del packed.walls[i]
+    packed.walls.extend(delta.walls)
+    return packed
+
+# endregion
+
 @dataclass
 class GameInput:
+    """
+    :param tick: number of the tick before which the decision is applied
+    """
     name: str
     decision: int
-    time_passed: float
+    time_passed: float = 0.0
+    tick: int = 0
 
 @dataclass
 class GameInputs:
     controls: list[GameInput] = field(default_factory=list)
 
-    def append(self, name, decision, time_passed):
-        self.controls.append(GameInput(name, decision, time_passed))
+    def append(self, name, decision, time_passed=0.0, tick=0):
+        self.controls.append(GameInput(name, decision, time_passed, tick))
 
     def serialize(self):
         packed = dto_pb2.GameInputs()
-        json_format.ParseDict(asdict(self), packed)
+        for control in self.controls:
+            packed.controls.add(name=control.name, decision=control.decision, time_passed=control.time_passed, tick=control.tick)
         return packed.SerializeToString()
     
     @classmethod
@@ -188,38 +486,27 @@ class GameInputs:
         if data is None:
             return cls()
         packed.ParseFromString(data)
-        dict_data = json_format.MessageToDict(packed, preserving_proto_field_name=True)
-        controls = []
-        for control in dict_data.get("controls", []):
-            controls.append(GameInput(
-                name=control.get("name", ""),
-                decision=control.get("decision", Direction.FORWARD),
-                time_passed=control.get("time_passed", 0.0)
-            ))
-        return cls(controls=controls)
+        return cls(controls=[GameInput(control.name, control.decision, control.time_passed, control.tick) for control in packed.controls])
     
 if __name__ == "__main__":
     # Testing serialization
     import pprint
 
-    pygameutils.create_window("test")
+    constants.Game().board_size = (800, 600)
 
     test = GameState()
     test.init(2)
     test.fruits[0].powerup = constants.Powerup.GHOSTING
 
-    dict_data = test.to_json()
+    test.players[0].tail.append(Tail(1, 2, test.players[0].r, Vector2(0, 1)))
+    test.players[0].powerups[constants.Powerup.CRUSHING] = 2.5
 
-    packed = dto_pb2.GameState()
-    json_format.ParseDict(dict_data, packed)
-    print(packed.IsInitialized())
-    serialized = packed.SerializeToString()
-    print(len(serialized))
-    deserialized = dto_pb2.GameState()
-    deserialized.ParseFromString(serialized)
-    gs = json_format.MessageToDict(deserialized, preserving_proto_field_name=True)
-
-    test_result = GameState.from_json(gs)
+    dict_data = test.to_json()
+    serialized = test.serialize()
+    test_result = GameState.deserialize(serialized)
+    snake, result = test.players[0], test_result.players[0]
+    error = max(abs(a - b) for a, b in zip((snake.x, snake.y, *snake.tail[0]), (result.x, result.y, *result.tail[0])))
+    print(len(serialized), error) # quantization error, below half of a step
 
     print(dict_data)
     print(test_result.to_json())
@@ -1,13 +1,22 @@
 # -*- coding: utf-8 -*-
 # Generated by the protocol buffer compiler.  DO NOT EDIT!
+# NO CHECKED-IN PROTOBUF GENCODE
 # source: dto.proto
+# Protobuf Python Version: 6.31.1
 """Generated protocol buffer code."""
-from google.protobuf.internal import enum_type_wrapper
 from google.protobuf import descriptor as _descriptor
 from google.protobuf import descriptor_pool as _descriptor_pool
-from google.protobuf import message as _message
-from google.protobuf import reflection as _reflection
+from google.protobuf import runtime_version as _runtime_version
 from google.protobuf import symbol_database as _symbol_database
+from google.protobuf.internal import builder as _builder
+_runtime_version.ValidateProtobufRuntimeVersion(
+    _runtime_version.Domain.PUBLIC,
+    6,
+    31,
+    1,
+    '',
+    'dto.proto'
+)
 # @@protoc_insertion_point(imports)
 
 _sym_db = _symbol_database.Default()
@@ -15,113 +24,31 @@ _sym_db = _symbol_database.Default()
 
 
 
-DESCRIPTOR = _descriptor_pool.Default().AddSerializedFile(b'\n\tdto.proto\x12\tsnakegame\"\x1f\n\x07Vector2\x12\t\n\x01x\x18\x01 \x01(\x02\x12\t\n\x01y\x18\x02 \x01(\x02\"N\n\x04Tail\x12\t\n\x01x\x18\x01 \x01(\x02\x12\t\n\x01y\x18\x02 \x01(\x02\x12\t\n\x01r\x18\x03 \x01(\x02\x12%\n\tdirection\x18\x04 \x01(\x0b\x32\x12.snakegame.Vector2\")\n\x06\x43ircle\x12\t\n\x01x\x18\x01 \x01(\x02\x12\t\n\x01y\x18\x02 \x01(\x02\x12\t\n\x01r\x18\x03 \x01(\x02\"M\n\x05\x46ruit\x12\t\n\x01x\x18\x01 \x01(\x02\x12\t\n\x01y\x18\x02 \x01(\x02\x12\t\n\x01r\x18\x03 \x01(\x02\x12#\n\x07powerup\x18\x04 \x01(\x0e\x32\x12.snakegame.Powerup\"\x99\x02\n\x05Snake\x12\t\n\x01x\x18\x01 \x01(\x02\x12\t\n\x01y\x18\x02 \x01(\x02\x12\t\n\x01r\x18\x03 \x01(\x02\x12\x10\n\x08\x64\x65\x63ision\x18\x04 \x01(\x05\x12%\n\tdirection\x18\x05 \x01(\x0b\x32\x12.snakegame.Vector2\x12\x16\n\x0erotation_power\x18\x06 \x01(\x05\x12\r\n\x05\x61live\x18\x07 \x01(\x08\x12\x1d\n\x04tail\x18\x08 \x03(\x0b\x32\x0f.snakegame.Tail\x12\r\n\x05\x63olor\x18\t \x03(\r\x12\x30\n\x08powerups\x18\n \x03(\x0b\x32\x1e.snakegame.Snake.PowerupsEntry\x1a/\n\rPowerupsEntry\x12\x0b\n\x03key\x18\x01 \x01(\t\x12\r\n\x05value\x18\x02 \x01(\x02:\x02\x38\x01\"\xbf\x02\n\tGameState\x12!\n\x07players\x18\x01 \x03(\x0b\x32\x10.snakegame.Snake\x12 \n\x06\x66ruits\x18\x02 \x03(\x0b\x32\x10.snakegame.Fruit\x12 \n\x05walls\x18\x03 \x03(\x0b\x32\x11.snakegame.Circle\x12\x13\n\x0btime_passed\x18\x04 \x01(\x02\x12\x19\n\x11\x66ruit_event_timer\x18\x05 \x01(\x02\x12\x18\n\x10wall_event_timer\x18\x06 \x01(\x02\x12 \n\x18wall_walking_event_timer\x18\x07 \x01(\x02\x12\x15\n\rcurrent_speed\x18\x08 \x01(\x05\x12\x0e\n\x06scores\x18\t \x03(\x05\x12\x11\n\ttimestamp\x18\n \x01(\x01\x12\x12\n\nlast_delta\x18\x0b \x01(\x02\x12\x11\n\tnumbering\x18\x0c \x01(\x05\"@\n\tGameInput\x12\x0c\n\x04name\x18\x01 \x01(\t\x12\x10\n\x08\x64\x65\x63ision\x18\x02 \x01(\x05\x12\x13\n\x0btime_passed\x18\x03 \x01(\x02\"4\n\nGameInputs\x12&\n\x08\x63ontrols\x18\x01 \x03(\x0b\x32\x14.snakegame.GameInput*T\n\x07Powerup\x12\x08\n\x04NONE\x10\x00\x12\x10\n\x0cWALL_WALKING\x10\x01\x12\x0c\n\x08\x43RUSHING\x10\x02\x12\x11\n\rWEIRD_WALKING\x10\x03\x12\x0c\n\x08GHOSTING\x10\x04\x62\x06proto3')
-
-_POWERUP = DESCRIPTOR.enum_types_by_name['Powerup']
-Powerup = enum_type_wrapper.EnumTypeWrapper(_POWERUP)
-NONE = 0
-WALL_WALKING = 1
-CRUSHING = 2
-WEIRD_WALKING = 3
-GHOSTING = 4
-
-
-_VECTOR2 = DESCRIPTOR.message_types_by_name['Vector2']
-_TAIL = DESCRIPTOR.message_types_by_name['Tail']
-_CIRCLE = DESCRIPTOR.message_types_by_name['Circle']
-_FRUIT = DESCRIPTOR.message_types_by_name['Fruit']
-_SNAKE = DESCRIPTOR.message_types_by_name['Snake']
-_SNAKE_POWERUPSENTRY = _SNAKE.nested_types_by_name['PowerupsEntry']
-_GAMESTATE = DESCRIPTOR.message_types_by_name['GameState']
-_GAMEINPUT = DESCRIPTOR.message_types_by_name['GameInput']
-_GAMEINPUTS = DESCRIPTOR.message_types_by_name['GameInputs']
-Vector2 = _reflection.GeneratedProtocolMessageType('Vector2', (_message.Message,), {
-  'DESCRIPTOR' : _VECTOR2,
-  '__module__' : 'dto_pb2'
-  # @@protoc_insertion_point(class_scope:snakegame.Vector2)
-  })
-_sym_db.RegisterMessage(Vector2)
-
-Tail = _reflection.GeneratedProtocolMessageType('Tail', (_message.Message,), {
-  'DESCRIPTOR' : _TAIL,
-  '__module__' : 'dto_pb2'
-  # @@protoc_insertion_point(class_scope:snakegame.Tail)
-  })
-_sym_db.RegisterMessage(Tail)
-
-Circle = _reflection.GeneratedProtocolMessageType('Circle', (_message.Message,), {
-  'DESCRIPTOR' : _CIRCLE,
-  '__module__' : 'dto_pb2'
-  # @@protoc_insertion_point(class_scope:snakegame.Circle)
-  })
-_sym_db.RegisterMessage(Circle)
-
-Fruit = _reflection.GeneratedProtocolMessageType('Fruit', (_message.Message,), {
-  'DESCRIPTOR' : _FRUIT,
-  '__module__' : 'dto_pb2'
-  # @@protoc_insertion_point(class_scope:snakegame.Fruit)
-  })
-_sym_db.RegisterMessage(Fruit)
-
-Snake = _reflection.GeneratedProtocolMessageType('Snake', (_message.Message,), {
-
-  'PowerupsEntry' : _reflection.GeneratedProtocolMessageType('PowerupsEntry', (_message.Message,), {
-    'DESCRIPTOR' : _SNAKE_POWERUPSENTRY,
-    '__module__' : 'dto_pb2'
-    # @@protoc_insertion_point(class_scope:snakegame.Snake.PowerupsEntry)
-    })
-  ,
-  'DESCRIPTOR' : _SNAKE,
-  '__module__' : 'dto_pb2'
-  # @@protoc_insertion_point(class_scope:snakegame.Snake)
-  })
-_sym_db.RegisterMessage(Snake)
-_sym_db.RegisterMessage(Snake.PowerupsEntry)
-
-GameState = _reflection.GeneratedProtocolMessageType('GameState', (_message.Message,), {
-  'DESCRIPTOR' : _GAMESTATE,
-  '__module__' : 'dto_pb2'
-  # @@protoc_insertion_point(class_scope:snakegame.GameState)
-  })
-_sym_db.RegisterMessage(GameState)
-
-GameInput = _reflection.GeneratedProtocolMessageType('GameInput', (_message.Message,), {
-  'DESCRIPTOR' : _GAMEINPUT,
-  '__module__' : 'dto_pb2'
-  # @@protoc_insertion_point(class_scope:snakegame.GameInput)
-  })
-_sym_db.RegisterMessage(GameInput)
-
-GameInputs = _reflection.GeneratedProtocolMessageType('GameInputs', (_message.Message,), {
-  'DESCRIPTOR' : _GAMEINPUTS,
-  '__module__' : 'dto_pb2'
-  # @@protoc_insertion_point(class_scope:snakegame.GameInputs)
-  })
-_sym_db.RegisterMessage(GameInputs)
-
-if _descriptor._USE_C_DESCRIPTORS == False:
-
-  DESCRIPTOR._options = None
-  _SNAKE_POWERUPSENTRY._options = None
-  _SNAKE_POWERUPSENTRY._serialized_options = b'8\001'
-  _POWERUP._serialized_start=985
-  _POWERUP._serialized_end=1069
-  _VECTOR2._serialized_start=24
-  _VECTOR2._serialized_end=55
-  _TAIL._serialized_start=57
-  _TAIL._serialized_end=135
-  _CIRCLE._serialized_start=137
-  _CIRCLE._serialized_end=178
-  _FRUIT._serialized_start=180
-  _FRUIT._serialized_end=257
-  _SNAKE._serialized_start=260
-  _SNAKE._serialized_end=541
-  _SNAKE_POWERUPSENTRY._serialized_start=494
-  _SNAKE_POWERUPSENTRY._serialized_end=541
-  _GAMESTATE._serialized_start=544
-  _GAMESTATE._serialized_end=863
-  _GAMEINPUT._serialized_start=865
-  _GAMEINPUT._serialized_end=929
-  _GAMEINPUTS._serialized_start=931
-  _GAMEINPUTS._serialized_end=983
+DESCRIPTOR = _descriptor_pool.Default().AddSerializedFile(b'\n\tdto.proto\x12\tsnakegame\")\n\x06\x43ircle\x12\t\n\x01x\x18\x01 \x01(\x02\x12\t\n\x01y\x18\x02 \x01(\x02\x12\t\n\x01r\x18\x03 \x01(\x02\"M\n\x05\x46ruit\x12\t\n\x01x\x18\x01 \x01(\x02\x12\t\n\x01y\x18\x02 \x01(\x02\x12\t\n\x01r\x18\x03 \x01(\x02\x12#\n\x07powerup\x18\x04 \x01(\x0e\x32\x12.snakegame.Powerup\"\x8e\x02\n\x05Snake\x12\x10\n\x08\x64\x65\x63ision\x18\x04 \x01(\x05\x12\x16\n\x0erotation_power\x18\x06 \x01(\x05\x12\r\n\x05\x61live\x18\x07 \x01(\x08\x12\r\n\x05\x63olor\x18\t \x03(\r\x12\x30\n\x08powerups\x18\n \x03(\x0b\x32\x1e.snakegame.Snake.PowerupsEntry\x12\t\n\x01x\x18\x0b \x01(\r\x12\t\n\x01y\x18\x0c \x01(\r\x12\x11\n\tdirection\x18\r \x01(\r\x12\r\n\x05trail\x18\x0f \x03(\x11\x1a/\n\rPowerupsEntry\x12\x0b\n\x03key\x18\x01 \x01(\t\x12\r\n\x05value\x18\x02 \x01(\x02:\x02\x38\x01J\x04\x08\x01\x10\x02J\x04\x08\x02\x10\x03J\x04\x08\x03\x10\x04J\x04\x08\x05\x10\x06J\x04\x08\x08\x10\tJ\x04\x08\x0e\x10\x0f\"\x9b\x04\n\tGameState\x12!\n\x07players\x18\x01 \x03(\x0b\x32\x10.snakegame.Snake\x12 \n\x06\x66ruits\x18\x02 \x03(\x0b\x32\x10.snakegame.Fruit\x12 \n\x05walls\x18\x03 \x03(\x0b\x32\x11.snakegame.Circle\x12\x13\n\x0btime_passed\x18\x04 \x01(\x02\x12\x19\n\x11\x66ruit_event_timer\x18\x05 \x01(\x02\x12\x18\n\x10wall_event_timer\x18\x06 \x01(\x02\x12 \n\x18wall_walking_event_timer\x18\x07 \x01(\x02\x12\x15\n\rcurrent_speed\x18\x08 \x01(\x05\x12\x0e\n\x06scores\x18\t \x03(\x05\x12\x11\n\ttimestamp\x18\n \x01(\x01\x12\x12\n\nlast_delta\x18\x0b \x01(\x02\x12\x11\n\tnumbering\x18\x0c \x01(\x05\x12\x0c\n\x04tick\x18\r \x01(\x05\x12\x0c\n\x04seed\x18\x0e \x01(\r\x12\x18\n\x10\x65ntities_version\x18\x0f \x01(\r\x12\x10\n\x08\x62\x61seline\x18\x11 \x01(\r\x12.\n\x0f\x63hanged_players\x18\x12 \x03(\x0b\x32\x15.snakegame.SnakeDelta\x12\x16\n\x0eremoved_fruits\x18\x13 \x03(\r\x12\x15\n\rremoved_walls\x18\x14 \x03(\r\x12\r\n\x05width\x18\x15 \x01(\r\x12\x0e\n\x06height\x18\x16 \x01(\r\x12\x0e\n\x06radius\x18\x17 \x01(\x02J\x04\x08\x10\x10\x11\"\x84\x01\n\nSnakeDelta\x12\r\n\x05index\x18\x01 \x01(\r\x12\x1e\n\x04head\x18\x02 \x01(\x0b\x32\x10.snakegame.Snake\x12\x13\n\x0btail_length\x18\x03 \x01(\r\x12\x0f\n\x07\x63hanged\x18\x04 \x03(\r\x12\x0c\n\x04tail\x18\x06 \x01(\x0c\x12\r\n\x05trail\x18\x07 \x03(\x11J\x04\x08\x05\x10\x06\"N\n\tGameInput\x12\x0c\n\x04name\x18\x01 \x01(\t\x12\x10\n\x08\x64\x65\x63ision\x18\x02 \x01(\x05\x12\x13\n\x0btime_passed\x18\x03 \x01(\x02\x12\x0c\n\x04tick\x18\x04 \x01(\x05\"4\n\nGameInputs\x12&\n\x08\x63ontrols\x18\x01 \x03(\x0b\x32\x14.snakegame.GameInput*T\n\x07Powerup\x12\x08\n\x04NONE\x10\x00\x12\x10\n\x0cWALL_WALKING\x10\x01\x12\x0c\n\x08\x43RUSHING\x10\x02\x12\x11\n\rWEIRD_WALKING\x10\x03\x12\x0c\n\x08GHOSTING\x10\x04\x62\x06proto3')
+
+_globals = globals()
+_builder.BuildMessageAndEnumDescriptors(DESCRIPTOR, _globals)
+_builder.BuildTopDescriptorsAndMessages(DESCRIPTOR, 'dto_pb2', _globals)
+if not _descriptor._USE_C_DESCRIPTORS:
+  DESCRIPTOR._loaded_options = None
+  _globals['_SNAKE_POWERUPSENTRY']._loaded_options = None
+  _globals['_SNAKE_POWERUPSENTRY']._serialized_options = b'8\001'
+  _globals['_POWERUP']._serialized_start=1230
+  _globals['_POWERUP']._serialized_end=1314
+  _globals['_CIRCLE']._serialized_start=24
+  _globals['_CIRCLE']._serialized_end=65
+  _globals['_FRUIT']._serialized_start=67
+  _globals['_FRUIT']._serialized_end=144
+  _globals['_SNAKE']._serialized_start=147
+  _globals['_SNAKE']._serialized_end=417
+  _globals['_SNAKE_POWERUPSENTRY']._serialized_start=334
+  _globals['_SNAKE_POWERUPSENTRY']._serialized_end=381
+  _globals['_GAMESTATE']._serialized_start=420
+  _globals['_GAMESTATE']._serialized_end=959
+  _globals['_SNAKEDELTA']._serialized_start=962
+  _globals['_SNAKEDELTA']._serialized_end=1094
+  _globals['_GAMEINPUT']._serialized_start=1096
+  _globals['_GAMEINPUT']._serialized_end=1174
+  _globals['_GAMEINPUTS']._serialized_start=1176
+  _globals['_GAMEINPUTS']._serialized_end=1228
 # @@protoc_insertion_point(module_scope)
@@ -7,22 +7,319 @@ import logging
 import typing
 import randomname
 import functools
+import random
+import socket
+import struct
+import time
+import zlib
 
 LOG = logging.getLogger("gamenetwork")
-END_SEQ = b"\0---\0"
-START_SEQ = b"\0+++\0"
-STOP_SEQ = b"\0***\0"
+
+# Every message is a frame: header and payload. Header holds the length of the payload, its kind, the opcode
+# of the action (see opcode_of) and the session of the client (see sessions). Frames follow one another in TCP streams
+# and datagrams.
+FRAME_HEADER = struct.Struct("!IBII")
+MAX_FRAME_SIZE = 1 << 24 # anything longer is taken for a broken stream
+PAYLOAD_NONE = 0
+PAYLOAD_BYTES = 1
+PAYLOAD_JSON = 2
+MAX_QUEUED_SIZE = 1 << 22 # bytes waiting in one outbox - a TCP client that does not read that much is disconnected
+MAX_DATAGRAM_SIZE = 1400 # frames are put together in datagrams up to that size, so they are not fragmented
+# Every datagram is a packet: header, ids of the reliable messages in it and frames, reliable ones first (see Channel).
+# Header holds the session, sequence number of the packet, the newest sequence number received from the other side
+# with a bitfield of the 32 before it and the number of reliable messages.
+PACKET_HEADER = struct.Struct("!IHHIB")
+RESEND_INTERVAL = 0.1 # seconds before a reliable message not acknowledged yet is sent again
+HANDSHAKE_INTERVAL = 0.5 # seconds between requests for an id of a client without TCP
+CONNECTION_TIMEOUT = 10 # seconds without a datagram after which a connection without TCP is lost
+KEEPALIVE_INTERVAL = 1 # seconds between hole punching messages and pings (see LinkQuality)
+
+class FramingError(ValueError):
+    """ Data is not a valid sequence of frames """
+
+class Outbox:
+    """
+    Frames waiting to be sent through one connection. They are written together once per turn of the event loop,
+    a frame put with latest_only replaces the one of the same action still waiting (e.g. older game state).
+    Nothing is written while the transport's buffer is full (see pause_writing).
+    """
+    def __init__(self, write: typing.Callable[[list[bytes]], int]):
+        """ :param write: writes frames (none too - a channel may have something to send on its own), returns the number of writes """
+        self.write = write
+        self.frames: list[bytes] = []
+        self.latest: dict[int, int] = {} # opcode -> index of its frame in frames
+        self.size = 0 # bytes in frames
+        self.paused = False
+        self.scheduled = False
+        # totals since the connection was made
+        self.sent = 0
+        self.writes = 0
+        self.replaced = 0
+
+    def put(self, opcode: int, frame: bytes, latest_only = False) -> bool:
+        """ :return: False if the outbox has grown over MAX_QUEUED_SIZE """
+        if latest_only:
+            index = self.latest.get(opcode)
+            if index is not None:
+                self.size -= len(self.frames[index])
+                self.frames[index] = b""
+                self.replaced += 1
+            self.latest[opcode] = len(self.frames)
+        self.frames.append(frame)
+        self.size += len(frame)
+        self.schedule()
+        return self.size <= MAX_QUEUED_SIZE
+
+    def pause(self):
+        self.paused = True
+
+    def resume(self):
+        self.paused = False
+        self.schedule()
+
+    def schedule(self):
+        """ Flushes the outbox at the end of this turn of the event loop """
+        if not self.scheduled and not self.paused:
+            self.scheduled = True
+            asyncio.get_running_loop().call_soon(self.flush)
+
+    def flush(self):
+        self.scheduled = False
+        if self.paused:
+            return
+        frames = [frame for frame in self.frames if frame]
+        self.clear()
+        self.sent += len(frames)
+        self.writes += self.write(frames)
+
+    def clear(self):
+        self.frames.clear()
+        self.latest.clear()
+        self.size = 0
+
+    def stats(self) -> dict:
+        return {"frames": sum(1 for frame in self.frames if frame), "bytes": self.size,
+                "paused": self.paused, "sent": self.sent, "writes": self.writes, "replaced": self.replaced}
+
+def _newer(sequence: int, other: int) -> bool:
+    """ Sequence numbers wrap around, the newer one is less than half of the range ahead """
+    return sequence != other and (sequence - other) & 0xFFFF < 0x8000
+
+class Channel:
+    """
+    Messages of one connection over UDP. Reliable ones are delivered once and in order - they are sent again
+    until a packet with them is acknowledged. Unreliable ones are sent once and dropped if they come after a newer
+    one of the same action. Every packet acknowledges the 33 latest packets received from the other side.
+    """
+    def __init__(self):
+        self.sequence = 1 # of the next packet, 0 is for packets outside of channels (see _bare_packet)
+        self.next_id = 0 # of the next reliable message
+        self.reliable: dict[int, list] = {} # id -> [frame, time it was last sent] of reliable messages not acknowledged yet
+        self.in_flight: dict[int, list[int]] = {} # sequence of a packet with reliable messages -> their ids
+        self.size = 0 # bytes of reliable messages
+        # received
+        self.remote = 0 # newest sequence number received
+        self.remote_bits = 0 # bit n - packet remote - 1 - n has been received
+        self.ack_due = False # reliable messages have come, the other side waits for an acknowledgement
+        self.expected = 0 # id of the next reliable message to be delivered
+        self.early: dict[int, dict] = {} # id -> reliable message received before the expected one
+        self.newest: dict[int, int] = {} # opcode -> sequence number of the packet with its newest unreliable message
+        self.last_received = time.monotonic()
+        # totals since the connection was made
+        self.resent = 0
+        self.dropped = 0
+        self.remote_span = 0 # packets before the newest one received covered by remote_bits (up to 32)
+        self.remote_ack, self.remote_acks = 0, 0 # newest of our packets the other side has got and bitfield of the 32 before it
+        self.wrapped = False # sequence numbers have wrapped around
+
+    def queue(self, frame: bytes) -> bool:
+        """ :return: False if more than MAX_QUEUED_SIZE bytes wait for acknowledgement """
+        self.reliable[self.next_id] = [frame, None]
+        self.next_id = (self.next_id + 1) & 0xFFFF
+        self.size += len(frame)
+        return self.size <= MAX_QUEUED_SIZE and len(self.reliable) < 0x8000
+
+    def packets(self, frames: list[bytes], session: int, now: float) -> list[bytes]:
+        """
+        :param frames: unreliable ones
+        :return: datagrams with them and reliable messages due to be sent (again), an empty one if there is only an acknowledgement to send
+        """
+        due = [(id, message) for id, message in self.reliable.items() if message[1] is None or now - message[1] >= RESEND_INTERVAL]
+        packets, ids, chunk, size = [], [], [], PACKET_HEADER.size
+        for id, frame in [(id, message[0]) for id, message in due] + [(None, frame) for frame in frames]:
+            cost = len(frame) + (2 if id is not None else 0)
+            if chunk and (size + cost > MAX_DATAGRAM_SIZE or id is not None and len(ids) == 255):
+                packets.append(self._packet(session, ids, chunk))
+                ids, chunk, size = [], [], PACKET_HEADER.size
+            if id is not None:
+                ids.append(id)
+            chunk.append(frame)
+            size += cost
+        if chunk or self.ack_due:
+            packets.append(self._packet(session, ids, chunk))
+        for _, message in due:
+            if message[1] is not None:
+                self.resent += 1
+            message[1] = now
+        return packets
+
+    def _packet(self, session: int, ids: list[int], frames: list[bytes]) -> bytes:
+        sequence = self.sequence
+        self.sequence = self.sequence % 0xFFFF + 1
+        self.wrapped |= self.sequence == 1
+        if ids:
+            self.in_flight[sequence] = ids
+            if len(self.in_flight) > 1024: # the oldest has been lost, its messages went again in later packets
+                del self.in_flight[next(iter(self.in_flight))]
+        self.ack_due = False
+        header = PACKET_HEADER.pack(session, sequence, self.remote, self.remote_bits, len(ids))
+        return b"".join([header, struct.pack(f"!{len(ids)}H", *ids), *frames])
+
+    def receive(self, sequence: int, ack: int, ack_bits: int, ids: tuple[int], messages: list[dict]) -> list[dict]:
+        """
+        :param messages: of the packet, the first len(ids) are reliable
+        :return: messages to be delivered now
+        """
+        self.last_received = time.monotonic()
+        if ack and not _newer(ack, self.sequence): # reliable messages in packets acknowledged by the other side have arrived
+            self.remote_ack, self.remote_acks = ack, ack_bits
+            for n in range(33):
+                if n == 0 or ack_bits >> (n - 1) & 1:
+                    for id in self.in_flight.pop((ack - n) & 0xFFFF, ()):
+                        message = self.reliable.pop(id, None)
+                        if message:
+                            self.size -= len(message[0])
+
+        duplicate = False
+        if self.remote == 0:
+            self.remote = sequence
+        elif _newer(sequence, self.remote):
+            shift = (sequence - self.remote) & 0xFFFF
+            self.remote_bits = ((self.remote_bits << 1 | 1) << (shift - 1)) & 0xFFFFFFFF
+            self.remote_span = min(32, self.remote_span + shift)
+            self.remote = sequence
+        else:
+            distance = (self.remote - sequence) & 0xFFFF
+            bit = 1 << (distance - 1) if 0 < distance <= 32 else 0
+            duplicate = distance == 0 or bool(self.remote_bits & bit)
+            self.remote_bits |= bit
+
+        delivered = []
+        if ids:
+            self.ack_due = True
+            for id, message in zip(ids, messages):
+                if (id - self.expected) & 0xFFFF < 0x8000: # not delivered yet
+                    self.early[id] = message
+            while self.expected in self.early:
+                delivered.append(self.early.pop(self.expected))
+                self.expected = (self.expected + 1) & 0xFFFF
+        if not duplicate:
+            for message in messages[len(ids):]:
+                newest = self.newest.get(message["opcode"])
+                if newest is None or newest == sequence or _newer(sequence, newest):
+                    self.newest[message["opcode"]] = sequence
+                    delivered.append(message)
+                else:
+                    self.dropped += 1
+        return delivered
+
+    def loss(self) -> tuple[float, float]:
+        """ :return: fractions of the last (up to 33) packets lost on their way here and there, None before any has arrived """
+        def lost(newest, bits, span):
+            return 1 - ((bits & ((1 << span) - 1)).bit_count() + 1) / (span + 1) if newest else None
+        return (lost(self.remote, self.remote_bits, self.remote_span),
+                lost(self.remote_ack, self.remote_acks, 32 if self.wrapped else min(32, self.remote_ack - 1)))
+
+    def stats(self) -> dict:
+        return {"reliable": len(self.reliable), "bytes": self.size, "resent": self.resent, "dropped": self.dropped}
+
+class LinkQuality:
+    """
+    Round-trip time, its jitter and packet loss of one connection, smoothed like TCP's SRTT and RTTVAR.
+    Every KEEPALIVE_INTERVAL both sides ping each other over UDP, an answer updates them. None until the first one.
+    """
+    GAIN = 1 / 8
+    JITTER_GAIN = 1 / 4
+
+    def __init__(self):
+        self.rtt: float = None # seconds
+        self.jitter: float = None # mean deviation of rtt, seconds
+        self.loss_in: float = None # fraction of packets from the other side lost
+        self.loss_out: float = None # fraction of packets to the other side lost
+        self.samples = 0
+
+    def update(self, rtt: float, loss: tuple[float, float]):
+        if self.rtt is None:
+            self.rtt, self.jitter = rtt, rtt / 2
+        else:
+            self.jitter += self.JITTER_GAIN * (abs(self.rtt - rtt) - self.jitter)
+            self.rtt += self.GAIN * (rtt - self.rtt)
+        loss_in, loss_out = loss
+        if loss_in is not None:
+            self.loss_in = loss_in if self.loss_in is None else self.loss_in + self.GAIN * (loss_in - self.loss_in)
+        if loss_out is not None:
+            self.loss_out = loss_out if self.loss_out is None else self.loss_out + self.GAIN * (loss_out - self.loss_out)
+        self.samples += 1
+
+    def to_json(self) -> dict:
+        return {"rtt_ms": self.rtt and self.rtt * 1000, "jitter_ms": self.jitter and self.jitter * 1000,
+                "loss_in": self.loss_in, "loss_out": self.loss_out, "samples": self.samples}
+
+def _bare_packet(frame: bytes) -> bytes:
+    """ Packet outside of any channel - e.g. for the handshake of a client without TCP, before it has a session """
+    return PACKET_HEADER.pack(0, 0, 0, 0, 0) + frame
 
 class Connection:
-    def __init__(self, transport: asyncio.Transport, protocol: asyncio.Protocol, udp_port: int):
+    def __init__(self, endpoint: "NetworkEndpoint", transport: asyncio.Transport, protocol: asyncio.Protocol, udp_port: int, session: int = 0, host: str = None):
+        """ :param transport: None for a client without TCP (see connect_to_server), its UDP address is host and udp_port """
+        self.endpoint = endpoint
         self.transport = transport
         self.protocol = protocol
         self.udp_port = udp_port
+        self.session = session
+        self.host = protocol.transport_address[0] if protocol else host
+        self.outbox = Outbox(self._write)
+        self.udp_outbox = Outbox(self._write_udp)
+        self.channel = Channel()
+        self.link = LinkQuality()
+        self._resend: asyncio.TimerHandle = None
     @property
     def udp_address(self):
-        return (self.protocol.transport_address[0], self.udp_port) if self.udp_port else None
+        return (self.host, self.udp_port) if self.udp_port else None
+    def _write(self, frames: list[bytes]) -> int:
+        if not frames or self.transport.is_closing():
+            return 0
+        self.transport.write(b"".join(frames))
+        return 1
+    def _write_udp(self, frames: list[bytes]) -> int:
+        udp_connection = self.endpoint.udp_connection
+        address = self.udp_address or self.endpoint.udp_server_address
+        if not (udp_connection and address):
+            return 0
+        packets = self.channel.packets(frames, self.session, time.monotonic())
+        for packet in packets:
+            udp_connection.transport.sendto(packet, address)
+        if self.channel.reliable and self._resend is None:
+            self._resend = asyncio.get_running_loop().call_later(RESEND_INTERVAL, self._resend_reliable)
+        return len(packets)
+    def _resend_reliable(self):
+        self._resend = None
+        self.udp_outbox.schedule()
+    def flush(self):
+        """ Writes whatever waits in the outboxes, even if the transport's buffer is full """
+        for outbox in (self.outbox, self.udp_outbox):
+            outbox.paused = False
+            outbox.flush()
     def close(self):
-        if not self.transport.is_closing():
+        if self.transport is None: # the other side would wait for CONNECTION_TIMEOUT otherwise
+            opcode = opcode_of("_disconnect")
+            self.udp_outbox.put(opcode, _frame(opcode, PAYLOAD_NONE, b"", self.session))
+        self.flush()
+        for outbox in (self.outbox, self.udp_outbox): # nothing more goes out
+            outbox.pause()
+        if self._resend:
+            self._resend.cancel()
+        if self.transport and not self.transport.is_closing():
             self.transport.close()
         
 class UDPConnection:
@@ -33,80 +330,119 @@ class UDPConnection:
         if not self.transport.is_closing():
             self.transport.close()
 
-tcp_connections: dict[str, Connection] = {} # There are multiple connections for server only
-udp_connection: UDPConnection = None
-server: asyncio.Server = None
-listener = None
-udp_server_address = None
-
 def repr_addr(address: tuple[str, int]):
     return address[0] + ":" + str(address[1])
 
-def _get_sendready_data(action: str, data = None, _id = None) -> bytes:
-    _id = _id or ""
-    is_bytes = b"b"
-    if data is None:
-        data = b""
-    elif not isinstance(data, bytes):
-        data = json.dumps(data).encode()
-        is_bytes = b"j"
-
-    return START_SEQ + action.encode() + STOP_SEQ + _id.encode() + STOP_SEQ + is_bytes + data + END_SEQ
-
-def _get_readready_data_generator(bytestream: bytes) -> typing.Generator[typing.Any, None, None]:
-    search_start = 0
-    def segment():
-        nonlocal search_start
-        return bytestream[search_start:]
-    while True:
-        start = segment().find(START_SEQ)
-        end = segment().find(END_SEQ)
-        if end < start:
-            search_start += start
-            start = 0
-            end = segment().find(END_SEQ)
-        if start == -1 or end == -1:
+_opcodes: dict[str, int] = {}
+_action_names: dict[int, str] = {}
+
+def opcode_of(action: str) -> int:
+    """
+    :return: number standing for the action on the wire - a checksum of its name, so it is the same in every process
+        (32 bits - with 16 of them some of this repo's actions already collide)
+    :raises ValueError: another action known to this process has the same opcode
+    """
+    opcode = _opcodes.get(action)
+    if opcode is None:
+        opcode = zlib.crc32(action.encode())
+        other = _action_names.setdefault(opcode, action)
+        if other != action:
+            raise ValueError(f"Actions '{action}' and '{other}' have the same opcode, one of them has to be renamed")
+        _opcodes[action] = opcode
+    return opcode
+
+def _payload(data) -> tuple[int, bytes]:
+    """ :return: kind of the payload and the payload """
+    if data is None or data == b"":
+        return PAYLOAD_NONE, b""
+    if isinstance(data, bytes):
+        return PAYLOAD_BYTES, data
+    return PAYLOAD_JSON, json.dumps(data).encode()
+
+def _frame(opcode: int, kind: int, payload: bytes, session: int) -> bytes:
+    return FRAME_HEADER.pack(len(payload), kind, opcode, session) + payload
+
+def _frames(view: memoryview, sessions: dict[int, str] = None) -> typing.Generator[tuple[dict, int], None, None]:
+    """
+    Reads complete frames from the start of view, an incomplete one at its end is left for later.
+    :param sessions: of the endpoint reading them, to tell the ids of their senders (see NetworkEndpoint.sessions)
+    :return: messages with the number of bytes read up to the end of each of them
+    :raises FramingError: view does not start with frames
+    """
+    offset = 0
+    while len(view) - offset >= FRAME_HEADER.size:
+        length, kind, opcode, session = FRAME_HEADER.unpack_from(view, offset)
+        if length > MAX_FRAME_SIZE or kind > PAYLOAD_JSON:
+            raise FramingError(f"Invalid frame header at byte {offset}")
+        start = offset + FRAME_HEADER.size
+        end = start + length
+        if end > len(view):
             return
-        message = segment()[start + len(START_SEQ):end]
-        attrs = message.split(STOP_SEQ)
-        action = attrs[0].decode()
-        _id = attrs[1].decode() if attrs[1] != b"" else None
-        is_bytes = attrs[2][:1]
-        data = json.loads(attrs[2][1:]) if is_bytes == b"j" else attrs[2][1:]
-        data = data if data != b"" else None
+        data = None
+        if kind == PAYLOAD_BYTES:
+            data = bytes(view[start:end])
+        elif kind == PAYLOAD_JSON:
+            data = json.loads(bytes(view[start:end]))
         yield {
-            "action": action,
+            "opcode": opcode,
+            "action": _action_names.get(opcode), # None if this process knows no such action
             "data": data,
-            "_id": _id
-        }
-        search_start += end + len(END_SEQ)
-    
-def _distribute_data(data: bytes, addr, transport=None, protocol=None):
-    original_data = data
-    try:
-        data = _get_readready_data_generator(data)
-        # data = toolz.unique(data, lambda x: x["action"])
-    except Exception as e: # I don't know what can go wrong here so I will leave that 'except' and wait...
-        LOG.error(f"Error while processing data: {original_data}")
-        raise e
-    for d in data:
-        action: str = d["action"]
-        data = d["data"]
-        _id = d["_id"]
-        listener._prepare(_id, addr, transport, protocol)
-        listener.interceptor(action, data)
-        # execute actions for fully connected connections or internal actions
-        if tcp_connections.get(_id) or action.startswith("_"):
-            method = getattr(listener, "action_" + action, None)
-            if method:
-                method(data)
-            else:
-                LOG.warning(f"Action '{action}' from {_id} is not registered in network listener!")
+            "_id": sessions.get(session) if sessions else None
+        }, end
+        offset = end
+
+class FrameBuffer:
+    """
+    Reassembles frames of a TCP stream, which arrive split across reads in any way.
+    Frames are read in place, only bytes of an incomplete frame are kept until the rest of it comes.
+    """
+
+    def __init__(self, sessions: dict[int, str] = None):
+        self._pending = bytearray()
+        self._sessions = sessions
+
+    def feed(self, data: bytes) -> list[dict]:
+        """
+        :return: messages completed by data
+        :raises FramingError: the stream is broken, nothing more can be read from it
+        """
+        if self._pending:
+            self._pending += data
+            data = self._pending
+        messages = []
+        read = 0
+        with memoryview(data) as view:
+            for message, read in _frames(view, self._sessions):
+                messages.append(message)
+        if data is self._pending:
+            del self._pending[:read]
+        else:
+            self._pending += data[read:]
+        return messages
+
+def _get_readready_data_generator(bytestream: bytes, sessions: dict[int, str] = None) -> typing.Generator[typing.Any, None, None]:
+    """ Messages of complete data (a datagram, a handshake) - a malformed rest of it is dropped """
+    with memoryview(bytestream) as view:
+        try:
+            for message, _ in _frames(view, sessions):
+                yield message
+        except FramingError as e:
+            LOG.warning(f"Dropping malformed data: {e}")
+
+async def read_frame(reader: asyncio.StreamReader) -> bytes:
+    """ :return: the first frame coming from the stream (e.g. a handshake, see handshake_hello) """
+    header = await reader.readexactly(FRAME_HEADER.size)
+    length = FRAME_HEADER.unpack(header)[0]
+    if length > MAX_FRAME_SIZE:
+        raise FramingError("Invalid frame header")
+    return header + await reader.readexactly(length)
 
 class _GeneralProtocol(asyncio.Protocol):
     
-    def __init__(self):
+    def __init__(self, endpoint: "NetworkEndpoint"):
+        self.endpoint = endpoint
         self._id = None
+        self._frames = FrameBuffer(endpoint.sessions)
 
     def connection_made(self, transport: asyncio.Transport):
         self.transport_address = transport.get_extra_info('peername')[:2]
@@ -114,16 +450,33 @@ class _GeneralProtocol(asyncio.Protocol):
         LOG.debug(f"Connection made with {repr_addr(self.transport_address)}")
 
     def data_received(self, data):
-        _distribute_data(data, self.transport_address, self.transport, self)
-        listener._clear()
+        try:
+            messages = self._frames.feed(data)
+        except FramingError as e:
+            LOG.error(f"Closing connection with {self._id}@{repr_addr(self.transport_address)}: {e}")
+            self.transport.close()
+            return
+        self.endpoint._dispatch(messages, self.transport_address, self.transport, self)
+        self.endpoint.listener._clear()
+
+    def pause_writing(self):
+        connection = self.endpoint.tcp_connections.get(self._id)
+        if connection: connection.outbox.pause()
+
+    def resume_writing(self):
+        connection = self.endpoint.tcp_connections.get(self._id)
+        if connection: connection.outbox.resume()
 
     def connection_lost(self, exc):
         if exc:
             LOG.error(f"Connection lost due to error '{exc}' with {self._id}@{repr_addr(self.transport_address)}")
         else:
             LOG.debug(f"Connection lost with {self._id}@{repr_addr(self.transport_address)}")
-        conn = tcp_connections.pop(self._id, None)
-        if conn: conn.close()
+        conn = self.endpoint.tcp_connections.pop(self._id, None)
+        if conn:
+            self.endpoint.sessions.pop(conn.session, None)
+            conn.close()
+        listener = self.endpoint.listener
         listener._prepare(self._id, self.transport_address, self.transport, self)
         listener.disconnected()
         listener._clear()
@@ -132,26 +485,57 @@ class _GeneralProtocol(asyncio.Protocol):
 
 class _GeneralDatagramProtocol(asyncio.DatagramProtocol):
 
+    def __init__(self, endpoint: "NetworkEndpoint"):
+        self.endpoint = endpoint
+
     def connection_made(self, transport: asyncio.DatagramTransport):
-        async def holepunching():
+        endpoint = self.endpoint
+        async def holepunching(): # for connections without TCP it is also a sign of life
             while not transport.is_closing():
-                send_udp("_hole_punching")
-                await asyncio.sleep(1)
+                endpoint.send_udp("_hole_punching")
+                now = time.monotonic()
+                endpoint.send_udp("_ping", now)
+                for _id, connection in list(endpoint.tcp_connections.items()):
+                    if connection.transport is None and now - connection.channel.last_received > CONNECTION_TIMEOUT:
+                        LOG.warning(f"Connection with {_id} timed out")
+                        endpoint._lose(_id)
+                await asyncio.sleep(KEEPALIVE_INTERVAL)
         asyncio.create_task(holepunching())
         LOG.debug("Hole punching task have been started.")
 
     def datagram_received(self, data, addr):
-        _distribute_data(data, addr)
-        # UDP port correction based on _id (was set in _distrubute_data)
-        connection = tcp_connections.get(listener._id)
+        try:
+            session, sequence, ack, ack_bits, count = PACKET_HEADER.unpack_from(data)
+            ids = struct.unpack_from(f"!{count}H", data, PACKET_HEADER.size)
+        except struct.error:
+            LOG.warning(f"Dropping malformed datagram from {repr_addr(addr)}")
+            return
+        endpoint = self.endpoint
+        messages = list(_get_readready_data_generator(memoryview(data)[PACKET_HEADER.size + 2 * count:], endpoint.sessions))
+        _id = endpoint.sessions.get(session)
+        connection = endpoint.tcp_connections.get(_id)
         if connection:
-            connection.udp_port = addr[1]
-            listener.udp_connected()
-        listener._clear()
+            connection.udp_port = addr[1] # UDP port correction
+            messages = connection.channel.receive(sequence, ack, ack_bits, ids, messages)
+            if connection.channel.ack_due:
+                connection.udp_outbox.schedule()
+        endpoint._dispatch(messages, addr)
+        if connection and _id in endpoint.tcp_connections:
+            endpoint.listener._prepare(_id, addr, None, None)
+            endpoint.listener.udp_connected()
+        endpoint.listener._clear()
 
     def error_received(self, exc):
         LOG.warning(f"UDB error: {exc}")
 
+    def pause_writing(self):
+        for connection in self.endpoint.tcp_connections.values():
+            connection.udp_outbox.pause()
+
+    def resume_writing(self):
+        for connection in self.endpoint.tcp_connections.values():
+            connection.udp_outbox.resume()
+
     def connection_lost(self, exc):
         if exc:
             LOG.error(f"UDP connection lost due to error: {exc}")
@@ -181,6 +565,13 @@ def tcp_only(func):
     return wrapper
 
 class NetworkListener:
+    _actions: dict[int, tuple[str, typing.Callable]] # opcode -> name and method of every action_<name>, made with the class
+    endpoint: "NetworkEndpoint" = None # the one it listens to, set by it (see NetworkEndpoint.listener)
+
+    def __init_subclass__(cls, **kwargs):
+        super().__init_subclass__(**kwargs)
+        cls._actions = _action_table(cls)
+
     def _prepare(self, _id: str, _address: str, transport: asyncio.Transport, protocol: _GeneralProtocol):
         self._id: str = _id
         self._address: str = _address
@@ -196,118 +587,330 @@ class NetworkListener:
     def udp_connected(self): ...
     def disconnected(self): ...
 
+    def _reply(self, action: str, data = None):
+        """ Answers the other side before the connection is made - through TCP if there is one """
+        frame = self.endpoint._get_sendready_data(action, data)
+        if self.transport:
+            self.transport.write(frame)
+        else:
+            self.endpoint.udp_connection.transport.sendto(_bare_packet(frame), self._address)
+
     # internal actions
     def action__hole_punching(self, data): ...
+    def action__ping(self, data):
+        if self._id in self.endpoint.tcp_connections: # not from an unknown session - send_udp to None goes to everyone
+            self.endpoint.send_udp("_pong", data, to=self._id)
+    def action__pong(self, data):
+        connection = self.endpoint.tcp_connections.get(self._id)
+        if connection is None or not isinstance(data, (int, float)):
+            return
+        rtt = time.monotonic() - data
+        if 0 <= rtt < CONNECTION_TIMEOUT: # not a timestamp of another process or a long lost answer
+            connection.link.update(rtt, connection.channel.loss())
+    def action__disconnect(self, data):
+        if self.transport is None and self._id:
+            self.endpoint._lose(self._id)
 
     ## client only
-    @tcp_only
     def action__send_id_proposition(self, data):
-        self.transport.write(_get_sendready_data("_check_if_id_is_available", _id = randomname.generate()))
-    @tcp_only
+        self.endpoint._proposal["id"] = randomname.generate()
+        if self.transport: # without TCP connect_to_server asks again
+            self._reply("_check_if_id_is_available", self.endpoint._proposal)
     def action__confirm_id(self, data):
-        tcp_connections[self._id] = Connection(self.transport, self.protocol, None)
-        self.protocol._id = self._id
+        endpoint = self.endpoint
+        if self._still_connecting.done(): # without TCP it may come more than once
+            return
+        if data["udp_port"] and endpoint.udp_server_address: # server tells us where its UDP endpoint is
+            endpoint.udp_server_address = (endpoint.udp_server_address[0], int(data["udp_port"]))
+        self._id = data["id"]
+        endpoint.tcp_connections[self._id] = Connection(endpoint, self.transport, self.protocol, None, data["session"], host=endpoint.udp_server_address[0])
+        endpoint.sessions[data["session"]] = self._id
+        if self.protocol:
+            self.protocol._id = self._id
         LOG.debug("Connected with valid id.")
         self.connected()
         self._still_connecting.set_result("done!")
 
 
     ## server only
-    @tcp_only
     def action__check_if_id_is_available(self, data):
         LOG.debug(f"Negotating id with {repr_addr(self._address)}...")
-        if tcp_connections.get(self._id): # not available
-            self.transport.write(_get_sendready_data("_send_id_proposition"))
+        endpoint = self.endpoint
+        self._id = data["id"]
+        connection = endpoint.tcp_connections.get(self._id)
+        asks_again = connection and self.transport is None and connection.transport is None and connection.udp_address == tuple(self._address)
+        if connection and not asks_again: # not available
+            self._reply("_send_id_proposition")
             LOG.debug(f"Sending request for change of id. '{self._id}' is already taken.")
-        else: # available
-            tcp_connections[self._id] = Connection(self.transport, self.protocol, None)
-            self.protocol._id = self._id
-            self.transport.write(_get_sendready_data("_confirm_id", _id = self._id))
+            return
+        if connection is None: # available
+            if self.transport:
+                connection = Connection(endpoint, self.transport, self.protocol, None, endpoint._new_session())
+                self.protocol._id = self._id
+            else:
+                connection = Connection(endpoint, None, None, self._address[1], endpoint._new_session(), host=self._address[0])
+            endpoint.tcp_connections[self._id] = connection
+            endpoint.sessions[connection.session] = self._id
+        self._reply("_confirm_id", {"id": self._id, "session": connection.session, "udp_port": endpoint.advertised_udp_port})
+        if not asks_again:
             LOG.debug("Connected with valid id.")
             self.connected()
 
-async def connect_to_server(ip: str, tcp_port: int, udp_port: int, network_listener: NetworkListener):
-    # Assign global variables listed below
-    global listener, udp_connection
-    listener = network_listener
-    loop = asyncio.get_running_loop()
-    t, p = await loop.create_datagram_endpoint(_GeneralDatagramProtocol, local_addr=("0.0.0.0", 0))
-    global udp_server_address # remote_addr parameter in method above does not work on Windows
-    udp_server_address = (ip, udp_port) 
-    udp_connection = UDPConnection(t, p)
-    # Connect to server
-    local_addr = t.get_extra_info("sockname")[:2]
-    t, p = await loop.create_connection(_GeneralProtocol, ip, tcp_port, local_addr=local_addr)
-    t.write(_get_sendready_data("_check_if_id_is_available", _id = randomname.generate()))
-    listener._still_connecting = loop.create_future()
-    await listener._still_connecting
-    LOG.debug(f"Client listen on address {repr_addr(local_addr)}(TCP/UDP)")
-
-async def start_server(ip: str, tcp_port: int, udp_port: int, network_listener: NetworkListener):
-    # Assign global variables listed below
-    global listener, udp_connection, server
-    listener = network_listener
-    loop = asyncio.get_running_loop()
-    t, p = await loop.create_datagram_endpoint(_GeneralDatagramProtocol, local_addr=(ip, udp_port))
-    udp_connection = UDPConnection(t, p)
-    server = await loop.create_server(_GeneralProtocol, ip, tcp_port)
-    LOG.debug(f"Server listen on address {ip}:{tcp_port}(TCP):{udp_port}(UDP)")
-
-def send(action: str, data = None, to: str = None):
-    LOG.debug(f"Sending TCP action '{action}' to {to if to else "all"}")
-    if to:
-        conn = tcp_connections.get(to)
-        if conn:
-            conn.transport.write(_get_sendready_data(action, data, to))
+def _action_table(cls) -> dict[int, tuple[str, typing.Callable]]:
+    table = {}
+    for attribute in dir(cls):
+        if attribute.startswith("action_"):
+            name = attribute.removeprefix("action_")
+            table[opcode_of(name)] = (name, getattr(cls, attribute))
+    return table
+
+NetworkListener._actions = _action_table(NetworkListener)
+
+def handshake_hello(data: bytes):
+    """
+    :param data: first bytes received from a connecting client
+    :return: hello data passed to connect_to_server by the client (None if not given or not there)
+    """
+    for d in _get_readready_data_generator(data):
+        if d["opcode"] == opcode_of("_check_if_id_is_available"):
+            return d["data"].get("hello") if isinstance(d["data"], dict) else None
+
+class NetworkEndpoint:
+    """
+    Server or client - its sockets, connections and listener. Functions of this module (send, start_server, ...)
+    are the methods of default_endpoint, more of them let one process e.g. serve on several ports or run many clients.
+    """
+
+    def __init__(self):
+        self.tcp_connections: dict[str, Connection] = {} # There are multiple connections for server only, with TCP or without it
+        self.sessions: dict[int, str] = {} # session number -> _id of its connection, numbers stand for ids on the wire
+        self.udp_connection: UDPConnection = None
+        self.server: asyncio.Server = None
+        self.udp_server_address = None
+        self.advertised_udp_port: int = None # server only - UDP port clients should use if it is not the one they connected to
+        self._proposal: dict = None # client only - id it asks for and hello data, until the server confirms it
+        self._listener: NetworkListener = None
+
+    @property
+    def listener(self) -> NetworkListener:
+        return self._listener
+    @listener.setter
+    def listener(self, listener: NetworkListener):
+        self._listener = listener
+        if listener:
+            listener.endpoint = self
+
+    def __enter__(self):
+        return self
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.close()
+
+    def _new_session(self) -> int:
+        session = 0
+        while session == 0 or session in self.sessions: # 0 - no session yet
+            session = random.getrandbits(32)
+        return session
+
+    def _get_sendready_data(self, action: str, data = None, _id = None) -> bytes:
+        connection = self.tcp_connections.get(_id)
+        return _frame(opcode_of(action), *_payload(data), connection.session if connection else 0)
+
+    def _distribute_data(self, data: bytes, addr, transport=None, protocol=None):
+        self._dispatch(_get_readready_data_generator(data, self.sessions), addr, transport, protocol)
+
+    def _dispatch(self, messages: typing.Iterable[dict], addr, transport=None, protocol=None):
+        listener = self.listener
+        actions = listener._actions
+        for d in messages:
+            data = d["data"]
+            _id = d["_id"]
+            registered = actions.get(d["opcode"])
+            action: str = registered[0] if registered else d["action"] or f"#{d['opcode']}"
+            listener._prepare(_id, addr, transport, protocol)
+            listener.interceptor(action, data)
+            # execute actions for fully connected connections or internal actions
+            if _id in self.tcp_connections or action.startswith("_"):
+                if registered:
+                    registered[1](listener, data)
+                else:
+                    LOG.warning(f"Action '{action}' from {_id} is not registered in network listener!")
+
+    def _lose(self, _id: str):
+        """ Forgets a connection without TCP - the other side has closed it or it has timed out """
+        connection = self.tcp_connections.pop(_id, None)
+        if connection is None:
+            return
+        self.sessions.pop(connection.session, None)
+        connection.close()
+        self.listener._prepare(_id, connection.udp_address, None, None)
+        self.listener.disconnected()
+        self.listener._clear()
+
+    async def connect_to_server(self, ip: str, tcp_port: int, udp_port: int, network_listener: NetworkListener, hello = None, tcp = True):
+        """
+        :param hello: data sent along with the first message - lets the server (or a router in front of it) decide where the client belongs
+        :param tcp: False - everything goes through UDP, messages sent with send are reliable there (see Channel), tcp_port is not used
+        :raises TimeoutError: the server has not answered within CONNECTION_TIMEOUT (without TCP)
+        """
+        self.listener = listener = network_listener
+        loop = asyncio.get_running_loop()
+        t, p = await loop.create_datagram_endpoint(lambda: _GeneralDatagramProtocol(self), local_addr=("0.0.0.0", 0))
+        self.udp_server_address = (ip, udp_port) # remote_addr parameter in method above does not work on Windows
+        self.udp_connection = UDPConnection(t, p)
+        self._proposal = {"id": randomname.generate(), "hello": hello}
+        listener._still_connecting = loop.create_future()
+        # Connect to server
+        local_addr = t.get_extra_info("sockname")[:2]
+        if tcp:
+            t, p = await loop.create_connection(lambda: _GeneralProtocol(self), ip, tcp_port, local_addr=local_addr)
+            t.write(self._get_sendready_data("_check_if_id_is_available", self._proposal))
+            await listener._still_connecting
         else:
-            LOG.warning(f"Could not send message to {to}. No such connection.")
-    else:
-        for to, connection in tcp_connections.items():
-            connection.transport.write(_get_sendready_data(action, data, to))
-        
+            give_up = loop.time() + CONNECTION_TIMEOUT
+            while not listener._still_connecting.done(): # datagrams may be lost, so it asks until it is confirmed
+                if loop.time() > give_up:
+                    raise TimeoutError(f"Server {repr_addr(self.udp_server_address)} does not answer")
+                self.udp_connection.transport.sendto(_bare_packet(self._get_sendready_data("_check_if_id_is_available", self._proposal)), self.udp_server_address)
+                await asyncio.wait([listener._still_connecting], timeout=HANDSHAKE_INTERVAL)
+        LOG.debug(f"Client listen on address {repr_addr(local_addr)}({"TCP/UDP" if tcp else "UDP"})")
+
+    async def start_server(self, ip: str, tcp_port: int, udp_port: int, network_listener: NetworkListener, advertise_udp_port = False):
+        """
+        :param advertise_udp_port: tell clients to use udp_port (needed when they connected through a router listening elsewhere)
+        """
+        self.listener = network_listener
+        self.advertised_udp_port = udp_port if advertise_udp_port else None
+        loop = asyncio.get_running_loop()
+        t, p = await loop.create_datagram_endpoint(lambda: _GeneralDatagramProtocol(self), local_addr=(ip, udp_port))
+        self.udp_connection = UDPConnection(t, p)
+        self.server = await loop.create_server(lambda: _GeneralProtocol(self), ip, tcp_port)
+        LOG.debug(f"Server listen on address {ip}:{tcp_port}(TCP):{udp_port}(UDP)")
+
+    async def adopt_connection(self, sock: socket.socket, data: bytes = b""):
+        """
+        Serves TCP connection accepted somewhere else (e.g. by a router process) as if it was accepted by this server.
+        :param data: bytes already read from the connection
+        """
+        loop = asyncio.get_running_loop()
+        _, protocol = await loop.connect_accepted_socket(lambda: _GeneralProtocol(self), sock)
+        if data:
+            protocol.data_received(data)
+
+    def send(self, action: str, data = None, to: str = None, latest_only = False):
+        """
+        Queues the message in the outbox of the connection, outboxes are written once per turn of the event loop.
+        Without TCP the message goes through the reliable channel of the connection.
+        :param latest_only: the message replaces one of the same action still waiting in the outbox (TCP only)
+        """
+        LOG.debug(f"Sending TCP action '{action}' to {to if to else "all"}")
+        opcode = opcode_of(action)
+        kind, payload = _payload(data) # encoded once for all receivers
+        if to:
+            conn = self.tcp_connections.get(to)
+            if conn:
+                self._put(to, conn, opcode, _frame(opcode, kind, payload, conn.session), latest_only)
+            else:
+                LOG.warning(f"Could not send message to {to}. No such connection.")
+        else:
+            for to, connection in list(self.tcp_connections.items()):
+                self._put(to, connection, opcode, _frame(opcode, kind, payload, connection.session), latest_only)
 
-def send_udp(action: str, data = None, to: str = None):
-    if not udp_connection: return
-    if to:
-        connection = tcp_connections.get(to)
-        if connection:
-            address = connection.udp_address
-            if address == None: address = udp_server_address
-            if address == None: return
-            udp_connection.transport.sendto(_get_sendready_data(action, data, to), address)
+    def _put(self, _id: str, connection: Connection, opcode: int, frame: bytes, latest_only: bool):
+        if connection.transport:
+            queued = connection.outbox.put(opcode, frame, latest_only)
         else:
-            LOG.warning(f"Could not send message to {to}. No such connection.")
-    else:
-        for to, connection in tcp_connections.items():
-            address = connection.udp_address
-            if address == None: address = udp_server_address
-            if address == None: return
-            udp_connection.transport.sendto(_get_sendready_data(action, data, to), address)
-        
+            queued = connection.channel.queue(frame)
+            connection.udp_outbox.schedule()
+        if not queued:
+            LOG.warning(f"Closing connection with {_id}, it does not keep up with {connection.outbox.size + connection.channel.size} bytes waiting")
+            connection.outbox.clear()
+            if connection.transport:
+                connection.close() # connection_lost does the rest
+            else:
+                self._lose(_id)
+
+    def send_udp(self, action: str, data = None, to: str = None, latest_only = False):
+        """ Like send, but the message is unreliable - frames for one receiver are put together in packets of at most MAX_DATAGRAM_SIZE """
+        if not self.udp_connection: return
+        opcode = opcode_of(action)
+        kind, payload = _payload(data)
+        if to:
+            connection = self.tcp_connections.get(to)
+            if connection:
+                self._put_udp(connection, opcode, _frame(opcode, kind, payload, connection.session), latest_only)
+            else:
+                LOG.warning(f"Could not send message to {to}. No such connection.")
+        else:
+            for connection in self.tcp_connections.values():
+                self._put_udp(connection, opcode, _frame(opcode, kind, payload, connection.session), latest_only)
+
+    def _put_udp(self, connection: Connection, opcode: int, frame: bytes, latest_only: bool):
+        if not connection.udp_outbox.put(opcode, frame, latest_only):
+            connection.udp_outbox.clear() # datagrams may be lost anyway
+
+    def link_quality(self, _id: str = None) -> LinkQuality | None:
+        """ :param _id: of the connection, the only one of a client if not given """
+        connection = self.tcp_connections.get(_id) if _id else next(iter(self.tcp_connections.values()), None)
+        return connection.link if connection else None
+
+    def queued(self, _id: str) -> int:
+        """ :return: bytes waiting to be sent to the client - in its outboxes, its channel (not acknowledged yet) and its TCP transport's buffer """
+        connection = self.tcp_connections.get(_id)
+        if connection is None:
+            return 0
+        buffered = connection.transport.get_write_buffer_size() if connection.transport else 0
+        return connection.outbox.size + connection.udp_outbox.size + connection.channel.size + buffered
+
+    def queue_stats(self) -> dict[str, dict]:
+        """
+        :return: _id -> state of its outboxes ("tcp", "udp"), of its channel ("channel")
+            and bytes buffered by its transport ("buffered" - the UDP one, shared by all, for connections without TCP)
+        """
+        return {_id: {"tcp": connection.outbox.stats(), "udp": connection.udp_outbox.stats(), "channel": connection.channel.stats(),
+                      "buffered": (connection.transport or self.udp_connection.transport).get_write_buffer_size()}
+                for _id, connection in self.tcp_connections.items()}
+
+    def is_connected(self, _id: str) -> bool:
+        conn = self.tcp_connections.get(_id)
+        return conn and (conn.transport is None or not conn.transport.is_closing())
 
-def is_connected(_id: str) -> bool:
-    conn = tcp_connections.get(_id)
-    return conn and not conn.transport.is_closing()
-
-def close():
-    """ Resets global variables and closes all connections. """
-    LOG.debug("Closing all connections.")
-    # Prepare for deletion and delete global references listed below
-    global server, tcp_connections, udp_connection
-    if server:
-        server.close()
-    for connection in tcp_connections.values():
-        connection.transport.write_eof()
-        connection.close()
-    if udp_connection:
-        udp_connection.close()
-    if listener:
-        listener._clear()
-    server = None
-    tcp_connections.clear()
-    udp_connection = None
+    def close(self):
+        """ Closes all connections, the endpoint can be started or connected again then """
+        LOG.debug("Closing all connections.")
+        if self.server:
+            self.server.close()
+        for connection in self.tcp_connections.values():
+            connection.flush()
+            if connection.transport:
+                connection.transport.write_eof()
+            connection.close()
+        if self.udp_connection:
+            self.udp_connection.close()
+        if self.listener:
+            self.listener._clear()
+        self.server = None
+        self.tcp_connections.clear()
+        self.sessions.clear()
+        self.udp_connection = None
+        self.advertised_udp_port = None
+
+# the default endpoint and its methods as functions of the module, most processes need just one
+default_endpoint = NetworkEndpoint()
+tcp_connections = default_endpoint.tcp_connections
+sessions = default_endpoint.sessions
+connect_to_server = default_endpoint.connect_to_server
+start_server = default_endpoint.start_server
+adopt_connection = default_endpoint.adopt_connection
+send = default_endpoint.send
+send_udp = default_endpoint.send_udp
+link_quality = default_endpoint.link_quality
+queued = default_endpoint.queued
+queue_stats = default_endpoint.queue_stats
+is_connected = default_endpoint.is_connected
+close = default_endpoint.close
+_get_sendready_data = default_endpoint._get_sendready_data
+_distribute_data = default_endpoint._distribute_data
 
-    
 class ContextManager:
     def __enter__(self): pass
-    def __exit__(self, exc_type, exc_value, traceback): close()
\ No newline at end of file
+    def __exit__(self, exc_type, exc_value, traceback): close()
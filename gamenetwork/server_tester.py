@@ -19,7 +19,7 @@ class ServerTester(net.NetworkListener):
         net.send_udp("print", f"Got UDP data from server! {data=}")
     @net.udp_only
     def action_send_direct_udp(self, data):
-        net.udp_connection.transport.sendto(net._get_sendready_data("print", f"Got direct UDP data from server! {data=}", self._id), self._address)
+        self.endpoint.udp_connection.transport.sendto(net._bare_packet(self.endpoint._get_sendready_data("print", f"Got direct UDP data from server! {data=}", self._id)), self._address)
     def action_send_tcp(self, data):
         net.send("print", f"Got TCP data from server! {data=}", self._id)
     def action_send_tcp_to_all(self,data):
@@ -34,6 +34,10 @@ class ServerTester(net.NetworkListener):
             except ValueError:
                 num = 10
             net.send("print", "\n".join(file.readlines()[-num:]))
+    def action_get_queues(self, data):
+        net.send("print", net.queue_stats(), self._id)
+    def action_get_links(self, data):
+        net.send("print", {_id: net.link_quality(_id).to_json() for _id in net.tcp_connections}, self._id)
     def action_set_logging_level(self, level):
         LOG.setLevel(level)
     def action_terminate(self, data):
@@ -53,7 +57,7 @@ async def main():
         udp_port = int(udp_port)
         await net.start_server("0.0.0.0", tcp_port, udp_port, ServerTester())
         print("Server has been started.")
-        await net.server.wait_closed()
+        await net.default_endpoint.server.wait_closed()
 
 if __name__ == "__main__":
     try:
@@ -1,35 +1,150 @@
 # Run as: 'python -m gamenetwork.test' from parent folder 
 
 import unittest
-
-# import facade twice as client and server
-import sys
-from . import facade as server
-names = [_ for _ in sys.modules if _.startswith(__package__)]
-for n in names: del sys.modules[n]
-from . import facade as client
-assert client != server
-#
+from . import facade as net
 
 import asyncio
 import logging
+import socket
+import struct
+import time
 import toolz
 from icecream import ic
 
 LOG = logging.getLogger("test")
 
+# both sides in one process
+server = net.NetworkEndpoint()
+client = net.NetworkEndpoint()
+
 class DataTransform(unittest.TestCase):
     def runTest(self):
         senddata = server._get_sendready_data("hello", [1, 2, 3, 4, 5])
         self.assertIsInstance(senddata, bytes, "get_sendready_data does not return bytes")
         senddata = senddata + b"hello"
         senddata = senddata + server._get_sendready_data("hello", [1, 2, 3, 4, 5])
-        readdata = server._get_readready_data_generator(senddata)
+        readdata = net._get_readready_data_generator(senddata)
         for d in readdata:
             self.assertEqual(d["action"], "hello", "Action is not hello")
             self.assertEqual(d["data"], [1, 2, 3, 4, 5], "Data is not [1, 2, 3, 4, 5]")
         self.assertIsInstance(senddata, bytes, "get_readready_data_generator is not pure")
 
+class FrameReassembly(unittest.TestCase):
+    def runTest(self):
+        outgoing = [("hello", [1, 2, 3]), ("raw", b"\0" * 300), ("empty", None), ("text", "zażółć")]
+        server.tcp_connections["someone"] = net.Connection(server, None, None, None, session=7)
+        server.sessions[7] = "someone"
+        try:
+            stream = b"".join(server._get_sendready_data(action, data, "someone") for action, data in outgoing)
+            for chunk_size in (1, 5, len(stream) // 2, len(stream)):
+                frames = net.FrameBuffer(server.sessions)
+                received = []
+                for i in range(0, len(stream), chunk_size):
+                    received += frames.feed(stream[i:i + chunk_size])
+                self.assertEqual([(d["action"], d["data"]) for d in received], outgoing, f"Wrong messages read in chunks of {chunk_size} bytes")
+                self.assertTrue(all(d["_id"] == "someone" for d in received), "Wrong id")
+        finally:
+            server.tcp_connections.clear()
+            server.sessions.clear()
+        with self.assertRaises(net.FramingError):
+            net.FrameBuffer().feed(b"\xff" * 16)
+
+class HandshakeHello(unittest.TestCase):
+    def runTest(self):
+        handshake = lambda data: net._frame(net.opcode_of("_check_if_id_is_available"), *net._payload(data), 0)
+        self.assertEqual(net.handshake_hello(handshake({ "id": "someone", "hello": "room" })), "room", "Hello data not read")
+        self.assertIsNone(net.handshake_hello(handshake({ "id": "someone" })), "Hello data read when not given")
+        for data in ([1, 2], "room", b"room"):
+            self.assertIsNone(net.handshake_hello(handshake(data)), f"Hello data read from {data!r}")
+        self.assertIsNone(net.handshake_hello(server._get_sendready_data("hello", { "hello": "room" })), "Hello data read from another action")
+
+class ActionOpcodes(unittest.TestCase):
+    def runTest(self):
+        called = []
+        class Tester(net.NetworkListener):
+            def action__probe(self, data):
+                called.append(data)
+        self.assertIn(net.opcode_of("_probe"), Tester._actions, "Action is not registered with its class")
+        self.assertNotIn(net.opcode_of("_probe"), net.NetworkListener._actions, "Action is registered with a base class")
+
+        server.listener = Tester()
+        server._distribute_data(server._get_sendready_data("_probe", 42) + server._get_sendready_data("_unknown"), None)
+        server.listener = None
+        self.assertEqual(called, [42], "Action has not been dispatched by its opcode")
+
+        net.opcode_of("zutdocbjiv")
+        with self.assertRaises(ValueError):
+            net.opcode_of("xvmxlgbdlh") # same crc32 as zutdocbjiv
+
+class Coalescing(unittest.IsolatedAsyncioTestCase):
+    async def runTest(self):
+        written = []
+        def write(frames):
+            if frames: written.append(b"".join(frames))
+            return len(frames) > 0
+        outbox = net.Outbox(write)
+        outbox.put(1, b"state 1", latest_only=True)
+        outbox.put(2, b"chat")
+        outbox.put(1, b"state 2", latest_only=True)
+        self.assertEqual(written, [], "Outbox is written before the end of the loop's turn")
+        await asyncio.sleep(0)
+        self.assertEqual(written, [b"chatstate 2"], "Frames are not written together or the older state is not replaced")
+
+        outbox.pause()
+        outbox.put(2, b"chat")
+        await asyncio.sleep(0)
+        self.assertEqual(len(written), 1, "Paused outbox is written")
+        outbox.resume()
+        await asyncio.sleep(0)
+        self.assertEqual(written[-1], b"chat", "Resumed outbox is not written")
+        self.assertEqual((outbox.sent, outbox.writes, outbox.replaced), (3, 2, 1), "Wrong statistics")
+
+class ChannelDelivery(unittest.TestCase):
+    def runTest(self):
+        def deliver(channel, packet):
+            _, sequence, ack, ack_bits, count = net.PACKET_HEADER.unpack_from(packet)
+            ids = struct.unpack_from(f"!{count}H", packet, net.PACKET_HEADER.size)
+            messages = list(net._get_readready_data_generator(packet[net.PACKET_HEADER.size + 2 * count:]))
+            return [(d["action"], d["data"]) for d in channel.receive(sequence, ack, ack_bits, ids, messages)]
+
+        sender, receiver = net.Channel(), net.Channel()
+        for n in range(3):
+            sender.queue(server._get_sendready_data("reliable", n))
+        lost = sender.packets([server._get_sendready_data("state", 1)], 0, now=0)
+        newer = sender.packets([server._get_sendready_data("state", 2)], 0, now=net.RESEND_INTERVAL / 2)
+        again = sender.packets([], 0, now=net.RESEND_INTERVAL)
+        self.assertEqual(deliver(receiver, newer[0]), [("state", 2)], "Unreliable message is not delivered")
+        self.assertEqual(deliver(receiver, again[0]), [("reliable", n) for n in range(3)], "Reliable messages are not sent again")
+        self.assertEqual(deliver(receiver, lost[0]), [], "Late packet delivers an older state or reliable messages again")
+        self.assertEqual(deliver(receiver, again[0]), [], "Duplicated packet is delivered")
+
+        self.assertTrue(receiver.ack_due, "Reliable messages are not acknowledged")
+        deliver(sender, receiver.packets([], 0, now=0)[0])
+        self.assertEqual(sender.reliable, {}, "Acknowledged messages wait to be sent again")
+        self.assertEqual(sender.packets([], 0, now=1), [], "Nothing to send but a packet is made")
+        self.assertEqual(len(net.Channel().packets([b"x" * 1000] * 3, 0, now=0)), 3, "Packet is bigger than MAX_DATAGRAM_SIZE")
+
+class LinkMeasurement(unittest.TestCase):
+    def runTest(self):
+        sender, receiver = net.Channel(), net.Channel()
+        self.assertEqual(receiver.loss(), (None, None), "Loss is measured before anything arrived")
+        for n in range(4):
+            packet = sender.packets([server._get_sendready_data("state", n)], 0, now=0)[0]
+            if n != 2:
+                _, sequence, ack, ack_bits, _ = net.PACKET_HEADER.unpack_from(packet)
+                receiver.receive(sequence, ack, ack_bits, (), [])
+        _, sequence, ack, ack_bits, _ = net.PACKET_HEADER.unpack_from(receiver.packets([server._get_sendready_data("state")], 0, now=0)[0])
+        sender.receive(sequence, ack, ack_bits, (), [])
+        self.assertEqual(receiver.loss()[0], 0.25, "Lost packet is not counted on the receiving side")
+        self.assertEqual(sender.loss()[1], 0.25, "Lost packet is not counted on the sending side")
+
+        link = net.LinkQuality()
+        link.update(0.1, (None, None))
+        link.update(0.2, (0.5, 0))
+        self.assertAlmostEqual(link.rtt, 0.1125)
+        self.assertAlmostEqual(link.jitter, 0.0625)
+        self.assertEqual((link.loss_in, link.loss_out, link.samples), (0.5, 0, 2))
+
 class DataDistribution(unittest.TestCase):
     
     def runTest(self):
@@ -37,18 +152,17 @@ class DataDistribution(unittest.TestCase):
         senddata = senddata + b"hello"
         senddata = senddata + server._get_sendready_data("hello", [1, 2, 3, 4, 5])
 
-        server.listener = server.NetworkListener()
+        server.listener = net.NetworkListener()
         server._distribute_data(senddata, None)
         self.assertIsInstance(senddata, bytes, "distribute_data is not pure")
         server.listener = None
 
 class FailedToConnect(unittest.IsolatedAsyncioTestCase):
     async def runTest(self):
-        server.LOG.setLevel(logging.WARNING)
-        client.LOG.setLevel(logging.WARNING)
+        net.LOG.setLevel(logging.WARNING)
         LOG.setLevel(logging.WARNING)
         try:
-            await client.connect_to_server("localhost", 31429, 31429, client.NetworkListener())
+            await client.connect_to_server("localhost", 31429, 31429, net.NetworkListener())
         except OSError as osError:
             return
         finally:
@@ -58,8 +172,7 @@ class FailedToConnect(unittest.IsolatedAsyncioTestCase):
 
 class EndPoint(unittest.IsolatedAsyncioTestCase):
     async def asyncSetUp(self):
-        server.LOG.setLevel(logging.WARNING)
-        client.LOG.setLevel(logging.WARNING)
+        net.LOG.setLevel(logging.WARNING)
         LOG.setLevel(logging.WARNING)
 
         self.outgoing = [
@@ -80,7 +193,7 @@ class EndPoint(unittest.IsolatedAsyncioTestCase):
         self.serverTester_data = serverData = TesterData()
         self.endpointTester_data = endpointData = TesterData()
         
-        class ServerTester(server.NetworkListener):
+        class ServerTester(net.NetworkListener):
             def connected(self):
                 serverData.connected = True
 
@@ -92,7 +205,7 @@ class EndPoint(unittest.IsolatedAsyncioTestCase):
             def disconnected(self):
                 serverData.connected = False
         
-        class EndPointTester(client.NetworkListener):
+        class EndPointTester(net.NetworkListener):
             def connected(self):
                 endpointData.connected = True
             
@@ -154,19 +267,18 @@ class EndPoint(unittest.IsolatedAsyncioTestCase):
 
 class UDPEndPoint(unittest.IsolatedAsyncioTestCase):
     async def asyncSetUp(self):
-        server.LOG.setLevel(logging.WARNING)
-        client.LOG.setLevel(logging.WARNING)
+        net.LOG.setLevel(logging.WARNING)
         LOG.setLevel(logging.WARNING)
         self.ports = (40000, 40010)
 
         self.server_data = server_data = { "arrived": False }
         self.client_data = client_data = { "arrived": False }
 
-        class HolePunchingListener(server.NetworkListener):
+        class HolePunchingListener(net.NetworkListener):
             def action__hole_punching(self, data):
                 server_data["arrived"] = True
 
-        class ClientHolePunchingListener(client.NetworkListener):
+        class ClientHolePunchingListener(net.NetworkListener):
             def action__hole_punching(self, data):
                 client_data["arrived"] = True
 
@@ -184,11 +296,153 @@ class UDPEndPoint(unittest.IsolatedAsyncioTestCase):
         server.close()
         client.close()
 
+class WithoutTCP(unittest.IsolatedAsyncioTestCase):
+    async def asyncSetUp(self):
+        net.LOG.setLevel(logging.WARNING)
+        LOG.setLevel(logging.WARNING)
+        self.server_data = server_data = {"received": [], "connected": False}
+        self.client_data = client_data = {"received": []}
+
+        class ServerTester(net.NetworkListener):
+            def connected(self):
+                server_data["connected"] = True
+            def disconnected(self):
+                server_data["connected"] = False
+            def action_hello(self, data):
+                server_data["received"].append(data)
+                server.send("gotit", data, to=self._id)
+
+        class ClientTester(net.NetworkListener):
+            def action_gotit(self, data):
+                client_data["received"].append(data)
+
+        await server.start_server("0.0.0.0", 31434, 31434, ServerTester())
+        await client.connect_to_server("localhost", 31434, 31434, ClientTester(), tcp=False)
+
+    async def runTest(self):
+        self.assertTrue(self.server_data["connected"], "Server have not accepted client without TCP")
+        self.assertIsNone(next(iter(server.tcp_connections.values())).transport, "Client has connected through TCP")
+        outgoing = [[n] * 200 for n in range(20)] # more than fits in one datagram
+        for data in outgoing:
+            client.send("hello", data)
+        await asyncio.sleep(0.1)
+        self.assertEqual(self.server_data["received"], outgoing, "Server have not received reliable messages in order")
+        self.assertEqual(self.client_data["received"], outgoing, "Client have not received reliable messages in order")
+
+        client.close()
+        await asyncio.sleep(0.01)
+        self.assertFalse(self.server_data["connected"], "Server have not got disconnected event from client without TCP")
+
+    async def asyncTearDown(self):
+        server.close()
+        client.close()
+
+class StrayPing(unittest.IsolatedAsyncioTestCase):
+    async def asyncSetUp(self):
+        net.LOG.setLevel(logging.WARNING)
+        LOG.setLevel(logging.WARNING)
+        self.pongs = pongs = []
+
+        class ClientTester(net.NetworkListener):
+            def action__pong(self, data):
+                pongs.append(data)
+                super().action__pong(data)
+
+        self.clients = [net.NetworkEndpoint() for _ in range(2)]
+        await server.start_server("0.0.0.0", 31437, 31437, net.NetworkListener())
+        for endpoint in self.clients: # their own pings go out every KEEPALIVE_INTERVAL, the first one before they are connected
+            await endpoint.connect_to_server("localhost", 31437, 31437, ClientTester())
+            endpoint.send_udp("_hole_punching") # so the server knows where to send them datagrams
+        await asyncio.sleep(0.05)
+
+    async def runTest(self):
+        with socket.socket(socket.AF_INET, socket.SOCK_DGRAM) as sock:
+            sock.sendto(net._bare_packet(server._get_sendready_data("_ping", 12345.0)), ("127.0.0.1", 31437)) # unknown session
+        await asyncio.sleep(0.1)
+        self.assertEqual(self.pongs, [], "Ping from an unknown session is answered to connected clients")
+
+        for _id in server.tcp_connections:
+            server.send_udp("_pong", time.monotonic() + 100, to=_id)
+            server.send_udp("_pong", time.monotonic() - 100, to=_id)
+        await asyncio.sleep(0.1)
+        self.assertEqual([endpoint.link_quality().samples for endpoint in self.clients], [0, 0], "Implausible pong is measured")
+
+    async def asyncTearDown(self):
+        server.close()
+        for endpoint in self.clients:
+            endpoint.close()
+
+class HandedOverConnection(unittest.IsolatedAsyncioTestCase):
+    async def asyncSetUp(self):
+        net.LOG.setLevel(logging.WARNING)
+        LOG.setLevel(logging.WARNING)
+        self.router_port = 31431
+        self.ports = (31432, 31433)
+
+        self.server_data = server_data = { "hello": None, "connected": False }
+
+        class ServerTester(net.NetworkListener):
+            def interceptor(self, action, data):
+                if action == "_check_if_id_is_available":
+                    server_data["hello"] = data["hello"]
+            def connected(self):
+                server_data["connected"] = True
+
+        async def hand_over(reader: asyncio.StreamReader, writer: asyncio.StreamWriter):
+            data = await net.read_frame(reader)
+            sock = writer.get_extra_info("socket").dup()
+            writer.transport.abort()
+            await server.adopt_connection(sock, data)
+
+        await server.start_server("0.0.0.0", *self.ports, ServerTester(), advertise_udp_port=True)
+        self.router = await asyncio.start_server(hand_over, "0.0.0.0", self.router_port)
+        await client.connect_to_server("localhost", self.router_port, self.router_port, net.NetworkListener(), hello="room")
+
+    async def runTest(self):
+        self.assertTrue(self.server_data["connected"], "Server have not accepted handed over connection")
+        self.assertEqual(self.server_data["hello"], "room", "Hello data have not arrived with the first message")
+        self.assertEqual(client.udp_server_address[1], self.ports[1], "Client does not use advertised UDP port")
+
+    async def asyncTearDown(self):
+        LOG.info("Closing handed over connection test")
+        self.router.close()
+        server.close()
+        client.close()
+
+class ManyEndpoints(unittest.IsolatedAsyncioTestCase):
+    async def asyncSetUp(self):
+        net.LOG.setLevel(logging.WARNING)
+        LOG.setLevel(logging.WARNING)
+        self.received = received = {}
+
+        class Echo(net.NetworkListener):
+            def action_hello(self, data):
+                self.endpoint.send("echo", data, to=self._id)
+
+        class Counter(net.NetworkListener):
+            def action_echo(self, data):
+                received[data] = self.endpoint
+
+        self.servers = [net.NetworkEndpoint() for _ in range(2)]
+        self.clients = [net.NetworkEndpoint() for _ in range(20)]
+        for n, endpoint in enumerate(self.servers):
+            await endpoint.start_server("0.0.0.0", 31435 + n, 31435 + n, Echo())
+        for n, endpoint in enumerate(self.clients):
+            await endpoint.connect_to_server("localhost", 31435 + n % 2, 31435 + n % 2, Counter(), tcp=n % 4 < 2)
+
+    async def runTest(self):
+        self.assertEqual([len(endpoint.tcp_connections) for endpoint in self.servers], [10, 10], "Clients are not spread over both servers")
+        for n, endpoint in enumerate(self.clients):
+            endpoint.send("hello", n)
+        await asyncio.sleep(0.1)
+        self.assertEqual(self.received, dict(enumerate(self.clients)), "Answers have not come back to the clients which asked")
+
+    async def asyncTearDown(self):
+        for endpoint in self.clients + self.servers:
+            endpoint.close()
 
 
 if __name__ == '__main__':
     logging.basicConfig(level=logging.DEBUG)
     logging.getLogger("asyncio").setLevel(logging.WARNING)
-    server.LOG = logging.getLogger("server")
-    client.LOG = logging.getLogger("client")
     unittest.main()
\ No newline at end of file
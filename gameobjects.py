@@ -1,42 +1,37 @@
 import random
-import pygame
+import numpy as np
 import constants
 from decisionfunctions import Direction
-import pygameutils
 import math
+import torus
+from vector import Vector2
 
-class Circle(pygame.Vector2):
+def board() -> torus.Torus:
+    """ Geometry of the current board (see constants.Game().board_size) """
+    return torus.of_size(*constants.Game().board_size)
+
+class Circle(Vector2):
 
     def __init__(self, x, y, radius, color=constants.Color.default, outline_width=0):
         super().__init__(x, y)
         self.r = radius
         self.outline_width = outline_width
         self.color = color
-        self.surface = pygame.Surface((radius * 2, radius * 2), flags=pygame.SRCALPHA)
-        pygame.draw.circle(self.surface, color, (radius, radius), radius, outline_width)
 
     def __str__(self) -> str:
         return self.__class__.__name__ + super().__str__()
 
-    def draw(self):
-        pygame.display.get_surface().blit(self.surface, (self.x - self.r, self.y - self.r))
-
     def is_colliding_with(self, other):
         return other is not self and isinstance(other, Circle) and self.distance_to(other) < self.r + other.r
 
     @classmethod
-    def at_random_position(cls, radius, color=None):
-        if pygame.display.get_surface():
-            rect = pygame.display.get_surface().get_rect()
-        else:
-            rect = constants.Game().screen_rect
-        x = random.random() * rect.width
-        y = random.random() * rect.height
+    def at_random_position(cls, radius, color=None, rng=random):
+        """
+        :param rng: source of randomness (random.Random or random module itself)
+        """
+        x, y = board().random_point(rng)
         return cls(x, y, radius) if not color else cls(x, y, radius, color)
 
-    def get_rect(self):
-        return pygame.Rect(self.x - self.r, self.y - self.r, self.r * 2, self.r * 2)
-
     def __deepcopy__(self, memo):
         """ No copy """
         memo[id(self)] = self
@@ -60,28 +55,21 @@ class Fruit(Circle):
         super().__init__(x, y, radius, powerup.value)
 
     @classmethod
-    def at_random_position(cls, radius, powerup=constants.Powerup.NONE):
-        if pygame.display.get_surface():
-            rect = pygame.display.get_surface().get_rect()
-        else:
-            rect = constants.Game().screen_rect
-        x = random.random() * rect.width
-        y = random.random() * rect.height
+    def at_random_position(cls, radius, powerup=constants.Powerup.NONE, rng=random):
+        x, y = board().random_point(rng)
         return cls(x, y, radius, powerup)
 
     @classmethod
-    def with_powerup(cls, radius):
-        rnd = random.random()
+    def with_powerup(cls, radius, rng=random):
+        rnd = rng.random()
         powerup = constants.Powerup.NONE
-        if rnd < 0.1:
-            powerup = constants.Powerup.WALL_WALKING
-        elif rnd < 0.2:
-            powerup = constants.Powerup.WEIRD_WALKING
-        elif rnd < 0.25:
-            powerup = constants.Powerup.GHOSTING
-        elif rnd < 0.27:
-            powerup = constants.Powerup.CRUSHING
-        return cls.at_random_position(radius, powerup)
+        threshold = 0
+        for candidate, probability in constants.POWERUP_PROBABILITIES.items():
+            threshold += probability
+            if rnd < threshold:
+                powerup = candidate
+                break
+        return cls.at_random_position(radius, powerup, rng)
 
     def to_json(self):
         return super().to_json() | {
@@ -100,7 +88,7 @@ class Wall(Circle):
 class Tail(Circle):
     def __init__(self, x, y, radius, direction, color=constants.Color.default, outline_width=0):
         super().__init__(x, y, radius, color, outline_width)
-        self.direction: pygame.Vector2 = direction
+        self.direction: Vector2 = direction
 
     def to_json(self):
         return super().to_json() | {
@@ -112,19 +100,236 @@ class Tail(Circle):
     
     @classmethod
     def from_json(cls, json, color, outline_width):
-        return cls(json["x"], json["y"], json["r"], pygame.Vector2(json["direction"]["x"], json["direction"]["y"]), color, outline_width)
+        return cls(json["x"], json["y"], json["r"], Vector2(json["direction"]["x"], json["direction"]["y"]), color, outline_width)
     
+class TailArray:
+    """
+    Replacement for list[Tail] in Snake.tail (see constants.Game.array_tails).
+    Positions, directions and radii of all segments are kept in numpy arrays, so following
+    the head can be done for the whole tail at once (see follow).
+    Indexing and iterating return Tail copies - changing them does not change the tail.
+    Tails follow the head a bit differently than lists of Tail do (see follow), so the same game goes
+    differently with them - everyone simulating a game has to use the same kind.
+    """
+
+    def __init__(self, color=constants.Color.default, outline_width=0, capacity=16):
+        self.color = color
+        self.outline_width = outline_width
+        self.positions = np.empty((capacity, 2))
+        self.directions = np.empty((capacity, 2))
+        self.radii = np.empty(capacity)
+        self._size = 0
+
+    def __len__(self):
+        return self._size
+
+    def __iter__(self):
+        for i in range(self._size):
+            yield self._get(i)
+
+    def __getitem__(self, key):
+        if isinstance(key, slice):
+            return [self._get(i) for i in range(*key.indices(self._size))]
+        if key < 0:
+            key += self._size
+        if not 0 <= key < self._size:
+            raise IndexError("tail index out of range")
+        return self._get(key)
+
+    def _get(self, i):
+        x, y = self.positions[i].tolist()
+        return Tail(x, y, float(self.radii[i]), Vector2(self.directions[i].tolist()), self.color, self.outline_width)
+
+    def append(self, tail):
+        if self._size == len(self.radii):
+            capacity = 2 * len(self.radii)
+            self.positions = np.resize(self.positions, (capacity, 2))
+            self.directions = np.resize(self.directions, (capacity, 2))
+            self.radii = np.resize(self.radii, capacity)
+        self.positions[self._size] = tail.x, tail.y
+        self.directions[self._size] = tail.direction.x, tail.direction.y
+        self.radii[self._size] = tail.r
+        self._size += 1
+
+    def extend(self, positions: np.ndarray, directions: np.ndarray, radii: np.ndarray):
+        """ Appends many segments at once, given as arrays of the same shapes as the ones of this class """
+        size = self._size + len(radii)
+        if size > len(self.radii):
+            capacity = max(size, 2 * len(self.radii))
+            self.positions = np.resize(self.positions, (capacity, 2))
+            self.directions = np.resize(self.directions, (capacity, 2))
+            self.radii = np.resize(self.radii, capacity)
+        self.positions[self._size:size] = positions
+        self.directions[self._size:size] = directions
+        self.radii[self._size:size] = radii
+        self._size = size
+
+    def points(self) -> list[list[float]]:
+        return self.positions[:self._size].tolist()
+
+    def vectors(self, stop=None) -> list[Vector2]:
+        """ Positions of segments as vectors, cheaper than self[:stop] """
+        return [Vector2(p) for p in self.positions[:min(self._size, stop or self._size)].tolist()]
+
+    def follow(self, head, distance, board: torus.Torus, straight=False) -> np.ndarray:
+        """
+        Moves every segment towards the nearest (board wraps around) image of the previous one.
+        All segments are moved in one batch, so each of them chases the position its predecessor
+        had before this step (the head - its new position), while in lists of Tail each one chases the place its
+        predecessor has just moved to (see Snake.move). Such tails stretch about 8% longer and neighbouring
+        segments may overlap a bit. Otherwise it does what Snake.move does, up to the last bit of numpy's hypot.
+        :param straight: segments move in the head's direction instead (weird walking, crushing)
+        :return: mask of segments which moved
+        """
+        n = self._size
+        if n == 0:
+            return np.zeros(0, dtype=bool)
+        pos = self.positions[:n]
+        radii = self.radii[:n]
+        prev = np.empty((n, 2))
+        prev[0] = head.x, head.y
+        prev[1:] = pos[:-1]
+        prev_dir = np.empty((n, 2))
+        prev_dir[0] = head.direction.x, head.direction.y
+        prev_dir[1:] = self.directions[:n-1]
+        reach = radii + np.concatenate(([head.r], radii[:-1]))
+
+        active = np.hypot(*(prev - pos).T) >= reach
+        size = board.size
+        offset = board.displacements(pos, prev)
+        closest = pos + offset
+
+        if straight:
+            moved = pos + np.array((head.direction.x, head.direction.y)) * distance
+        else:
+            length = np.hypot(*offset.T)
+            far = length > distance
+            moved = closest.copy()
+            moved[far] = pos[far] + offset[far] * (distance / length[far, None])
+
+        moved %= size
+        to_prev = board.displacements(moved, prev)
+        length = np.sqrt(to_prev[:, 0] * to_prev[:, 0] + to_prev[:, 1] * to_prev[:, 1]) # as Vector2.normalize
+        directions = prev_dir.copy()
+        nonzero = length > 0
+        directions[nonzero] = to_prev[nonzero] / length[nonzero, None]
+
+        reverted = np.hypot(*(prev - moved).T) < reach
+        moved[reverted] = pos[reverted]
+
+        pos[active] = moved[active]
+        self.directions[:n][active] = directions[active]
+        return active
+
+    def colliding_with(self, circle, start=0, stop=None) -> bool:
+        """
+        Vectorized version of any(circle.is_colliding_with(t) for t in tail[start:stop])
+        """
+        n = self._size if stop is None else min(stop, self._size)
+        if n <= start:
+            return False
+        pos = self.positions[start:n]
+        hits = np.hypot(pos[:, 0] - circle.x, pos[:, 1] - circle.y) < circle.r + self.radii[start:n]
+        return bool(hits.any())
+
+    def segment_colliding_with(self, i, circle) -> bool:
+        """
+        Same as colliding_with, but for the i-th segment only
+        """
+        x, y = self.positions[i].tolist()
+        return math.hypot(x - circle.x, y - circle.y) < circle.r + self.radii[i]
+
+
+class TailBounds:
+    """
+    Bounding boxes of chunks of CHUNK consecutive tail segments, so a collision test can skip
+    the chunks which are far away. Snake.move marks chunks with moved segments and their boxes
+    are recomputed on the next query. Changes of the tail's length are noticed on their own.
+    """
+    CHUNK = 16
+
+    def __init__(self):
+        self._boxes: list[tuple[float, float, float, float]] = [] # centres' extent expanded by the biggest radius
+        self._stale: list[bool] = []
+        self._size = 0
+
+    def moved(self, i):
+        """ :param i: index of the moved segment """
+        if i < self._size:
+            self._stale[i // self.CHUNK] = True
+
+    def moved_many(self, mask: np.ndarray):
+        """ :param mask: moved segments (see TailArray.follow) """
+        n = min(len(mask), self._size)
+        if n:
+            for k in np.nonzero(np.add.reduceat(mask[:n], np.arange(0, n, self.CHUNK)))[0].tolist():
+                self._stale[k] = True
+
+    def _sync(self, tail):
+        n = len(tail)
+        if n != self._size:
+            chunks = -(-n // self.CHUNK)
+            first = min(n, self._size) // self.CHUNK
+            del self._boxes[chunks:]
+            del self._stale[chunks:]
+            self._boxes.extend([None] * (chunks - len(self._boxes)))
+            self._stale.extend([True] * (chunks - len(self._stale)))
+            for k in range(first, chunks):
+                self._stale[k] = True
+            self._size = n
+        for k, stale in enumerate(self._stale):
+            if stale:
+                self._boxes[k] = self._box(tail, k)
+                self._stale[k] = False
+
+    def _box(self, tail, k):
+        start, stop = k * self.CHUNK, min((k + 1) * self.CHUNK, self._size)
+        if isinstance(tail, TailArray):
+            (x0, y0), (x1, y1) = tail.positions[start:stop].min(axis=0).tolist(), tail.positions[start:stop].max(axis=0).tolist()
+            r = float(tail.radii[start:stop].max())
+        else:
+            segments = tail[start:stop]
+            xs = [t.x for t in segments]
+            ys = [t.y for t in segments]
+            x0, y0, x1, y1 = min(xs), min(ys), max(xs), max(ys)
+            r = max(t.r for t in segments)
+        return x0 - r, y0 - r, x1 + r, y1 + r
+
+    def chunks_near(self, tail, circle):
+        """
+        :param tail: tail these bounds belong to
+        :return: ranges of indexes of segments which may collide with the circle (neighbouring chunks are merged)
+        """
+        self._sync(tail)
+        x, y, r = circle.x, circle.y, circle.r
+        start = stop = 0
+        for k, (x0, y0, x1, y1) in enumerate(self._boxes):
+            if x0 - r < x < x1 + r and y0 - r < y < y1 + r:
+                if k * self.CHUNK != stop:
+                    if stop:
+                        yield range(start, stop)
+                    start = k * self.CHUNK
+                stop = min((k + 1) * self.CHUNK, self._size)
+        if stop:
+            yield range(start, stop)
+
 class Snake(Circle):
-    def __init__(self, x, y, radius, color=constants.Color.white, outline_width=0):
+    NECK = 3 # number of first tail segments the head never collides with
+
+    def __init__(self, x, y, radius, color=constants.Color.white, outline_width=0, direction=None):
         super().__init__(x, y, radius, color, outline_width)
         self.decision = Direction.FORWARD
-        self.tail: list[Tail] = []
-        self.direction = pygame.Vector2(random.random(), random.random()).normalize()
+        self.tail: list[Tail] | TailArray = TailArray(color, int(radius / 2)) if constants.Game().array_tails else []
+        self.direction = direction if direction is not None else Vector2(random.random(), random.random()).normalize()
         self.rotation_power = 5  # distance sin size of snake width in witch snake successfully turns back
         self.alive = True
         self.powerups = {}
+        self.bounds = TailBounds()
 
-    def move(self, distance):
+    def move(self, distance, index=None):
+        """
+        :param index: spatialhash.BoardIndex to keep up to date with new positions of segments
+        """
         # change direction if key was pressed
         PI = 3.14
         decision = self.decision
@@ -136,40 +341,37 @@ class Snake(Circle):
         # move certain distance forward
         self.x += self.direction.x * distance
         self.y += self.direction.y * distance
+        if index:
+            index.move_segment(self, 0)
 
-        for prev, t in zip([self] + self.tail, self.tail):
-            if not t.is_colliding_with(prev):
-
-                x, y = prev
-                if pygame.display.get_surface():
-                    screen_rect = pygame.display.get_surface().get_rect()
-                else:
-                    screen_rect = constants.Game().screen_rect
-                width, height = screen_rect.size
-
-                # Create a list of translations
-                translations = [(0, 0), (-width, 0), (width, 0), (0, -height), (0, height), (-width, -height), (-width, height), (width, -height), (width, height)]
-
-                # Apply each translation to the original point
-                points = [(x + dx, y + dy) for dx, dy in translations]
-
-                # Find the closest point to the target point
-                closest = min(points, key=lambda p: t.distance_to(p))
+        if isinstance(self.tail, TailArray):
+            self._move_tail_array(distance, index)
+            return
 
+        geometry = board()
+        straight = constants.Powerup.WEIRD_WALKING in self.powerups or constants.Powerup.CRUSHING in self.powerups
+        for i, (prev, t) in enumerate(zip([self] + self.tail, self.tail), 1):
+            if not t.is_colliding_with(prev):
                 old_pos = t.x, t.y
-                if constants.Powerup.WEIRD_WALKING in self.powerups or constants.Powerup.CRUSHING in self.powerups:
-                    t.x += self.direction.x * distance
-                    t.y += self.direction.y * distance
+                if straight:
+                    t.x, t.y = geometry.wrap(t.x + self.direction.x * distance, t.y + self.direction.y * distance)
                 else:
-                    t.x, t.y = t.move_towards(closest, distance)
-                t.direction = (closest - t).normalize() if closest != t else prev.direction
-
-                t.x = (t.x + screen_rect.width) % screen_rect.width
-                t.y = (t.y + screen_rect.height) % screen_rect.height
+                    t.x, t.y = geometry.move_towards(t.x, t.y, prev.x, prev.y, distance)
+                dx, dy = geometry.displacement(t.x, t.y, prev.x, prev.y)
+                t.direction = Vector2(dx, dy).normalize() if dx or dy else prev.direction
 
                 if t.is_colliding_with(prev):
                     t.x, t.y = old_pos
+                self.bounds.moved(i - 1)
+                if index:
+                    index.move_segment(self, i)
 
+    def _move_tail_array(self, distance, index=None):
+        previous = self.tail.positions[:len(self.tail)].copy() if index else None
+        straight = constants.Powerup.WEIRD_WALKING in self.powerups or constants.Powerup.CRUSHING in self.powerups
+        self.bounds.moved_many(self.tail.follow(self, distance, board(), straight))
+        if index:
+            index.move_tail(self, previous)
 
     def consume(self, fruit):
         last = self.tail[-1] if self.tail else self
@@ -182,69 +384,56 @@ class Snake(Circle):
                 self.powerups[fruit.powerup] = constants.POWERUP_TIMES[fruit.powerup]
         
 
-    def draw(self):
-        if self.powerups:
-            self.draw_with_timer()
-            return
-        super().draw()
-        for t in self.tail:
-            t.draw()
-
     def update_timer(self, delta):
         for powerup in list(self.powerups):
             self.powerups[powerup] -= delta
             if self.powerups[powerup] < 0:
                 del self.powerups[powerup]
 
-    def draw_with_timer(self):
-        for powerup, time in sorted(list(self.powerups.items()), key=lambda x: x[1], reverse=True):
-            num_of_segments = len(self.tail) + 1
-            segments_to_color = time
-            fully_colored = int(math.floor(segments_to_color))
-            rest = segments_to_color - fully_colored
-            segments = [self] + self.tail
-            for segment, percentage in zip(segments, fully_colored * [1] + [rest] + (num_of_segments - fully_colored - 1) * [0]):
-                current_sur = segment.surface
-                segment.surface = pygameutils.paint_surface(current_sur, powerup.value, percentage, -segment.direction)
-                if segment is self:
-                    super().draw()
-                else:
-                    segment.draw()
-                segment.surface = current_sur
-
-
-    def draw_direction(self):
-        WIDTH = int(self.r / 4)
-        start_point = self + self.direction * self.r * 2
-        end_point = start_point + self.direction * self.r * 2
-        right_arrow = end_point + self.direction.rotate(150) * self.r
-        left_arrow = end_point + self.direction.rotate(-150) * self.r
-        pygame.draw.line(pygame.display.get_surface(), self.color, start_point, end_point, WIDTH)
-        pygame.draw.line(pygame.display.get_surface(), self.color, end_point, right_arrow, WIDTH)
-        pygame.draw.line(pygame.display.get_surface(), self.color, end_point, left_arrow, WIDTH)
-
     def length(self):
         return len(self.tail) + 1
 
     def is_colliding_with(self, other):
         if isinstance(other, Snake):
-            return super().is_colliding_with(other) or any(self.is_colliding_with(t) for t in other.tail)
-        if other in self.tail[:3]: 
+            if super().is_colliding_with(other):
+                return True
+            first = self.NECK if other is self else 0
+            for segments in other.bounds.chunks_near(other.tail, self):
+                start = max(segments.start, first)
+                if isinstance(other.tail, TailArray):
+                    if other.tail.colliding_with(self, start=start, stop=segments.stop):
+                        return True
+                elif any(Circle.is_colliding_with(self, other.tail[i]) for i in range(start, segments.stop)):
+                    return True
+            return False
+        if other in self.tail[:self.NECK]: 
             return False
         return super().is_colliding_with(other)
+
+    def is_colliding_with_segment(self, snake, i):
+        """
+        Same as is_colliding_with(snake) but tests only one segment of it (0 is the head).
+        """
+        if i == 0:
+            return super().is_colliding_with(snake)
+        if snake is self and i <= self.NECK:
+            return False
+        return self._touches_segment(snake, i - 1)
+
+    def _touches_segment(self, snake, i):
+        """ :param i: index in snake's tail """
+        if isinstance(snake.tail, TailArray):
+            return snake.tail.segment_colliding_with(i, self)
+        return Circle.is_colliding_with(self, snake.tail[i])
     
     def died(self):
         self.alive = False
     
     @classmethod
-    def at_random_position(cls, radius, color=None):
-        if pygame.display.get_surface():
-            screen_rect = pygame.display.get_surface().get_rect()
-        else:
-            screen_rect = constants.Game().screen_rect
-        x = random.random() * screen_rect.width * 0.6 + screen_rect.width * 0.2
-        y = random.random() * screen_rect.height * 0.6 + screen_rect.height * 0.2
-        return cls(x, y, radius) if not color else cls(x, y, radius, color)
+    def at_random_position(cls, radius, color=None, rng=random):
+        x, y = board().random_point(rng, margin=0.2)
+        direction = Vector2(rng.random(), rng.random()).normalize()
+        return cls(x, y, radius, direction=direction) if not color else cls(x, y, radius, color, direction=direction)
     
     def to_json(self):
         return super().to_json() | {
@@ -262,9 +451,8 @@ class Snake(Circle):
      
     @classmethod
     def from_json(cls, json: dict):
-        snake = cls(json["x"], json["y"], json["r"], json["color"])
+        snake = cls(json["x"], json["y"], json["r"], json["color"], direction=Vector2(json["direction"]["x"], json["direction"]["y"]))
         snake.decision = json.get("decision", Direction.FORWARD)
-        snake.direction = pygame.Vector2(json["direction"]["x"], json["direction"]["y"])
         snake.rotation_power = json["rotation_power"]
         snake.alive = json.get("alive", False)
         for t in json.get("tail", []):
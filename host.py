@@ -1,49 +1,61 @@
+# Dedicated host - runs rooms of matches without a window. It does not import pygame (nor anything that does),
+# so it can be built without it (see Dockerfile).
+
 import asyncio
 import gamenetwork as net
-from views import *
+from simulation import *
 import utils
+import sys
 import dto
 import constants
 import logging
+import multiprocessing
+import os
+import socket
+import zlib
+import decisionfunctions
 
 import gamenetwork.server_tester as server_tester
 class HostNetworkListener(server_tester.ServerTester):
 
-    def __init__(self, local_players: list, game_state: dto.GameState):
+    def __init__(self, local_players: list, match: HostedMatch):
         self.players = local_players
-        self.game_state = game_state
+        self.match = match
+        self.game_state = match.game_state
 
     def action_join(self, names):
         constants.LOG.info(f"Player joined: {names}")
         new_players = [[name, self._id] for name in names]
         self.players.extend(new_players)
 
-    def _add_control(self, data):
+    def _queue_control(self, player, direction, tick):
+        self.match.add_control(player, direction, tick)
+
+    def _add_control(self, name, direction, tick):
         try:
-            idx = utils.find_index(self.players, lambda x: x[0] == data["name"] and x[1] == self._id)
+            idx = utils.find_index(self.players, lambda x: x[0] == name and x[1] == self._id)
             player = self.game_state.players[idx]
-            if self.game_state.time_passed < data["time_passed"]:
-                add_control(player, data["direction"], data["time_passed"])
-        except StopIteration:
+            if self.game_state.tick <= tick:
+                self._queue_control(player, direction, tick)
+        except (StopIteration, IndexError):
             pass
 
     def action_control(self, data):
         if isinstance(data, dict):
             if "ctrls" in data:
                 for ctrl in data["ctrls"]:
-                    self._add_control(ctrl)
+                    self._add_control(ctrl["name"], ctrl["direction"], ctrl["tick"])
             else:
-                self._add_control(data)
+                self._add_control(data["name"], data["direction"], data["tick"])
         else:
             controls = dto.GameInputs.deserialize(data).controls
             for control in controls:
-                try:
-                    idx = utils.find_index(self.players, lambda x: x[0] == control.name and x[1] == self._id)
-                    player = self.game_state.players[idx]
-                    if self.game_state.time_passed < control.time_passed:
-                        add_control(player, control.decision, control.time_passed)
-                except StopIteration:
-                    pass
+                self._add_control(control.name, control.decision, control.tick)
+
+    def action_ack(self, numbering):
+        """ Clients acknowledge every snapshot, but this host sends only full ones (see SoloHostNetworkListener) """
+
+    def action_keyframe(self, data): ...
 
     def disconnected(self):
         constants.LOG.info("Player disconnected")
@@ -52,49 +64,213 @@ class HostNetworkListener(server_tester.ServerTester):
                 del self.players[i]
         
 
-async def run_host():
-    host = f"{utils.get_my_ip()}:{constants.DEFAULT_PORT}"
-    players = [[name, "host"] for name in dto.Config().active_players_names]
-    game_state = dto.GameState()
+DEFAULT_ROOM = "default"
 
-    with net.ContextManager():
-        try:
-            await net.start_server("0.0.0.0", constants.DEFAULT_PORT, constants.DEFAULT_PORT, HostNetworkListener(players, game_state))
-        except OSError as e:
-            constants.LOG.warning(f"Could not start the server: {e}")
-            return
-        
-        while True:
-            should_start = await LobbyView(host, players)
-            if not should_start: return
+class Room(HostedMatch):
+    """
+    Match with its own lobby. Clients are members of at most one room and all their actions go there.
+    """
+
+    def __init__(self, name: str):
+        super().__init__(dto.GameState(), name)
+        self.players = [] # [name, client id] - order matches game_state.players, bots have no client id
+        self.bot_kinds: dict[str, str] = {} # bot's name -> name of decisionfunctions.BOTS
+        self.members: set[str] = set()
+        self.lobby_running = False
+        self.task: asyncio.Task = None
+
+    def send(self, action: str, data=None):
+        for _id in self.members:
+            net.send(action, data, to=_id)
+
+    def send_udp(self, action: str, data=None):
+        for _id in self.members:
+            net.send_udp(action, data, to=_id)
+
+    def clients(self) -> list[str]:
+        return list(self.members)
 
-            dto.Config().save_to_file()
-            game_state.init(len(players))
-            for snake, (name, _id) in zip(game_state.players, players):
+    def add_bots(self, count: int, kind: str):
+        for _ in range(count):
+            name = f"{kind} bot {len(self.bot_kinds) + 1}"
+            self.bot_kinds[name] = kind
+            self.players.append([name, None])
+
+    def start(self, resolution):
+        self.board_size = tuple(resolution)
+        constants.Game().board_size = self.board_size
+        self.game_state.init(len(self.players))
+        for snake, (name, _id) in zip(self.game_state.players, self.players):
+            if _id is None:
+                self.bots.append((snake, decisionfunctions.BOTS[self.bot_kinds[name]](lambda: self.game_state, snake.color)))
+            else:
                 net.send("your_color", {"name": name, "color": snake.color}, to=_id)
-            net.send("start", pygame.display.get_window_size())
-            await ReadyGoView(game_state,GameView(game_state))
-            players_copy = players.copy()
-            players.clear()
-            players.extend([name, "host"] for name in dto.Config().active_players_names)
-            net.send("score", game_state.serialize())
-            await show_scores(game_state.scores, players_copy)
-            game_state.reset()
+        self.send("start", resolution)
+        self.lobby_running = False
+
+    async def lobby(self):
+        clock = TickClock()
+        self.lobby_running = True
+        LOBBY_FPS = 10
+        while self.lobby_running:
+            await clock.tick(LOBBY_FPS)
+            self.send_udp("lobby", self.players)
+
+    async def run(self):
+        while True:
+            constants.LOG.info(f"Room '{self.name}' is waiting for players")
+            await self.lobby()
+            constants.LOG.info(f"Starting the game in room '{self.name}'")
+            await solo_host_game(self)
+            self.players.clear()
+            self.bot_kinds.clear()
+            self.bots.clear()
+            self.send("score", self.game_state.serialize(self.board_size))
+            self.game_state.reset()
 
+    def to_json(self):
+        return {
+            "name": self.name,
+            "players": [name for name, _ in self.players],
+            "running": self.game_state.get_init(),
+            "tick": self.game_state.tick,
+            "overruns": self.overruns,
+            "links": {_id: link.to_json() for _id in self.members if (link := net.link_quality(_id))},
+            "rates": {_id: rate.to_json() for _id, rate in self.rates.items()}
+        }
 
-lobby_running = True
+class RoomManager:
+    """
+    Creates rooms on demand and tears them down when their last member leaves.
+    Every room runs as a separate task on the same event loop.
+    """
+
+    def __init__(self):
+        self.rooms: dict[str, Room] = {}
+        self._client_rooms: dict[str, Room] = {}
+
+    def create(self, name: str) -> Room:
+        room = self.rooms.get(name)
+        if room is None:
+            room = self.rooms[name] = Room(name)
+            room.task = asyncio.create_task(room.run())
+            constants.LOG.info(f"Room '{name}' created")
+        return room
+
+    def close(self, name: str):
+        room = self.rooms.pop(name, None)
+        if room is None:
+            return
+        room.task.cancel()
+        for _id in room.members:
+            self._client_rooms.pop(_id, None)
+        constants.LOG.info(f"Room '{name}' closed")
+
+    def close_all(self):
+        for name in list(self.rooms):
+            self.close(name)
+
+    def of(self, _id: str) -> Room | None:
+        return self._client_rooms.get(_id)
+
+    def join(self, _id: str, name: str = None) -> Room:
+        """
+        :param name: room to join, client's current room (or the default one) if not given
+        """
+        current = self.of(_id)
+        if name is None:
+            name = current.name if current else DEFAULT_ROOM
+        if current and current.name != name:
+            self.leave(_id)
+        room = self.create(name)
+        room.members.add(_id)
+        self._client_rooms[_id] = room
+        return room
+
+    def leave(self, _id: str):
+        room = self._client_rooms.pop(_id, None)
+        if room is None:
+            return
+        room.members.discard(_id)
+        room.players[:] = [player for player in room.players if player[1] != _id]
+        if not room.members:
+            self.close(room.name)
+
+    def list(self) -> list[dict]:
+        return [room.to_json() for room in self.rooms.values()]
 
 class SoloHostNetworkListener(HostNetworkListener):
+    def __init__(self, rooms: RoomManager):
+        self.rooms = rooms
+
+    @property
+    def room(self) -> Room | None:
+        return self.rooms.of(self._id)
+
+    @property
+    def players(self):
+        return self.room.players if self.room else []
+
+    @property
+    def game_state(self):
+        return self.room.game_state if self.room else dto.GameState()
+
+    def _queue_control(self, player, direction, tick):
+        self.room.add_control(player, direction, tick)
+
+    def action_join(self, data):
+        """
+        :param data: list of names or {"room": room name, "names": list of names}
+        """
+        if isinstance(data, dict):
+            room = self.rooms.join(self._id, data.get("room"))
+            names = data["names"]
+        else:
+            room = self.rooms.join(self._id)
+            names = data
+        constants.LOG.info(f"Player joined room '{room.name}': {names}")
+        room.players.extend([name, self._id] for name in names)
+
+    def action_create_room(self, name):
+        self.rooms.create(name)
+        self.action_list_rooms(None)
+
+    def action_list_rooms(self, data):
+        net.send("rooms", self.rooms.list(), to=self._id)
+
+    def action_add_bots(self, data):
+        """
+        :param data: {"count": number of bots, "kind": name of decisionfunctions.BOTS} - they take player slots in client's room
+        """
+        room = self.room
+        kind = data.get("kind", "seeking_fruits")
+        if room is None or room.game_state.get_init() or kind not in decisionfunctions.BOTS:
+            constants.LOG.warning(f"Could not add bots: {data}")
+            return
+        room.add_bots(int(data.get("count", 1)), kind)
+        constants.LOG.info(f"Bots joined room '{room.name}': {data}")
+
     def action_start(self, resolution):
         constants.LOG.debug(f"Start request received with resolution: {resolution}")
-        if self.players and self._id == self.players[0][1] and not self.game_state.get_init():
-            constants.Game().screen_rect = pygame.Rect((0, 0), resolution)
-            self.game_state.init(len(self.players))
-            for snake, (name, _id) in zip(self.game_state.players, self.players):
-                net.send("your_color", {"name": name, "color": snake.color}, to=_id)
-            net.send("start", resolution)
-            global lobby_running
-            lobby_running = False
+        room = self.room
+        if room and room.players and self._id == room.players[0][1] and not room.game_state.get_init():
+            room.start(resolution)
+
+    def action_ack(self, numbering):
+        """ :param numbering: of the last snapshot the client received - next ones are deltas against it """
+        if self.room:
+            self.room.acknowledge(self._id, int(numbering))
+
+    def action_keyframe(self, data):
+        """ Client does not know the baseline of deltas it gets, so it needs a full state """
+        if self.room:
+            self.room.acks.pop(self._id, None)
+
+    def action_set_budget(self, budget):
+        """ :param budget: bytes per second of snapshots the client wants at most (see simulation.SnapshotRate) """
+        if self.room:
+            self.room.rates.setdefault(self._id, SnapshotRate()).budget = int(budget)
+
     def action_set_latency(self, latency):
         constants.LOG.debug(f"Setting latency to {latency} ms")
         constants.NETWORK_GAME_LATENCY = int(latency)
@@ -103,43 +279,122 @@ class SoloHostNetworkListener(HostNetworkListener):
         constants.LOG.debug(f"Sending UDP states set to: {SEND_UDP}")
         SEND_UDP = not SEND_UDP
 
-async def solo_host_lobby(players):
-    clock = pygameview.AsyncClock()
-    global lobby_running
-    lobby_running = True
-    LOBBY_FPS = 10
-    while lobby_running:
-        await clock.tick(LOBBY_FPS)
-        net.send_udp("lobby", players)
+    def disconnected(self):
+        constants.LOG.info("Player disconnected")
+        self.rooms.leave(self._id)
 
-async def run_solo_host():
-    tcp_port = int(sys.argv[1]) if len(sys.argv) > 1 else constants.DEFAULT_PORT
-    udp_port = int(sys.argv[2]) if len(sys.argv) > 2 else constants.DEFAULT_PORT
-    pygame.init()
-    players = []
-    game_state = dto.GameState()
+async def serve_rooms(tcp_port: int, udp_port: int, channel: socket.socket = None):
+    """
+    :param channel: unix socket on which the router hands over clients (worker mode)
+    """
+    rooms = RoomManager()
 
     with net.ContextManager():
         try:
-            await net.start_server("0.0.0.0", tcp_port, udp_port, SoloHostNetworkListener(players, game_state))
+            await net.start_server("0.0.0.0", tcp_port, udp_port, SoloHostNetworkListener(rooms), advertise_udp_port=channel is not None)
         except OSError as e:
             constants.LOG.warning(f"Could not start the server: {e}")
             return
-        
-        while True:
-            constants.LOG.info("Waiting for players")
-            await solo_host_lobby(players)
-            constants.LOG.info("Starting the game")
-            await solo_host_game(game_state)
-            players.clear()
-            net.send("score", game_state.serialize())
-            game_state.reset()
+
+        if channel:
+            receive_clients(channel)
+        try:
+            await asyncio.Future() # rooms live in their own tasks, serve until interrupted
+        finally:
+            rooms.close_all()
+
+async def run_solo_host():
+    tcp_port = int(sys.argv[1]) if len(sys.argv) > 1 else constants.DEFAULT_PORT
+    udp_port = int(sys.argv[2]) if len(sys.argv) > 2 else constants.DEFAULT_PORT
+    await serve_rooms(tcp_port, udp_port)
+
+# Supervisor mode: router process accepting clients on the public TCP port and worker processes running rooms.
+# Every room is owned by one worker, clients name the room in the first message (see client.run_client).
+
+HANDSHAKE_TIMEOUT = 5
+
+def room_owner(room: str, workers: int) -> int:
+    return zlib.crc32(room.encode()) % workers
+
+def receive_clients(channel: socket.socket):
+    """ Worker side - serves connections handed over by the router """
+    loop = asyncio.get_running_loop()
+
+    def receive():
+        data, fds, _, _ = socket.recv_fds(channel, 65536, 1)
+        if not fds:
+            if not data: # router is gone
+                loop.remove_reader(channel)
+            return
+        asyncio.create_task(net.adopt_connection(socket.socket(fileno=fds[0]), data))
+
+    channel.setblocking(False)
+    loop.add_reader(channel, receive)
+
+async def route_clients(tcp_port: int, channels: list[socket.socket]):
+    """ Router side - reads the first message of every client and passes the connection to the owner of its room """
+    async def hand_over(reader: asyncio.StreamReader, writer: asyncio.StreamWriter):
+        try:
+            data = await asyncio.wait_for(net.read_frame(reader), HANDSHAKE_TIMEOUT)
+        except (asyncio.IncompleteReadError, net.FramingError, TimeoutError):
+            writer.close()
+            return
+        try:
+            room = net.handshake_hello(data)
+            if not isinstance(room, str):
+                room = DEFAULT_ROOM
+            worker = room_owner(room, len(channels))
+            socket.send_fds(channels[worker], [data], [writer.get_extra_info("socket").fileno()])
+        except (OSError, ValueError, AttributeError, KeyError) as e: # bad first message or worker is gone
+            constants.LOG.warning(f"Client could not be handed over: {e!r}")
+            writer.close()
+            return
+        writer.transport.abort() # worker has its own copy of the socket
+        constants.LOG.debug(f"Client for room '{room}' handed over to worker {worker}")
+
+    server = await asyncio.start_server(hand_over, "0.0.0.0", tcp_port)
+    async with server:
+        await server.serve_forever()
+
+def run_worker(channel: socket.socket, udp_port: int):
+    try:
+        asyncio.run(serve_rooms(0, udp_port, channel))
+    except KeyboardInterrupt:
+        pass
+
+def run_supervisor(tcp_port: int, udp_port: int, workers: int):
+    """
+    Starts workers (each with its own UDP port: udp_port + 1, udp_port + 2, ...) and routes clients to them.
+    """
+    channels = []
+    processes = []
+    for i in range(workers):
+        router_end, worker_end = socket.socketpair(socket.AF_UNIX, socket.SOCK_SEQPACKET)
+        process = multiprocessing.Process(target=run_worker, args=(worker_end, udp_port + 1 + i), daemon=True)
+        process.start()
+        worker_end.close()
+        channels.append(router_end)
+        processes.append(process)
+    constants.LOG.info(f"Started {workers} workers")
+    try:
+        asyncio.run(route_clients(tcp_port, channels))
+    finally:
+        for process in processes:
+            process.kill()
 
 if __name__ == "__main__":
+    multiprocessing.freeze_support()
     logging.basicConfig(level=logging.DEBUG, filename="host.log", filemode="w")
     server_tester.LOG_FILE = "host.log"
+    # Run as: python host.py <tcp_port> <udp_port> [workers] (0 workers - one per core)
+    workers = int(sys.argv[3]) if len(sys.argv) > 3 else 1
     try:
-        print("Starting solo host...")
-        asyncio.run(run_solo_host())
+        if workers == 1:
+            print("Starting solo host...")
+            asyncio.run(run_solo_host())
+        else:
+            tcp_port, udp_port = int(sys.argv[1]), int(sys.argv[2])
+            print("Starting host supervisor...")
+            run_supervisor(tcp_port, udp_port, workers or os.cpu_count())
     except KeyboardInterrupt:
-        print("Solo host stopped by user.")
\ No newline at end of file
+        print("Solo host stopped by user.")
@@ -1,5 +1,6 @@
 import client
 from dto import *
+from config import Config
 import host
 from views import *
 import functools as ft
@@ -78,16 +79,48 @@ def controls_menu():
         menu_methods += [ft.partial(left, idx), ft.partial(right, idx)]
     return menu_options, menu_methods
 
+async def run_host():
+    address = f"{utils.get_my_ip()}:{constants.DEFAULT_PORT}"
+    players = [[name, "host"] for name in Config().active_players_names]
+    game_state = dto.GameState()
+    match = HostedMatch(game_state)
+
+    with net.ContextManager():
+        try:
+            await net.start_server("0.0.0.0", constants.DEFAULT_PORT, constants.DEFAULT_PORT, host.HostNetworkListener(players, match))
+        except OSError as e:
+            constants.LOG.warning(f"Could not start the server: {e}")
+            return
+        
+        while True:
+            should_start = await LobbyView(address, players)
+            if not should_start: return
+
+            Config().save_to_file()
+            game_state.init(len(players))
+            match.next_controls.clear()
+            for snake, (name, _id) in zip(game_state.players, players):
+                net.send("your_color", {"name": name, "color": snake.color}, to=_id)
+            net.send("start", pygame.display.get_window_size())
+            await ReadyGoView(game_state,GameView(game_state, match))
+            players_copy = players.copy()
+            players.clear()
+            players.extend([name, "host"] for name in Config().active_players_names)
+            net.send("score", game_state.serialize())
+            await show_scores(game_state.scores, players_copy)
+            game_state.reset()
+
 def network_menu():
     async def join():
         host_address_phrase = await pygameview.common.InputView("Enter host address:", Config().last_connected_ip)
         if not host_address_phrase: return
+        host_address_phrase, _, room = host_address_phrase.partition("/") # ip:port/room
         parts = host_address_phrase.split(":")
         ip = parts[0]
         
         port = int(parts[1]) if len(parts) > 1 else DEFAULT_PORT
-        await client.run_client(ip, port, port)
+        await client.run_client(ip, port, port, room or None)
     
     menu_options = ["CREATE ROOM", "JOIN", "JOIN GLOBAL"]
-    menu_methods = [host.run_host, join, client.run_on_playfab]
+    menu_methods = [run_host, join, client.run_on_playfab]
     return menu_options, menu_methods
\ No newline at end of file
@@ -9,12 +9,18 @@ def get_screen_size() -> tuple[int, int]:
     monitor = screeninfo.get_monitors()[0]
     return monitor.width, monitor.height
 
+def set_resolution(resolution: tuple[int, int]):
+    """ Resizes the window (full screen if it is the screen's size) and the board along with it """
+    resolution = tuple(resolution)
+    pygame.display.set_mode(resolution, pygame.FULLSCREEN if resolution == get_screen_size() else 0)
+    pygameview.utils.set_font_scale(constants.TEXT_LINES_PER_SCREEN)
+    constants.Game().board_size = resolution
+
 def next_screen_resolution():
     RESOLUTIONS = [(800, 600), (1024, 768), (1280, 720), (1600, 900), (1920, 1080), get_screen_size()]
 
     if not (pygame.get_init and pygame.display.get_surface()):
-        pygame.display.set_mode(RESOLUTIONS[0], pygame.FULLSCREEN if RESOLUTIONS[0] == get_screen_size() else 0)
-        pygameview.utils.set_font_scale(constants.TEXT_LINES_PER_SCREEN)
+        set_resolution(RESOLUTIONS[0])
         return
 
     current_resolution = pygame.display.get_window_size()
@@ -22,8 +28,7 @@ def next_screen_resolution():
         next_resolution = RESOLUTIONS[0]
     else:
         next_resolution = RESOLUTIONS[RESOLUTIONS.index(current_resolution)+1]
-    pygame.display.set_mode(next_resolution, pygame.FULLSCREEN if next_resolution == get_screen_size() else 0)
-    pygameview.utils.set_font_scale(constants.TEXT_LINES_PER_SCREEN)
+    set_resolution(next_resolution)
 
 def create_window(title, width=None, height=None, icon=None):
     if pygame.get_init() and pygame.display.get_surface(): return
@@ -32,12 +37,27 @@ def create_window(title, width=None, height=None, icon=None):
     if icon:
         pygame.display.set_icon(icon)
     if width and height:
-        full_screen = get_screen_size() == (width, height)
-        pygame.display.set_mode((width, height), pygame.FULLSCREEN if full_screen else 0)
-        pygameview.utils.set_font_scale(constants.TEXT_LINES_PER_SCREEN)
+        set_resolution((width, height))
     else:
         next_screen_resolution()
 
+_circle_sprites: dict[tuple, pygame.Surface] = {}
+
+def circle_sprite(radius, color, outline_width=0) -> pygame.Surface:
+    """
+    Surface with a circle drawn on it. It is created on the first call and then shared
+    by every caller asking for the same (radius, color, outline_width) - do not draw on it.
+    """
+    key = (radius, tuple(color), outline_width)
+    sprite = _circle_sprites.get(key)
+    if sprite is None:
+        sprite = pygame.Surface((radius * 2, radius * 2), flags=pygame.SRCALPHA)
+        pygame.draw.circle(sprite, color, (radius, radius), radius, outline_width)
+        if pygame.display.get_surface():
+            sprite = sprite.convert_alpha()
+        _circle_sprites[key] = sprite
+    return sprite
+
 def draw_arrow(surface: pygame.Surface, color, center: pygame.Vector2, direction: pygame.Vector2, width, radius):
     """
     :param width: width of the line
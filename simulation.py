@@ -0,0 +1,348 @@
+# Simulation of the game and hosting of matches. It does not need pygame, so the host can run without it (see host.py).
+
+import asyncio
+import bisect
+import math
+import random
+import time
+import typing
+import dto
+import gameobjects
+import constants
+import gamenetwork as net
+
+def _visit_like_list(candidates, items: list, order):
+    """
+    Yields candidates in order of items. Iterating over a list while removing from it skips
+    the element right after the removed one - this keeps that behaviour, so collisions resolve
+    exactly as when the whole list was scanned.
+    :param order: key of items which sorts them as in the list (see spatialhash.BoardIndex.order)
+    """
+    skipped = None
+    for item in sorted(candidates, key=order):
+        if item is skipped:
+            continue
+        length = len(items)
+        position = order(item)
+        yield item
+        if len(items) < length:
+            following = bisect.bisect_left(items, position, key=order)
+            skipped = items[following] if following < len(items) else None
+
+def game_loop(st: dto.GameState, delta: float, add_new_entities=True, rng=random, timer=None):
+    """
+    :param rng: source of randomness for new entities
+    :param timer: gets lap(phase) after every phase of the tick, for profiling (see debugtools.benchmark)
+    :return: list of sounds' names to play after
+    """
+    board = gameobjects.board()
+    sounds = []
+    fruits_to_add = 0
+    wall_to_add = 0
+
+    if delta <= 0:
+        constants.LOG.debug("Delta is non-positive")
+
+    index = st.spatial_index()
+    for idx, player in st.enumerate_alive_players():
+        player.move(constants.Game().diameter * st.current_speed * delta, index)
+        if timer: timer.lap("move")
+        # region COLLISION_CHECK
+        # with fruits
+        for fruit in _visit_like_list(index.fruits_near(player), st.fruits, index.order):
+            if fruit.is_colliding_with(player):
+                if fruit.powerup == constants.Powerup.WALL_WALKING:
+                    st.wall_walking_event_timer += constants.POWERUP_TIMES[constants.Powerup.WALL_WALKING]
+                if fruit.powerup == constants.Powerup.CRUSHING:
+                    st.wall_walking_event_timer += constants.POWERUP_TIMES[constants.Powerup.CRUSHING]
+                player.consume(fruit)
+                index.add_segment(player, len(player.tail))
+                st.fruits.remove(fruit)
+                index.remove_fruit(fruit)
+                st.entities_version += 1
+                fruits_to_add += 1
+                if fruit.powerup == constants.Powerup.CRUSHING:
+                    sounds.append("bless")
+                st.scores[idx] += 1
+        if timer: timer.lap("fruits")
+        # with walls
+        for wall in _visit_like_list(index.walls_near(player), st.walls, index.order):
+            if wall.is_colliding_with(player):
+                if constants.Powerup.CRUSHING in player.powerups:
+                    sounds.append("crush")
+                    st.walls.remove(wall)
+                    index.remove_wall(wall)
+                    st.entities_version += 1
+                elif constants.Powerup.GHOSTING not in player.powerups:
+                    player.died()
+                    constants.LOG.info(f"Player {idx+1} clashed with wall")
+        if timer: timer.lap("walls")
+        # with borders
+        if not board.contains(player.x, player.y, player.r):
+            if st.wall_walking_event_timer == 0 and constants.Powerup.GHOSTING not in player.powerups:
+                player.died()
+                constants.LOG.info(f"Player {idx+1} got out of border")
+            else:
+                player.x, player.y = board.wrap(player.x, player.y)
+                index.move_segment(player, 0)
+        if timer: timer.lap("borders")
+        # with tail
+        touched = {id(pl) for pl, i in index.segments_near(player) if pl.alive and player.is_colliding_with_segment(pl, i)}
+        for pl in st.alive_players():
+            if id(pl) in touched and not (constants.Powerup.GHOSTING in player.powerups or constants.Powerup.GHOSTING in pl.powerups):
+                player.died()
+                constants.LOG.info(f"Player {idx+1} clashed with sb's tail")
+        if timer: timer.lap("tails")
+        # endregion
+
+    # update time counter
+    for player in st.alive_players():
+        player.update_timer(delta)
+    st.time_passed += delta
+    st.fruit_event_timer += delta
+    st.wall_walking_event_timer = max(0, st.wall_walking_event_timer - delta)
+    if st.fruit_event_timer > 5:
+        fruits_to_add += 1
+        st.fruit_event_timer = 0
+    if constants.Game().time_limit and st.time_passed > constants.Game().time_limit:
+        st.wall_event_timer += delta
+        if st.wall_event_timer > (constants.Game().time_limit**2) / (st.time_passed**2):
+            wall_to_add += 1
+            st.wall_event_timer = 0
+
+    # something to make it more fun!
+    st.current_speed = constants.Game().speed + 2 * int(1 + st.time_passed / 10)
+    for player in st.alive_players():
+        player.rotation_power = constants.Game().rotation_power + int(st.time_passed / 10)
+    if timer: timer.lap("timers")
+    
+    if add_new_entities and (fruits_to_add or wall_to_add):
+        st.entities_version += 1
+        for _ in range(fruits_to_add):
+            st.fruits.append(gameobjects.Fruit.with_powerup(constants.Game().diameter / 2, rng))
+            index.add_fruit(st.fruits[-1])
+        for _ in range(wall_to_add):
+            st.walls.append(gameobjects.Wall.at_random_position(constants.Game().diameter, rng=rng))
+            index.add_wall(st.walls[-1])
+    if timer: timer.lap("spawns")
+
+    return sounds
+
+def simulate_tick(st: dto.GameState, add_new_entities=True):
+    """
+    Advances the game by exactly one fixed tick (constants.TICK_SEC).
+    The same state and decisions give the same result on every machine.
+    :return: list of sounds' names to play after
+    """
+    sounds = game_loop(st, constants.TICK_SEC, add_new_entities, st.rng() if add_new_entities else random)
+    st.tick += 1
+    return sounds
+
+class FixedTimestep:
+    """
+    Accumulates frames' deltas and tells how many fixed ticks should be simulated.
+    """
+    MAX_TICKS_PER_UPDATE = 8 # if we are that late, the rest is dropped instead of catching up
+
+    def __init__(self, tick=constants.TICK_SEC):
+        self.tick = tick
+        self.accumulator = 0.0
+        self.dropped = 0 # ticks dropped by the last advance
+
+    def advance(self, delta) -> int:
+        self.accumulator += delta
+        ticks = int(self.accumulator / self.tick)
+        self.accumulator -= ticks * self.tick
+        self.dropped = max(0, ticks - self.MAX_TICKS_PER_UPDATE)
+        return ticks - self.dropped
+
+SEND_UDP = True
+
+HOST_FPS = 60
+
+class TickClock:
+    """
+    Same as pygameview.AsyncClock, but measures time on its own - pygame's clock needs pygame.
+    """
+
+    def __init__(self):
+        self.last_tick = time.perf_counter()
+
+    async def tick(self, fps) -> float:
+        """ :return: seconds since the previous tick """
+        await asyncio.sleep(1 / fps - (time.perf_counter() - self.last_tick))
+        now = time.perf_counter()
+        awaited = now - self.last_tick
+        self.last_tick = now
+        return awaited
+
+class HostedMatch:
+    """
+    One match played on the host (see solo_host_game). Host can run many of them at once,
+    so everything belonging to the match is kept here instead of module globals.
+    """
+    DEFAULT_BOARD_SIZE = (800, 600) # the smallest resolution (see pygameutils.next_screen_resolution)
+
+    def __init__(self, game_state: dto.GameState, name: str = "default", board_size: tuple[int, int] = None):
+        """ :param board_size: constants.Game().board_size if not given """
+        self.name = name
+        self.game_state = game_state
+        self.next_controls: list[tuple[gameobjects.Snake, int, int]] = []
+        self.board_size: tuple[int, int] = tuple(board_size or constants.Game().board_size or self.DEFAULT_BOARD_SIZE)
+        self.overruns = 0 # number of frames in which simulation could not keep up with real time
+        self.bots: list[tuple[gameobjects.Snake, typing.Callable[[], int]]] = [] # snakes driven by decisionfunctions.BOTS
+        self.acks: dict[str, int] = {} # client id -> numbering of the last snapshot it acknowledged (see send_game_state)
+        self.rates: dict[str, SnapshotRate] = {} # client id -> how often it gets snapshots
+
+    def add_control(self, player: gameobjects.Snake, direction: int, tick: int):
+        self.next_controls.append((player, direction, tick))
+
+    def apply_controls(self):
+        tick = self.game_state.tick
+        for player, function in self.bots:
+            if player.alive:
+                player.decision = function()
+        for player, direction, control_tick in self.next_controls:
+            if control_tick <= tick:
+                player.decision = direction
+        self.next_controls = [control for control in self.next_controls if control[2] > tick]
+
+    def acknowledge(self, _id: str, numbering: int):
+        if numbering <= self.game_state.numbering: # not one from the previous game
+            self.acks[_id] = numbering
+
+    def clients(self) -> list[str]:
+        return list(net.tcp_connections)
+
+    def send(self, action: str, data=None):
+        net.send(action, data)
+
+    def send_udp(self, action: str, data=None):
+        net.send_udp(action, data)
+
+class SnapshotRate:
+    """
+    How often one client gets snapshots (see send_game_state) - every interval-th one the host makes.
+    The interval is never shorter than the client's budget allows. Above that it doubles when packets to the client
+    get lost or bytes queue up for it, and shortens by one while its link is clean, like TCP's congestion window -
+    so a bad connection slows down only its own snapshots.
+    """
+    MAX_INTERVAL = 4 # snapshots of a client have to come often enough for its prediction
+    MAX_LOSS = 0.1 # fraction of packets to the client lost (see net.LinkQuality)
+    MAX_QUEUED = 16 * 1024 # bytes waiting to be sent to the client (see net.queued)
+    HOLD = 1.0 # seconds between changes of the interval, loss is measured once per net.KEEPALIVE_INTERVAL
+
+    def __init__(self, budget: int = constants.SNAPSHOT_BUDGET):
+        self.budget = budget # bytes per second
+        self.interval = 1
+        self.countdown = 0 # snapshots to skip before the next one
+        self.size: float = None # smoothed size of snapshots sent
+        self.changed = 0.0 # time of the last change of the interval
+        # totals
+        self.skipped = 0
+        self.backoffs = 0
+
+    def due(self) -> bool:
+        if self.countdown > 0:
+            self.countdown -= 1
+            self.skipped += 1
+            return False
+        self.countdown = self.interval - 1
+        return True
+
+    def sent(self, size: int, period: float, loss: float | None, queued: int, now: float):
+        """
+        Adjusts the interval after a snapshot has been sent
+        :param period: seconds between snapshots the host makes
+        :param queued: bytes that were waiting for the client before the snapshot
+        """
+        self.size = size if self.size is None else self.size + (size - self.size) / 8
+        floor = min(self.MAX_INTERVAL, math.ceil(self.size / (self.budget * period)))
+        if (loss is not None and loss > self.MAX_LOSS) or queued > self.MAX_QUEUED:
+            if self.interval < self.MAX_INTERVAL and now - self.changed >= self.HOLD:
+                self.interval = min(self.MAX_INTERVAL, self.interval * 2)
+                self.changed = now
+                self.backoffs += 1
+        elif self.interval > floor and now - self.changed >= self.HOLD:
+            self.interval -= 1
+            self.changed = now
+        self.interval = max(self.interval, floor)
+        self.countdown = min(self.countdown, self.interval - 1)
+
+    def to_json(self) -> dict:
+        return {"interval": self.interval, "budget": self.budget, "size": self.size and round(self.size),
+                "skipped": self.skipped, "backoffs": self.backoffs}
+
+async def send_game_state(match: HostedMatch):
+    """
+    Every client gets a delta against the last snapshot it acknowledged, or the full state if there is none (see dto.Snapshot),
+    as often as its link carries them (see SnapshotRate).
+    """
+    game_state = match.game_state
+    history: dict[int, dto.Snapshot] = {}
+    while True:
+        game_state.timestamp = time.time()
+        game_state.numbering += 1
+        snapshot = dto.Snapshot(game_state, match.board_size)
+        history[snapshot.numbering] = snapshot
+        history.pop(snapshot.numbering - dto.SNAPSHOT_HISTORY, None)
+        period = constants.NETWORK_GAME_LATENCY / 1000
+        now = time.monotonic()
+        encoded = {} # baseline's numbering (None - full state) -> data, clients with the same baseline share it
+        clients = match.clients()
+        for _id in match.rates.keys() - set(clients): # left
+            del match.rates[_id]
+        for _id in clients:
+            rate = match.rates.get(_id)
+            if rate is None:
+                rate = match.rates[_id] = SnapshotRate()
+            if not rate.due():
+                continue
+            queued = net.queued(_id)
+            baseline = history.get(match.acks.get(_id))
+            if baseline and not baseline.can_be_baseline_of(snapshot):
+                baseline = None
+            key = baseline.numbering if baseline else None
+            if key not in encoded:
+                encoded[key] = game_state.serialize_delta(snapshot, baseline) if baseline else game_state.serialize(snapshot.board_size)
+            if SEND_UDP:
+                net.send_udp("game", encoded[key], to=_id, latest_only=True)
+            else:
+                net.send("game", encoded[key], to=_id, latest_only=True) # a client that does not keep up gets only the newest one
+            link = net.link_quality(_id)
+            rate.sent(len(encoded[key]), period, link and link.loss_out, queued, now)
+        await asyncio.sleep(period)
+
+async def solo_host_game(match: HostedMatch):
+    game_state = match.game_state
+    clock = TickClock()
+    FPS = HOST_FPS
+    timestep = FixedTimestep()
+    match.acks.clear()
+    send_state_task = asyncio.create_task(send_game_state(match))
+    try: # the match may also end by being cancelled (e.g. its room closes)
+        # ready go
+        while game_state.time_passed <= 1:
+            delta = await clock.tick(FPS)
+            game_state.time_passed += delta
+
+        # game loop
+        while True:
+            delta = await clock.tick(FPS)
+
+            ticks = timestep.advance(delta)
+            start = time.perf_counter()
+            for _ in range(ticks):
+                constants.Game().board_size = match.board_size # matches share the event loop, not the board size
+                match.apply_controls()
+                simulate_tick(game_state)
+            took = time.perf_counter() - start
+            if timestep.dropped or took > ticks * timestep.tick:
+                match.overruns += 1
+                constants.LOG.warning(f"Match '{match.name}' overran at tick {game_state.tick}: "
+                                      f"{took * 1000:.1f} ms for {ticks} ticks, {timestep.dropped} ticks dropped")
+
+            if game_state.all_players_dead():
+                return
+    finally:
+        send_state_task.cancel()
@@ -0,0 +1,187 @@
+# Uniform grid used as a broadphase for collision checks on the board.
+
+import math
+import numpy as np
+from gameobjects import TailArray
+
+class SpatialHash:
+    """
+    Uniform grid of buckets. Every key lives in the cell containing its centre.
+    Cells wrap around the board edges (board is a torus), so a query near one edge
+    also returns keys from the opposite one. Results are candidates only - exact
+    tests are up to the caller.
+    """
+
+    def __init__(self, width, height, cell_size):
+        self.width = width
+        self.height = height
+        self.cols = max(1, int(width // cell_size))
+        self.rows = max(1, int(height // cell_size))
+        self.cell_width = width / self.cols
+        self.cell_height = height / self.rows
+        self._cells: dict[tuple[int, int], dict] = {}
+        self._where: dict = {}
+
+    def __len__(self):
+        return len(self._where)
+
+    def __contains__(self, key):
+        return key in self._where
+
+    def cell_of(self, x, y) -> tuple[int, int]:
+        return math.floor(x / self.cell_width) % self.cols, math.floor(y / self.cell_height) % self.rows
+
+    def insert(self, key, x, y):
+        cell = self.cell_of(x, y)
+        self._where[key] = cell
+        self._cells.setdefault(cell, {})[key] = None
+
+    def move(self, key, x, y):
+        cell = math.floor(x / self.cell_width) % self.cols, math.floor(y / self.cell_height) % self.rows
+        old = self._where.get(key)
+        if old == cell:
+            return
+        if old is not None:
+            del self._cells[old][key]
+        self._where[key] = cell
+        self._cells.setdefault(cell, {})[key] = None
+
+    def remove(self, key):
+        cell = self._where.pop(key, None)
+        if cell is not None:
+            del self._cells[cell][key]
+
+    def clear(self):
+        self._cells.clear()
+        self._where.clear()
+
+    def _span(self, low, high, size, count):
+        first = math.floor(low / size)
+        last = math.floor(high / size)
+        if last - first + 1 >= count:
+            return range(count)
+        return [i % count for i in range(first, last + 1)]
+
+    def query(self, x, y, reach):
+        """
+        :param reach: keys with centres closer than that to (x, y) are guaranteed to be returned
+        """
+        cols = self._span(x - reach, x + reach, self.cell_width, self.cols)
+        rows = self._span(y - reach, y + reach, self.cell_height, self.rows)
+        for col in cols:
+            for row in rows:
+                bucket = self._cells.get((col, row))
+                if bucket:
+                    yield from bucket
+
+
+class BoardIndex:
+    """
+    Spatial index of everything on the board: fruits, walls and snakes' segments.
+    Segments are keyed by (id(snake), i) where i = 0 is the head and i > 0 is tail[i-1].
+    """
+
+    def __init__(self, width, height, cell_size):
+        self.fruits = SpatialHash(width, height, cell_size)
+        self.walls = SpatialHash(width, height, cell_size)
+        self.bodies = SpatialHash(width, height, cell_size)
+        self._objects = {}
+        self._order = {}
+        self._added = 0
+        self._snakes = {}
+        self._max_radius = {self.fruits: 0, self.walls: 0, self.bodies: 0}
+
+    @classmethod
+    def of(cls, state, width, height, cell_size):
+        index = cls(width, height, cell_size)
+        for fruit in state.fruits:
+            index.add_fruit(fruit)
+        for wall in state.walls:
+            index.add_wall(wall)
+        for player in state.players:
+            index.add_snake(player)
+        return index
+
+    def _add(self, grid, key, circle):
+        grid.insert(key, circle.x, circle.y)
+        self._max_radius[grid] = max(self._max_radius[grid], circle.r)
+
+    def _near(self, grid, circle):
+        for key in grid.query(circle.x, circle.y, circle.r + self._max_radius[grid]):
+            yield self._objects[key]
+
+    def _add_object(self, grid, circle):
+        self._objects[id(circle)] = circle
+        self._order[id(circle)] = self._added
+        self._added += 1
+        self._add(grid, id(circle), circle)
+
+    def _remove_object(self, grid, circle):
+        grid.remove(id(circle))
+        self._objects.pop(id(circle), None)
+        self._order.pop(id(circle), None)
+
+    def order(self, circle) -> int:
+        """
+        :return: number of the fruit or wall, growing in order of adding - lists of them are appended to
+                 as they are added, so it sorts them as their list does
+        """
+        return self._order[id(circle)]
+
+    def add_fruit(self, fruit):
+        self._add_object(self.fruits, fruit)
+
+    def remove_fruit(self, fruit):
+        self._remove_object(self.fruits, fruit)
+
+    def fruits_near(self, circle):
+        return self._near(self.fruits, circle)
+
+    def add_wall(self, wall):
+        self._add_object(self.walls, wall)
+
+    def remove_wall(self, wall):
+        self._remove_object(self.walls, wall)
+
+    def walls_near(self, circle):
+        return self._near(self.walls, circle)
+
+    def add_snake(self, snake):
+        self._snakes[id(snake)] = snake
+        self.add_segment(snake, 0)
+        if isinstance(snake.tail, TailArray):
+            for i, (x, y) in enumerate(snake.tail.points(), 1):
+                self.bodies.insert((id(snake), i), x, y)
+            if len(snake.tail):
+                self._max_radius[self.bodies] = max(self._max_radius[self.bodies], snake.tail.radii[:len(snake.tail)].max())
+        else:
+            for i in range(1, len(snake.tail) + 1):
+                self.add_segment(snake, i)
+
+    def add_segment(self, snake, i):
+        segment = snake.tail[i-1] if i else snake
+        self._add(self.bodies, (id(snake), i), segment)
+
+    def move_segment(self, snake, i):
+        segment = snake.tail[i-1] if i else snake
+        self.bodies.move((id(snake), i), segment.x, segment.y)
+
+    def move_tail(self, snake, previous):
+        """
+        Batched move_segment for a TailArray. Only segments which changed their cell are touched.
+        :param previous: positions of the tail before moving (n x 2 array)
+        """
+        grid = self.bodies
+        current = snake.tail.positions[:len(previous)]
+        size = np.array((grid.cell_width, grid.cell_height))
+        counts = np.array((grid.cols, grid.rows))
+        changed = np.nonzero((np.floor(previous / size) % counts != np.floor(current / size) % counts).any(axis=1))[0]
+        for i, (x, y) in zip(changed.tolist(), current[changed].tolist()):
+            grid.move((id(snake), i + 1), x, y)
+
+    def segments_near(self, circle):
+        """
+        :return: pairs (snake, i) - segment i of the snake (0 is the head)
+        """
+        for snake_id, i in self.bodies.query(circle.x, circle.y, circle.r + self._max_radius[self.bodies]):
+            yield self._snakes[snake_id], i
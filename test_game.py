@@ -0,0 +1,411 @@
+# Run as: 'python -m test_game' from this folder
+
+import unittest
+import asyncio
+import copy
+import math
+import random
+import numpy as np
+
+import constants
+constants.Game().board_size = (800, 600)
+constants.LOG.disabled = True
+
+import client
+import dto
+import dto_pb2
+import gameobjects
+import simulation
+import spatialhash
+import torus
+from decisionfunctions import Direction
+from vector import Vector2
+
+def random_game(seed, players=4, array_tails=False, tail=0) -> dto.GameState:
+    """
+    Game with plenty of fruits with powerups and walls, so snakes grow, crush walls and die within seconds
+    :param tail: segments given to every snake at the start, in a straight line behind it
+    """
+    rng = random.Random(seed)
+    st = dto.GameState()
+    constants.Game().array_tails = array_tails
+    try:
+        st.init(players, seed)
+    finally:
+        constants.Game().array_tails = False
+    board = torus.of_size(800, 600)
+    for player in st.players:
+        for i in range(1, tail + 1):
+            x, y = board.wrap(player.x - player.direction.x * i * 2 * player.r, player.y - player.direction.y * i * 2 * player.r)
+            player.tail.append(gameobjects.Tail(x, y, player.r, Vector2(player.direction)))
+    st.fruits += [gameobjects.Fruit.with_powerup(constants.Game().diameter / 2, rng) for _ in range(30)]
+    st.walls = [gameobjects.Wall.at_random_position(constants.Game().diameter, rng=rng) for _ in range(8)]
+    return st
+
+def play(st: dto.GameState, ticks, seed):
+    """ Snakes change their decisions at random every few ticks """
+    rng = random.Random(seed)
+    for _ in range(ticks):
+        if st.tick % 10 == 0:
+            for player in st.alive_players():
+                player.decision = rng.choice([Direction.LEFT, Direction.RIGHT, Direction.FORWARD])
+        simulation.simulate_tick(st)
+
+def values(st: dto.GameState) -> tuple:
+    """ Everything about the game which collisions decide, not quantized """
+    players = [(player.x, player.y, player.alive, dto.tail_rows(player.tail).tolist()) for player in st.players]
+    fruits = [(fruit.x, fruit.y, fruit.powerup) for fruit in st.fruits]
+    walls = [(wall.x, wall.y) for wall in st.walls]
+    return st.tick, st.scores, players, fruits, walls
+
+def chase(head, tail, distance, batched=False) -> list[tuple[float, float]]:
+    """
+    How segments of the tail follow the head which has just moved - each one towards the place its predecessor has
+    just moved to (see gameobjects.Snake.move), or with batched, the one it had before (see gameobjects.TailArray.follow).
+    :return: new positions of segments
+    """
+    board = torus.of_size(800, 600)
+    hypot = np.hypot if batched else math.hypot # they differ in the last bit now and then
+    positions = []
+    prev_x, prev_y, prev_r = head.x, head.y, head.r
+    for t in tail:
+        x, y = t.x, t.y
+        reach = t.r + prev_r
+        if hypot(x - prev_x, y - prev_y) >= reach:
+            dx, dy = board.displacement(x, y, prev_x, prev_y)
+            length = hypot(dx, dy)
+            if length > distance:
+                dx *= distance / length
+                dy *= distance / length
+            new_x, new_y = (x + dx) % board.width, (y + dy) % board.height
+            if hypot(new_x - prev_x, new_y - prev_y) >= reach: # stops before touching it
+                x, y = new_x, new_y
+        positions.append((x, y))
+        prev_x, prev_y, prev_r = (t.x, t.y, t.r) if batched else (x, y, t.r)
+    return positions
+
+def wandering_snake(rng, segments, array_tail=False) -> gameobjects.Snake:
+    """ Snake with a tail wandering around the middle of the board, with segments of different sizes """
+    snake = gameobjects.Snake(400, 300, 15, direction=Vector2(1, 0))
+    snake.tail = gameobjects.TailArray() if array_tail else []
+    x, y = snake.x, snake.y
+    for _ in range(segments):
+        x, y = x + rng.uniform(-20, 20), y + rng.uniform(-20, 20)
+        snake.tail.append(gameobjects.Tail(x, y, rng.uniform(5, 15), Vector2(1, 0)))
+    return snake
+
+class TorusGeometry(unittest.TestCase):
+    def runTest(self):
+        board = torus.of_size(800, 600)
+        self.assertIs(board, torus.of_size(800, 600), "Boards of the same size are not shared")
+        self.assertEqual(board.wrap(-10, 610), (790, 10), "Wrong image on the board")
+        self.assertEqual(board.wrap(800, 0), (0, 0), "Right edge is not glued to the left one")
+        self.assertEqual(board.displacement(790, 10, 10, 590), (20, -20), "Displacement does not cross the edges")
+        self.assertEqual(board.displacement(10, 10, 30, 50), (20, 40), "Displacement crosses the edges")
+        self.assertAlmostEqual(board.distance(795, 300, 5, 300), 10, msg="Distance does not cross the edge")
+        self.assertEqual(board.move_towards(795, 300, 5, 300, 8), (3, 300), "Moved point is not wrapped")
+        self.assertEqual(board.move_towards(795, 300, 5, 300, 100), (5, 300), "Point does not stop at the target")
+        self.assertTrue(board.contains(400, 300, 20), "Circle in the middle is not on the board")
+        self.assertFalse(board.contains(10, 300, 20), "Circle crossing the edge is on the board")
+
+class TorusDisplacements(unittest.TestCase):
+    def runTest(self):
+        board = torus.of_size(800, 600)
+        rng = random.Random(1)
+        points = np.array([(rng.uniform(-100, 900), rng.uniform(-100, 700)) for _ in range(200)])
+        others = np.array([(rng.uniform(0, 800), rng.uniform(0, 600)) for _ in range(200)])
+        offsets = board.displacements(points, others)
+        for (x, y), (other_x, other_y), offset in zip(points.tolist(), others.tolist(), offsets.tolist()):
+            np.testing.assert_allclose(offset, board.displacement(x, y, other_x, other_y), atol=1e-9,
+                                       err_msg="Vectorized displacement differs")
+
+class VisitLikeList(unittest.TestCase):
+    def runTest(self):
+        rng = random.Random(2)
+        for _ in range(300):
+            fruits = [gameobjects.Fruit(rng.randrange(5), 0, 1) for _ in range(rng.randrange(1, 12))] # some equal ones
+            eaten = {id(fruit) for fruit in fruits if rng.random() < 0.5}
+            scanned, visited_by_scan = list(fruits), []
+            for fruit in scanned:
+                visited_by_scan.append(id(fruit))
+                if id(fruit) in eaten:
+                    del scanned[[id(f) for f in scanned].index(id(fruit))]
+            index = spatialhash.BoardIndex(800, 600, 30)
+            for fruit in fruits:
+                index.add_fruit(fruit)
+            left, visited = list(fruits), []
+            for fruit in simulation._visit_like_list(index.fruits_near(gameobjects.Circle(2, 0, 10)), left, index.order):
+                visited.append(id(fruit))
+                if id(fruit) in eaten:
+                    del left[[id(f) for f in left].index(id(fruit))]
+                    index.remove_fruit(fruit)
+            self.assertEqual(visited, visited_by_scan, "Fruits are visited not as in a list scan")
+            self.assertEqual([id(f) for f in left], [id(f) for f in scanned], "Wrong fruits are left")
+
+class BoardIndexLikeListScan(unittest.TestCase):
+    def runTest(self):
+        for seed in range(3):
+            indexed, scanned = random_game(seed), random_game(seed)
+            # a single cell gives every object to every query, as scanning whole lists did
+            scanned._index = spatialhash.BoardIndex.of(scanned, 800, 600, 800)
+            play(indexed, 600, seed)
+            play(scanned, 600, seed)
+            self.assertEqual(values(indexed), values(scanned), f"Game {seed} differs with the list scan")
+
+class TailsFollowHeads(unittest.TestCase):
+    def runTest(self):
+        distance = constants.Game().diameter * constants.Game().speed * constants.TICK_SEC
+        for array_tails in (False, True):
+            for seed in range(3):
+                st = random_game(seed, array_tails=array_tails, tail=30)
+                rng = random.Random(seed)
+                for step in range(300):
+                    for snake in st.players:
+                        if step % 10 == 0:
+                            snake.decision = rng.choice([Direction.LEFT, Direction.RIGHT, Direction.FORWARD])
+                        before = [gameobjects.Circle(t.x, t.y, t.r) for t in snake.tail]
+                        snake.move(distance)
+                        self.assertEqual([(t.x, t.y) for t in snake.tail], chase(snake, before, distance, batched=array_tails),
+                                         f"Tail does not follow its head at step {step}")
+
+class TailBoundsChunks(unittest.TestCase):
+    def runTest(self):
+        rng = random.Random(3)
+        snake = wandering_snake(rng, 100)
+        bounds = gameobjects.TailBounds()
+        for step in range(200):
+            probe = gameobjects.Circle(rng.uniform(0, 800), rng.uniform(0, 600), rng.uniform(5, 40))
+            ranges = list(bounds.chunks_near(snake.tail, probe))
+            covered = {i for segments in ranges for i in segments}
+            touched = {i for i, t in enumerate(snake.tail) if probe.is_colliding_with(t)}
+            self.assertLessEqual(touched, covered, "Touched segments are outside of the chunks near the circle")
+            self.assertTrue(all(a.stop < b.start for a, b in zip(ranges, ranges[1:])), "Neighbouring chunks are not merged")
+            # the tail changes between queries, as it does between ticks
+            if step % 3 == 0:
+                i = rng.randrange(len(snake.tail))
+                snake.tail[i].x, snake.tail[i].y = rng.uniform(0, 800), rng.uniform(0, 600)
+                bounds.moved(i)
+            elif step % 3 == 1:
+                snake.tail.append(gameobjects.Tail(rng.uniform(0, 800), rng.uniform(0, 600), 10, Vector2(1, 0)))
+            else:
+                del snake.tail[-rng.randrange(1, 4):]
+
+class TailArrayCollisions(unittest.TestCase):
+    def runTest(self):
+        for seed in range(20):
+            lists, arrays = wandering_snake(random.Random(seed), 60), wandering_snake(random.Random(seed), 60, True)
+            rng = random.Random(seed)
+            for _ in range(50):
+                probe = gameobjects.Snake(rng.uniform(200, 600), rng.uniform(100, 500), rng.uniform(5, 20))
+                self.assertEqual(probe.is_colliding_with(arrays), probe.is_colliding_with(lists), "Collisions with the snake differ")
+                for i in range(len(lists.tail)):
+                    self.assertEqual(probe.is_colliding_with_segment(arrays, i), probe.is_colliding_with_segment(lists, i),
+                                     f"Collisions with segment {i} differ")
+                start, stop = sorted(rng.sample(range(len(lists.tail) + 1), 2))
+                self.assertEqual(arrays.tail.colliding_with(probe, start, stop),
+                                 any(probe.is_colliding_with(t) for t in lists.tail[start:stop]), "Collisions with a part of the tail differ")
+            self.assertEqual(arrays.is_colliding_with(arrays), lists.is_colliding_with(lists), "Collisions with own tail differ")
+
+class ProtobufRoundTrip(unittest.TestCase):
+    def runTest(self):
+        st = random_game(4)
+        play(st, 300, 4)
+        st.numbering, st.timestamp = 17, 1234.5
+        data = st.serialize()
+        decoded = dto.GameState.deserialize(data)
+        for name in ["tick", "seed", "numbering", "entities_version", "current_speed", "timestamp", "scores"]:
+            self.assertEqual(getattr(decoded, name), getattr(st, name), f"Wrong {name}")
+        self.assertAlmostEqual(decoded.time_passed, st.time_passed, places=4, msg="Wrong time_passed")
+        self.assertTrue(any(snake.alive for snake in st.players) and any(snake.powerups for snake in st.players), "Game is too short")
+        for snake, other in zip(decoded.players, st.players):
+            self.assertEqual((snake.decision, snake.alive, snake.rotation_power, list(snake.color), len(snake.tail)),
+                             (other.decision, other.alive, other.rotation_power, list(other.color), len(other.tail)), "Wrong snake")
+            self.assertEqual(snake.powerups.keys(), other.powerups.keys(), "Wrong powerups")
+        self.assertEqual([fruit.powerup for fruit in decoded.fruits], [fruit.powerup for fruit in st.fruits], "Wrong fruits")
+        np.testing.assert_allclose([(fruit.x, fruit.y) for fruit in decoded.fruits], [(fruit.x, fruit.y) for fruit in st.fruits],
+                                   atol=1e-3, err_msg="Wrong positions of fruits")
+        self.assertEqual(len(decoded.walls), len(st.walls), "Wrong walls")
+        self.assertEqual(dto_pb2.GameState.FromString(decoded.serialize()), dto_pb2.GameState.FromString(data),
+                         "Decoded state is encoded differently")
+
+class SnapshotDeltas(unittest.TestCase):
+    def runTest(self):
+        st = random_game(3, tail=12)
+        rng = random.Random(3)
+        history = {}
+        received = dto.SnapshotBaselines()
+        acked = None
+        sizes = []
+        for _ in range(200):
+            long_tails = [snake.tail for snake in st.players if len(snake.tail) > 5]
+            if long_tails and rng.random() < 0.3: # only a few segments change
+                for segment in rng.sample(rng.choice(long_tails), 2):
+                    segment.x, segment.y = torus.of_size(800, 600).wrap(segment.x + rng.uniform(-5, 5), segment.y + rng.uniform(-5, 5))
+            else:
+                play(st, rng.randint(1, 3), rng.random())
+            st.numbering += 1
+            snapshot = dto.Snapshot(st)
+            history[snapshot.numbering] = snapshot
+            baseline = history.get(acked)
+            data = st.serialize_delta(snapshot, baseline) if baseline else st.serialize()
+            if rng.random() < 0.3: # lost
+                continue
+            decoded = received.decode(data)
+            self.assertIsNotNone(decoded, "Delta against an acknowledged snapshot is not decoded")
+            self.assertEqual(dto_pb2.GameState.FromString(decoded.serialize()), dto_pb2.GameState.FromString(st.serialize()),
+                             f"Snapshot {st.numbering} against {acked} differs from the full state")
+            if baseline:
+                sizes.append((len(data), len(st.serialize())))
+            if rng.random() < 0.7: # acknowledgement lost otherwise
+                acked = st.numbering
+        self.assertGreater(len(sizes), 50, "Too few deltas")
+        self.assertLess(sum(delta for delta, _ in sizes), sum(full for _, full in sizes), "Deltas are not smaller")
+        unknown = st.serialize_delta(dto.Snapshot(st), history[1])
+        self.assertIsNone(dto.SnapshotBaselines().decode(unknown), "Delta against an unknown snapshot is decoded")
+
+class SnapshotBaselinesEviction(unittest.TestCase):
+    def runTest(self):
+        st = random_game(5)
+        received = dto.SnapshotBaselines(size=8)
+        rng = random.Random(5)
+        for _ in range(300):
+            st.numbering += rng.randint(1, 7) # lost or skipped ones in between
+            received.decode(st.serialize())
+            self.assertLessEqual(len(received._packed), received.size, "Old snapshots are kept")
+        self.assertIn(st.numbering, received._packed, "Last snapshot is not kept")
+
+class Quantization(unittest.TestCase):
+    def runTest(self):
+        board_size = (800, 600)
+        steps = dto.QUANTIZATION_STEPS
+        rng = random.Random(6)
+        for _ in range(1000):
+            x, y = rng.uniform(0, 800), rng.uniform(0, 600)
+            qx, qy = dto.quantize_position(x, y, board_size)
+            self.assertTrue(0 <= qx < steps and 0 <= qy < steps, "Quantized position does not fit in 16 bits")
+            back_x, back_y = dto.dequantize_position(qx, qy, board_size)
+            self.assertLessEqual(abs(back_x - x), 800 / steps / 2, "Position is off by more than half a step")
+            self.assertLessEqual(abs(back_y - y), 600 / steps / 2, "Position is off by more than half a step")
+            self.assertEqual(dto.quantize_position(back_x, back_y, board_size), (qx, qy), "Quantized position changes")
+            self.assertEqual(dto.quantize_position(x - 800, y + 600, board_size), (qx, qy), "Image off the board is not the same")
+            direction = Vector2(1, 0).rotate(rng.uniform(-360, 360))
+            angle = dto.quantize_angle(direction)
+            self.assertTrue(0 <= angle < steps, "Quantized angle does not fit in 16 bits")
+            back = dto.dequantize_angle(angle)
+            self.assertLessEqual(direction.distance_to(back), math.tau / steps / 2, "Direction is off by more than half a step")
+            self.assertEqual(dto.quantize_angle(back), angle, "Quantized angle changes")
+        snake = wandering_snake(rng, 50)
+        rows = dto.tail_rows(snake.tail)
+        points = dto.quantize_tail(rows, board_size)
+        self.assertEqual(points.dtype, dto.QUANTIZED, "Wrong type of quantized tails")
+        self.assertEqual(points.tolist(), [list(dto.quantize_position(t.x, t.y, board_size)) for t in snake.tail],
+                         "Vectorized quantization differs")
+        np.testing.assert_allclose(dto.dequantize_tail(points, board_size), rows[:, :2], atol=800 / steps / 2,
+                                   err_msg="Tail is off by more than half a step")
+
+class TrailEncoding(unittest.TestCase):
+    def runTest(self):
+        rng = random.Random(7)
+        steps = dto.QUANTIZATION_STEPS
+        self.assertEqual(dto.trail_points(dto.trail_of(np.zeros((0, 2), dto.QUANTIZED))).shape, (0, 2), "Empty tail is not empty")
+        for length in (1, 2, 3, 50, 300):
+            # a path crossing the edges of the board, with a few jumps
+            x, y = rng.randrange(steps), rng.randrange(steps)
+            points = []
+            for _ in range(length):
+                jump = rng.random() < 0.05
+                x = (x + (rng.randrange(steps) if jump else rng.randint(-300, 300))) % steps
+                y = (y + (rng.randrange(steps) if jump else rng.randint(-300, 300))) % steps
+                points.append((x, y))
+            points = np.array(points, dto.QUANTIZED)
+            trail = dto.trail_of(points)
+            self.assertEqual(len(trail), 2 * length, "Wrong length of the trail")
+            decoded = dto.trail_points(trail)
+            self.assertEqual(decoded.dtype, dto.QUANTIZED, "Wrong type of decoded tails")
+            self.assertEqual(decoded.tolist(), points.tolist(), f"Tail of {length} segments changes")
+        # segments following the head's path take about 2 bytes as zigzag varints
+        st = random_game(8, tail=100)
+        play(st, 30, 8)
+        packed = dto_pb2.Snake()
+        packed.trail.extend(dto.trail_of(dto.quantize_tail(dto.tail_rows(st.players[0].tail), (800, 600))))
+        self.assertLess(packed.ByteSize(), 3 * len(st.players[0].tail), "Trail is too long")
+
+class SnapshotRateControl(unittest.TestCase):
+    def runTest(self):
+        period = 0.05
+        rate = simulation.SnapshotRate(budget=10000) # 500 bytes per snapshot
+        self.assertEqual([rate.due() for _ in range(3)], [True] * 3, "Snapshots are skipped at the start")
+        # (time, loss, queued bytes) -> interval after the snapshot
+        script = [(1.0, 0.2, 0, 2), (1.5, 0.2, 0, 2), (2.0, None, 20000, 4), (3.0, 0.5, 0, 4), # backs off once per HOLD
+                  (3.5, 0.0, 0, 3), (4.0, None, 0, 3), (4.5, 0.05, 100, 2), (5.5, 0.0, 0, 1), (6.5, 0.0, 0, 1)] # recovers
+        for now, loss, queued, interval in script:
+            rate.sent(200, period, loss, queued, now)
+            self.assertEqual(rate.interval, interval, f"Wrong interval at {now} s")
+        self.assertEqual(rate.backoffs, 2, "Wrong number of backoffs")
+        rate = simulation.SnapshotRate(budget=10000)
+        rate.sent(1500, period, 0.0, 0, 0.0)
+        self.assertEqual(rate.interval, 3, "Interval does not keep snapshots within the budget")
+        self.assertEqual([rate.due() for _ in range(7)], [True, False, False, True, False, False, True], "Wrong snapshots skipped")
+        self.assertEqual(rate.skipped, 4, "Wrong number of skipped snapshots")
+        rate.sent(50000, period, 0.0, 0, 0.5)
+        self.assertEqual(rate.interval, simulation.SnapshotRate.MAX_INTERVAL, "Interval is longer than the maximum")
+        rate.due()
+        for now in range(1, 40):
+            rate.sent(100, period, 0.0, 0, now)
+        self.assertEqual(rate.interval, 1, "Interval does not recover as snapshots get smaller")
+        self.assertTrue(rate.due() and rate.due(), "Snapshots are skipped after the recovery")
+
+class MatchBoards(unittest.IsolatedAsyncioTestCase):
+    async def runTest(self):
+        matches = []
+        try:
+            for size in ((240, 180), (1600, 900)): # the last one is left in constants.Game().board_size
+                constants.Game().board_size = size
+                st = dto.GameState()
+                st.init(2, 5)
+                st.time_passed = 1.01 # after ready go
+                matches.append(simulation.HostedMatch(st, str(size)))
+            outside = []
+            async def watch():
+                while True:
+                    await asyncio.sleep(0.01)
+                    for match in matches:
+                        width, height = match.board_size
+                        outside.extend((match.name, player.x, player.y) for player in match.game_state.players
+                                       if not (0 <= player.x < width and 0 <= player.y < height))
+            with self.assertRaises(TimeoutError):
+                await asyncio.wait_for(asyncio.gather(*[simulation.solo_host_game(match) for match in matches], watch()), 1.5)
+        finally:
+            constants.Game().board_size = (800, 600)
+        self.assertGreater(matches[0].game_state.tick, 0, "Match has not been played")
+        self.assertEqual(outside, [], "Snakes left the board of their match")
+
+class PredictionRebase(unittest.TestCase):
+    def runTest(self):
+        host = random_game(11)
+        host.time_passed = 1.0 # after ready go
+        play(host, 20, 3)
+        snapshot = host.serialize()
+        history = client.PredictionHistory()
+        prediction = client.rebase(dto.GameState.deserialize(snapshot), history, 10, 5)
+        self.assertEqual(prediction.tick, 25, "Snapshot ahead of the prediction is not played ahead by the lead")
+        expected = dto.GameState.deserialize(snapshot)
+        for _ in range(5):
+            simulation.simulate_tick(expected)
+        self.assertEqual(values(prediction), values(expected), "Prediction ahead of the snapshot differs from the game")
+        # snapshot behind the prediction - own inputs host had not known are replayed up to the prediction's tick
+        played = values(expected)
+        expected = dto.GameState.deserialize(snapshot)
+        player = next(expected.alive_players())
+        history.record_input(22, player.color, Direction.LEFT)
+        prediction = client.rebase(dto.GameState.deserialize(snapshot), history, 25, 5)
+        self.assertEqual(prediction.tick, 25, "Snapshot behind the prediction is played further than the prediction")
+        for _ in range(5):
+            if expected.tick == 22:
+                player.decision = Direction.LEFT
+            simulation.simulate_tick(expected)
+        self.assertEqual(values(prediction), values(expected), "Own inputs are not replayed")
+        self.assertNotEqual(values(prediction), played, "Own input has not changed anything")
+
+if __name__ == '__main__':
+    unittest.main()
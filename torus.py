@@ -0,0 +1,80 @@
+# Geometry of the board - its opposite edges are glued together, so it is a torus.
+# Does not depend on pygame, so it can be used by headless simulations too.
+
+import math
+import numpy as np
+
+class Torus:
+    """
+    Board of given dimensions. Points are (x, y) pairs, the ones on the board are in [0, width) x [0, height).
+    """
+
+    def __init__(self, width, height):
+        self.width = width
+        self.height = height
+        self.half_width = width / 2
+        self.half_height = height / 2
+        self.size = np.array((width, height), dtype=float)
+
+    def __repr__(self):
+        return f"Torus({self.width}, {self.height})"
+
+    def wrap(self, x, y) -> tuple[float, float]:
+        return x % self.width, y % self.height
+
+    def contains(self, x, y, r=0) -> bool:
+        """ Whether the circle fits in the board without crossing its edges """
+        return r <= x <= self.width - r and r <= y <= self.height - r
+
+    def displacement(self, x1, y1, x2, y2) -> tuple[float, float]:
+        """ Shortest vector from (x1, y1) to the nearest image of (x2, y2) """
+        dx = x2 - x1
+        dy = y2 - y1
+        if dx > self.half_width:
+            dx -= self.width
+        elif dx < -self.half_width:
+            dx += self.width
+        if dy > self.half_height:
+            dy -= self.height
+        elif dy < -self.half_height:
+            dy += self.height
+        return dx, dy
+
+    def distance(self, x1, y1, x2, y2) -> float:
+        return math.hypot(*self.displacement(x1, y1, x2, y2))
+
+    def move_towards(self, x, y, x2, y2, distance) -> tuple[float, float]:
+        """
+        Moves (x, y) by distance towards the nearest image of (x2, y2), stopping at it.
+        :return: new position, wrapped to the board
+        """
+        dx, dy = self.displacement(x, y, x2, y2)
+        length = math.hypot(dx, dy)
+        if length > distance:
+            dx *= distance / length
+            dy *= distance / length
+        return (x + dx) % self.width, (y + dy) % self.height
+
+    def random_point(self, rng, margin=0.0) -> tuple[float, float]:
+        """
+        :param rng: source of randomness (random.Random or random module itself)
+        :param margin: part of the board's width/height kept free at each edge
+        """
+        x = rng.random() * self.width * (1 - 2 * margin) + self.width * margin
+        y = rng.random() * self.height * (1 - 2 * margin) + self.height * margin
+        return x, y
+
+    def displacements(self, points, others) -> np.ndarray:
+        """ Vectorized displacement for arrays of points (last axis is x, y) """
+        offset = others - points
+        offset -= self.size * np.round(offset / self.size)
+        return offset
+
+_tori: dict[tuple, Torus] = {}
+
+def of_size(width, height) -> Torus:
+    """ Shared Torus of given dimensions """
+    board = _tori.get((width, height))
+    if board is None:
+        board = _tori[(width, height)] = Torus(width, height)
+    return board
@@ -0,0 +1,123 @@
+# 2D vector for the simulation, so the host does not need pygame (see host.py).
+# It follows pygame.Vector2's formulas (results may differ from it in the last bits, so the host and its clients
+# have to use the same one) and pygame's functions accept it wherever they take a pair of numbers.
+
+import math
+
+class Vector2:
+    EPSILON = 1e-6 # same as pygame.Vector2's default - vectors closer than that are equal
+
+    __slots__ = ("x", "y")
+
+    def __init__(self, x=0.0, y=None):
+        if y is None:
+            if isinstance(x, (int, float)):
+                y = x
+            else:
+                x, y = x
+        self.x = float(x)
+        self.y = float(y)
+
+    def __repr__(self):
+        return f"<Vector2({self.x}, {self.y})>"
+
+    def __str__(self):
+        return f"[{self.x}, {self.y}]"
+
+    def __len__(self):
+        return 2
+
+    def __iter__(self):
+        yield self.x
+        yield self.y
+
+    def __getitem__(self, key):
+        return (self.x, self.y)[key]
+
+    def __bool__(self):
+        return self.x != 0 or self.y != 0
+
+    def __eq__(self, other):
+        try:
+            x, y = other
+        except (TypeError, ValueError):
+            return NotImplemented
+        return abs(self.x - x) < self.EPSILON and abs(self.y - y) < self.EPSILON
+
+    __hash__ = None # mutable, like pygame.Vector2
+
+    def __add__(self, other):
+        x, y = other
+        return Vector2(self.x + x, self.y + y)
+
+    __radd__ = __add__
+
+    def __sub__(self, other):
+        x, y = other
+        return Vector2(self.x - x, self.y - y)
+
+    def __rsub__(self, other):
+        x, y = other
+        return Vector2(x - self.x, y - self.y)
+
+    def __neg__(self):
+        return Vector2(-self.x, -self.y)
+
+    def __mul__(self, other):
+        if isinstance(other, (int, float)):
+            return Vector2(self.x * other, self.y * other)
+        return self.dot(other)
+
+    __rmul__ = __mul__
+
+    def __truediv__(self, other):
+        return Vector2(self.x / other, self.y / other)
+
+    def copy(self) -> "Vector2":
+        return Vector2(self.x, self.y)
+
+    def dot(self, other) -> float:
+        x, y = other
+        return self.x * x + self.y * y
+
+    def length(self) -> float:
+        return math.sqrt(self.x * self.x + self.y * self.y)
+
+    def length_squared(self) -> float:
+        return self.x * self.x + self.y * self.y
+
+    def distance_to(self, other) -> float:
+        x, y = (other.x, other.y) if isinstance(other, Vector2) else other # unpacking is slower, it is called a lot
+        return math.hypot(self.x - x, self.y - y)
+
+    def distance_squared_to(self, other) -> float:
+        x, y = (other.x, other.y) if isinstance(other, Vector2) else other
+        dx = self.x - x
+        dy = self.y - y
+        return dx * dx + dy * dy
+
+    def normalize(self) -> "Vector2":
+        length = self.length()
+        if length == 0:
+            raise ValueError("Can't normalize Vector of length zero")
+        return Vector2(self.x / length, self.y / length)
+
+    def rotate(self, angle) -> "Vector2":
+        """ :param angle: in degrees """
+        angle = math.fmod(angle, 360.0)
+        if angle < 0:
+            angle += 360.0
+        # exact results for right angles
+        if math.fmod(angle + self.EPSILON, 90.0) < 2 * self.EPSILON:
+            quarter = int((angle + self.EPSILON) / 90) % 4
+            if quarter == 0:
+                return Vector2(self.x, self.y)
+            if quarter == 1:
+                return Vector2(-self.y, self.x)
+            if quarter == 2:
+                return Vector2(-self.x, -self.y)
+            return Vector2(self.y, -self.x)
+        angle = angle * math.pi / 180.0
+        sin = math.sin(angle)
+        cos = math.cos(angle)
+        return Vector2(cos * self.x - sin * self.y, sin * self.x + cos * self.y)
@@ -5,9 +5,56 @@ import gameobjects
 import constants
 import gamenetwork as net
 import pygameview
+import pygameutils
+import math
+from config import Config
 import time
 import utils
 import asyncio
+import random
+from simulation import *
+
+def draw_circle(circle: gameobjects.Circle, sprite: pygame.Surface = None):
+    """
+    :param sprite: drawn instead of the default one (see sprite_of)
+    """
+    if sprite is None:
+        sprite = sprite_of(circle)
+    pygame.display.get_surface().blit(sprite, (circle.x - circle.r, circle.y - circle.r))
+
+def sprite_of(circle: gameobjects.Circle) -> pygame.Surface:
+    """ Shared between all circles of the same look - do not draw on it """
+    return pygameutils.circle_sprite(circle.r, circle.color, circle.outline_width)
+
+def draw_snake(snake: gameobjects.Snake):
+    if snake.powerups:
+        draw_snake_with_timer(snake)
+        return
+    draw_circle(snake)
+    for t in snake.tail:
+        draw_circle(t)
+
+def draw_snake_with_timer(snake: gameobjects.Snake):
+    for powerup, time in sorted(list(snake.powerups.items()), key=lambda x: x[1], reverse=True):
+        num_of_segments = len(snake.tail) + 1
+        segments_to_color = time
+        fully_colored = int(math.floor(segments_to_color))
+        rest = segments_to_color - fully_colored
+        segments = [snake, *snake.tail]
+        for segment, percentage in zip(segments, fully_colored * [1] + [rest] + (num_of_segments - fully_colored - 1) * [0]):
+            painted = pygameutils.paint_surface(sprite_of(segment), powerup.value, percentage, -pygame.Vector2(segment.direction))
+            draw_circle(segment, painted)
+
+def draw_direction(snake: gameobjects.Snake):
+    WIDTH = int(snake.r / 4)
+    direction = pygame.Vector2(snake.direction)
+    start_point = pygame.Vector2(snake) + direction * snake.r * 2
+    end_point = start_point + direction * snake.r * 2
+    right_arrow = end_point + direction.rotate(150) * snake.r
+    left_arrow = end_point + direction.rotate(-150) * snake.r
+    pygame.draw.line(pygame.display.get_surface(), snake.color, start_point, end_point, WIDTH)
+    pygame.draw.line(pygame.display.get_surface(), snake.color, end_point, right_arrow, WIDTH)
+    pygame.draw.line(pygame.display.get_surface(), snake.color, end_point, left_arrow, WIDTH)
 
 def draw_board(state: dto.GameState):
         pygame.display.get_surface().fill(constants.Color.black)
@@ -17,11 +64,11 @@ def draw_board(state: dto.GameState):
         
         # draw game objects
         for player in state.alive_players():
-            player.draw()
+            draw_snake(player)
         for fruit in state.fruits:
-            fruit.draw()
+            draw_circle(fruit)
         for wall in state.walls:
-            wall.draw()
+            draw_circle(wall)
 
         # draw wall
         WALL_WIDTH = 2
@@ -41,7 +88,7 @@ def draw_board(state: dto.GameState):
         # draw arrows for 1st 2 seconds
         if state.time_passed < 2:
             for player in state.alive_players():
-                player.draw_direction()
+                draw_direction(player)
 
 def show_scores(scores, names) -> pygameview.common.PauseView:
     end_phrase = "GAME OVER\n"
@@ -50,102 +97,28 @@ def show_scores(scores, names) -> pygameview.common.PauseView:
         end_phrase += f"{name}: {score}\n"
     return pygameview.common.PauseView(end_phrase)
 
-def game_loop(st: dto.GameState, delta: float, add_new_entities=True):
-    """
-    :return: list of sounds' names to play after
-    """
-    screen_rect = constants.Game().screen_rect or pygame.display.get_surface().get_rect()
-    sounds = []
-    fruits_to_add = 0
-    wall_to_add = 0
-
-    if delta <= 0:
-        constants.LOG.debug("Delta is non-positive")
-
-    for idx, player in st.enumerate_alive_players():
-        player.move(constants.Game().diameter * st.current_speed * delta)
-        # region COLLISION_CHECK
-        # with fruits
-        for fruit in st.fruits:
-            if fruit.is_colliding_with(player):
-                if fruit.powerup == constants.Powerup.WALL_WALKING:
-                    st.wall_walking_event_timer += constants.POWERUP_TIMES[constants.Powerup.WALL_WALKING]
-                if fruit.powerup == constants.Powerup.CRUSHING:
-                    st.wall_walking_event_timer += constants.POWERUP_TIMES[constants.Powerup.CRUSHING]
-                player.consume(fruit)
-                st.fruits.remove(fruit)
-                fruits_to_add += 1
-                if fruit.powerup == constants.Powerup.CRUSHING:
-                    sounds.append("bless")
-                st.scores[idx] += 1
-        # with walls
-        for wall in st.walls:
-            if wall.is_colliding_with(player):
-                if constants.Powerup.CRUSHING in player.powerups:
-                    sounds.append("crush")
-                    st.walls.remove(wall)
-                elif constants.Powerup.GHOSTING not in player.powerups:
-                    player.died()
-                    constants.LOG.info(f"Player {idx+1} clashed with wall")
-        # with borders
-        if not screen_rect.contains(player.get_rect()):
-            if st.wall_walking_event_timer == 0 and constants.Powerup.GHOSTING not in player.powerups:
-                player.died()
-                constants.LOG.info(f"Player {idx+1} got out of border")
-            else:
-                player.x = (player.x + screen_rect.width) % screen_rect.width
-                player.y = (player.y + screen_rect.height) % screen_rect.height
-        # with tail
-        for pl in st.alive_players():
-            if player.is_colliding_with(pl) and not (constants.Powerup.GHOSTING in player.powerups or constants.Powerup.GHOSTING in pl.powerups):
-                player.died()
-                constants.LOG.info(f"Player {idx+1} clashed with sb's tail")
-        # endregion
-
-    # update time counter
-    for player in st.alive_players():
-        player.update_timer(delta)
-    st.time_passed += delta
-    st.fruit_event_timer += delta
-    st.wall_walking_event_timer = max(0, st.wall_walking_event_timer - delta)
-    if st.fruit_event_timer > 5:
-        fruits_to_add += 1
-        st.fruit_event_timer = 0
-    if constants.Game().time_limit and st.time_passed > constants.Game().time_limit:
-        st.wall_event_timer += delta
-        if st.wall_event_timer > (constants.Game().time_limit**2) / (st.time_passed**2):
-            wall_to_add += 1
-            st.wall_event_timer = 0
-
-    # something to make it more fun!
-    st.current_speed = constants.Game().speed + 2 * int(1 + st.time_passed / 10)
-    for player in st.alive_players():
-        player.rotation_power = constants.Game().rotation_power + int(st.time_passed / 10)
-    
-    if add_new_entities:
-        for _ in range(fruits_to_add):
-            st.fruits.append(gameobjects.Fruit.with_powerup(constants.Game().diameter / 2))
-        for _ in range(wall_to_add):
-            st.walls.append(gameobjects.Wall.at_random_position(constants.Game().diameter))
-
-    return sounds
-
 class GameView(pygameview.PyGameView):
 
-    def __init__(self, game_state: dto.GameState):
+    def __init__(self, game_state: dto.GameState, match: HostedMatch = None):
+        """ :param match: of the host, whose clients' controls are applied every tick """
         self.state = game_state
+        self.match = match
+        self.timestep = FixedTimestep()
 
     def update(self, delta):
-        sounds = game_loop(self.state, delta)
-        constants.LOG.debug("HEY")
+        for snake, function in zip(self.state.players[:Config().number_of_players], Config().control_functions):
+            snake.decision = function()
+
+        sounds = []
+        for _ in range(self.timestep.advance(delta)):
+            if self.match:
+                self.match.apply_controls()
+            sounds += simulate_tick(self.state)
 
         draw_board(self.state)
         for sound in sounds:
             pygame.mixer.Sound(f"sound/{sound}.mp3").play(maxtime=constants.SOUND_MAXTIME[sound])
 
-        for snake, function in zip(self.state.players[:dto.Config().number_of_players], dto.Config().control_functions):
-            snake.decision = function()
-
         if self.state.all_players_dead():
             pygameview.close_view()
 
@@ -157,7 +130,7 @@ class GameView(pygameview.PyGameView):
             pygameview.set_view(pygameview.common.PauseView("PAUSED", self))
 
     async def do_async(self):
-        net.send_udp("game", self.state.serialize())
+        net.send_udp("game", self.state.serialize(), latest_only=True)
 
 class ReadyGoView(pygameview.PyGameView):
 
@@ -178,7 +151,7 @@ class ReadyGoView(pygameview.PyGameView):
             pygameview.set_view(self.next_view)
 
     async def do_async(self):
-        net.send_udp("game", self.state.serialize())
+        net.send_udp("game", self.state.serialize(), latest_only=True)
 
 class LobbyView(pygameview.PyGameView):
 
@@ -209,55 +182,3 @@ class LobbyView(pygameview.PyGameView):
 
     async def do_async(self):
         net.send_udp("lobby", self.players)
-
-
-SEND_UDP = True
-
-async def send_game_state(game_state: dto.GameState):
-    while True:
-        game_state.timestamp = time.time()
-        game_state.numbering += 1
-        if SEND_UDP:
-            net.send_udp("game", game_state.serialize())
-        else:
-            net.send("game", game_state.serialize())
-        await asyncio.sleep(constants.NETWORK_GAME_LATENCY / 1000)
-
-next_controls = []
-
-def add_control(player: gameobjects.Snake, direction: int, time_passed: float):
-    global next_controls
-    next_controls.append((player, direction, time_passed))
-
-async def solo_host_game(game_state: dto.GameState):
-    clock = pygameview.AsyncClock()
-    FPS = pygameview.DEFAULT_FPS
-    send_state_task = asyncio.create_task(send_game_state(game_state))
-
-    # ready go
-    while game_state.time_passed <= 1:
-        delta = await clock.tick(FPS)
-        game_state.time_passed += delta
-
-    # game loop
-    while True:
-
-        prev_time_passed = game_state.time_passed
-        delta = await clock.tick(FPS)
-        
-        global next_controls
-        next_controls = [(a,b,c) for a,b,c in next_controls if c > game_state.time_passed - delta]
-        for player, direction, time_passed in next_controls:
-            if time_passed <= prev_time_passed:
-                player.decision = direction
-
-        game_loop(game_state, delta)
-
-
-
-        if game_state.time_passed < prev_time_passed:
-            constants.LOG.error("Time passed decreased")
-
-        if game_state.all_players_dead():
-            send_state_task.cancel()
-            return
\ No newline at end of file